@@ -0,0 +1,162 @@
+"""In-process stand-ins for Gemini and SerpAPI used by the benchmark harness.
+
+Database access goes to the SQLite repository backend instead (DB_BACKEND=sqlite).
+`install()` must run before `main` is imported: the Gemini client is only built on first
+use, but `analysis_search` binds `GoogleSearch` at import.
+"""
+import asyncio
+import io
+import json
+import math
+import random
+import time
+import uuid
+from PIL import Image
+
+
+class Latency:
+    """Log-normal latency given as median and p95 milliseconds ("median:p95", or one number for a fixed delay)."""
+
+    def __init__(self, median_ms: float, p95_ms: float = None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms if p95_ms is not None else median_ms
+        # p95 of a log-normal sits 1.645 sigma above the median
+        self.sigma = math.log(self.p95_ms / self.median_ms) / 1.645 if self.median_ms > 0 and self.p95_ms > self.median_ms else 0.0
+
+    @classmethod
+    def parse(cls, value: str) -> "Latency":
+        if ":" in value:
+            median, p95 = value.split(":", 1)
+            return cls(float(median), float(p95))
+        return cls(float(value))
+
+    def sample(self) -> float:
+        """Seconds."""
+        if self.median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_ms), self.sigma) / 1000
+
+    def describe(self) -> str:
+        return f"{self.median_ms:g}:{self.p95_ms:g}"
+
+
+def noise_image(edge: int, fmt: str = "PNG") -> bytes:
+    """Random-pixel image; noise does not compress, so encoded size tracks the edge length."""
+    img = Image.frombytes("RGB", (edge, edge), random.randbytes(edge * edge * 3))
+    out = io.BytesIO()
+    img.save(out, format=fmt)
+    return out.getvalue()
+
+
+# --- Gemini ---
+
+class FakeModels:
+    def __init__(self, latency: Latency, image_bytes: bytes, text_chars: int):
+        self.latency = latency
+        self.image_bytes = image_bytes
+        self.text_chars = text_chars
+        self.calls = 0
+
+    def _response(self, model: str, config):
+        from google.genai import types
+
+        modalities = getattr(config, "response_modalities", None) or []
+        if "IMAGE" in modalities:
+            parts = [
+                types.Part.from_bytes(data=self.image_bytes, mime_type="image/png"),
+                types.Part(text=("A calm, well lit redesign. " * (self.text_chars // 27 + 1))[:self.text_chars]),
+            ]
+        else:
+            parts = [types.Part(text=json.dumps({
+                "description": "Scandinavian living room with light oak and linen textures.",
+                "search_queries": [
+                    {"name": "Sofa", "query": "linen sofa beige"},
+                    {"name": "Coffee table", "query": "oak coffee table round"},
+                    {"name": "Floor lamp", "query": "arc floor lamp black"},
+                ],
+            }))]
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts))]
+        )
+
+    async def get(self, model: str, config=None):
+        from google.genai import types
+        return types.Model(name=f"models/{model}")
+
+    async def generate_content(self, model: str, contents, config=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        return self._response(model, config)
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        self.calls += 1
+        response = self._response(model, config)
+        delay = self.latency.sample()
+
+        async def chunks():
+            from google.genai import types
+            parts = response.candidates[0].content.parts
+            for part in parts:
+                await asyncio.sleep(delay / len(parts))
+                yield types.GenerateContentResponse(
+                    candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))]
+                )
+        return chunks()
+
+
+class FakeAio:
+    def __init__(self, models):
+        self.models = models
+
+    async def aclose(self):
+        pass
+
+
+class FakeGenaiClient:
+    """Replaces google.genai.Client; only the async models API is used by the routers."""
+
+    models_impl = None
+
+    def __init__(self, *args, **kwargs):
+        self.aio = FakeAio(FakeGenaiClient.models_impl)
+        self.models = FakeGenaiClient.models_impl
+
+
+# --- SerpAPI ---
+
+class FakeGoogleSearch:
+    latency = Latency(0)
+    calls = 0
+
+    def __init__(self, params: dict):
+        self.params = params
+
+    def get_dict(self) -> dict:
+        FakeGoogleSearch.calls += 1
+        time.sleep(FakeGoogleSearch.latency.sample())
+        query = self.params.get("q", "")
+        return {"shopping_results": [
+            {
+                "title": f"{query} #{idx}",
+                "product_link": f"https://shop.example/{uuid.uuid4().hex[:8]}",
+                "price": f"{random.randint(50, 900)}.00",
+                "source": "Example Shop",
+                "thumbnail": "https://shop.example/thumb.jpg",
+            }
+            for idx in range(self.params.get("num", 3))
+        ]}
+
+
+def install(gemini_latency: Latency, serpapi_latency: Latency, image_edge: int, text_chars: int) -> dict:
+    """Patches the SDK entry points the routers import; returns the fakes for seeding and counters."""
+    import google.genai
+    import serpapi
+
+    models = FakeModels(gemini_latency, noise_image(image_edge), text_chars)
+    FakeGenaiClient.models_impl = models
+    google.genai.Client = FakeGenaiClient
+
+    FakeGoogleSearch.latency = serpapi_latency
+    serpapi.GoogleSearch = FakeGoogleSearch
+
+    return {"models": models, "search": FakeGoogleSearch}
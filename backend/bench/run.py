@@ -0,0 +1,316 @@
+"""Offline load test of the API with Gemini and SerpAPI replaced by local fakes and the database on SQLite.
+
+Requests are driven in-process through httpx's ASGI transport, so numbers reflect the
+app itself (parsing, preprocessing, encoding, event-loop blocking) plus the configured
+fake upstream latencies. Results are written as JSON that can be diffed between commits.
+
+Usage (from backend/):
+    python -m bench.run [--scenario try_on] [--concurrency 1,8,32] [--requests 40] [--out bench/results.json]
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from bench import fakes
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is KB on Linux, bytes on macOS; only a fallback for non-Linux hosts
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, current_rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = current_rss_bytes()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return max(self.peak, current_rss_bytes())
+
+
+# --- Scenarios: each returns the kwargs for one httpx request ---
+
+def try_on_request(ctx: dict, unique: bool = True) -> dict:
+    return {
+        "method": "POST",
+        "url": "/api/try-on",
+        "data": {
+            "design_type": "interior",
+            "room_type": "living room",
+            "style": "scandinavian",
+            "background_color": "#f5f1ea",
+            "foreground_color": "#2d3a3a",
+            # A distinct instruction per request keeps every call off the result cache
+            "instructions": uuid.uuid4().hex if unique else "",
+            "session_id": "bench",
+        },
+        "files": {"place_image": ("room.jpg", ctx["upload"], "image/jpeg")},
+        "headers": {"Accept": ctx["accept"]},
+    }
+
+
+def place_furniture_request(ctx: dict) -> dict:
+    return {
+        "method": "POST",
+        "url": "/api/place-furniture",
+        "data": {"session_id": "bench", "furniture_descriptions": "armchair"},
+        "files": [("furniture_images", ("chair.png", ctx["furniture"], "image/png"))],
+        "headers": {"Accept": ctx["accept"]},
+    }
+
+
+def analyze_request(ctx: dict, unique: bool = True) -> dict:
+    # A different photo per request keeps every call off the perceptual-hash analysis cache
+    upload = next(ctx["unique_uploads"]) if unique else ctx["upload"]
+    return {
+        "method": "POST",
+        "url": "/api/analyze-and-search",
+        "files": {"uploaded_image": ("room.jpg", upload, "image/jpeg")},
+    }
+
+
+def listing_request(ctx: dict) -> dict:
+    return {"method": "GET", "url": random.choice(["/api/designs/all", "/api/rooms/all?session_id=bench", "/api/furniture/all"])}
+
+
+SCENARIOS = {
+    "try_on": try_on_request,
+    "try_on_cached": lambda ctx: try_on_request(ctx, unique=False),
+    "place_furniture": place_furniture_request,
+    "analyze_and_search": analyze_request,
+    "analyze_and_search_cached": lambda ctx: analyze_request(ctx, unique=False),
+    "listings": listing_request,
+}
+
+
+async def seed_listings(rows: int):
+    from utils.image_store import store_image
+    from utils.repository import designs, furnitures
+
+    thumb = store_image(fakes.noise_image(256), "image/png", derivatives=False)
+    await designs.insert([
+        {
+            "session_id": "bench",
+            **thumb,
+            "design_metadata": {"room_type": "living room", "style": "modern", "design_type": "interior"},
+            "description": f"Seeded design {idx}",
+        }
+        for idx in range(rows)
+    ])
+    await furnitures.insert([{**thumb, "description": f"Seeded furniture {idx}"} for idx in range(rows)])
+
+
+async def run_level(client, build_request, ctx: dict, concurrency: int, total: int) -> dict:
+    latencies = []
+    errors = {}
+    pending = iter(range(total))
+
+    async def worker():
+        for _ in pending:
+            kwargs = build_request(ctx)
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(**kwargs)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started_at)
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    sampler = RssSampler()
+    sampler.start()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_seconds = time.perf_counter() - started_at
+    peak_rss = await sampler.stop()
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "rps": round(total / wall_seconds, 2) if wall_seconds else 0.0,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+async def wait_until_ready(client, timeout: float = 30.0) -> float:
+    """Seconds until /api/ready reports the worker warm."""
+    started_at = time.perf_counter()
+    while True:
+        response = await client.get("/api/ready")
+        if response.status_code == 200:
+            return time.perf_counter() - started_at
+        if time.perf_counter() - started_at > timeout:
+            raise RuntimeError(f"Worker not ready after {timeout}s: {response.text}")
+        await asyncio.sleep(0.05)
+
+
+def measure_import_seconds(runs: int = 3) -> float:
+    """Median wall time of `import main` in a fresh interpreter, so nothing is already cached in sys.modules."""
+    code = "import time; started_at = time.perf_counter(); import main; print(time.perf_counter() - started_at)"
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True, env=os.environ.copy()
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return sorted(samples)[len(samples) // 2]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args, installed: dict, app, import_seconds: float) -> dict:
+    import httpx
+
+    await seed_listings(args.seed_rows)
+    ctx = {
+        "upload": fakes.noise_image(args.upload_edge, "JPEG"),
+        "furniture": fakes.noise_image(args.upload_edge // 2),
+        "accept": args.accept,
+    }
+    if "analyze_and_search" in args.scenario:
+        count = args.requests * len(args.concurrency)
+        print(f"Preparing {count} distinct room photos ...", file=sys.stderr)
+        ctx["unique_uploads"] = iter([fakes.noise_image(args.upload_edge, "JPEG") for _ in range(count)])
+
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            ready_seconds = await wait_until_ready(client)
+            for name in args.scenario:
+                for concurrency in args.concurrency:
+                    print(f"{name} @ {concurrency} ...", file=sys.stderr)
+                    result = await run_level(client, SCENARIOS[name], ctx, concurrency, args.requests)
+                    results.append({"scenario": name, **result})
+                    print(f"  p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms "
+                          f"p99 {result['p99_ms']}ms {result['rps']} req/s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "accept": args.accept,
+            "import_seconds": round(import_seconds, 3),
+            "import_budget_seconds": args.import_budget,
+            "ready_seconds": round(ready_seconds, 3),
+            "gemini_latency_ms": args.gemini_latency.describe(),
+            "serpapi_latency_ms": args.serpapi_latency.describe(),
+            "upload_bytes": len(ctx["upload"]),
+            "model_image_edge": args.image_edge,
+            "gemini_calls": installed["models"].calls,
+            "serpapi_calls": installed["search"].calls,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against local fakes of its upstream services")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and concurrency level")
+    parser.add_argument("--gemini-latency", type=fakes.Latency.parse, default=fakes.Latency(2000, 6000), help="median:p95 ms")
+    parser.add_argument("--serpapi-latency", type=fakes.Latency.parse, default=fakes.Latency(600, 1500), help="median:p95 ms")
+    parser.add_argument("--image-edge", type=int, default=1024, help="edge of the image the fake model returns")
+    parser.add_argument("--text-chars", type=int, default=1200, help="length of the fake model's description")
+    parser.add_argument("--upload-edge", type=int, default=2048, help="edge of the uploaded room photo")
+    parser.add_argument("--seed-rows", type=int, default=300, help="rows seeded per listing table")
+    parser.add_argument("--accept", default="application/json", help="Accept header for try_on/place_furniture, e.g. image/*")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--import-budget", type=float, default=2.0, help="max seconds to import main; 0 disables the check")
+    parser.add_argument("--out", default="bench/results.json")
+    args = parser.parse_args()
+    args.scenario = args.scenario or list(SCENARIOS)
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="ati-bench-")
+    os.environ.update({
+        "GEMINI_API_KEY": "bench",
+        "SERPAPI_API_KEY": "bench",
+        "SUPABASE_URL": "http://supabase.bench",
+        "SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "DB_BACKEND": "sqlite",
+        "DB_SQLITE_PATH": os.path.join(workdir, "app.sqlite3"),
+        "BLOB_STORE_BACKEND": "local",
+        "BLOB_STORE_DIR": os.path.join(workdir, "blobs"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "CATALOG_DB_PATH": os.path.join(workdir, "catalog.sqlite3"),
+        "ROOM_POOL_ENABLED": "false",
+        "LOG_SAMPLE_RATE": "0",
+    })
+
+    # Measured against the real SDKs: importing the app must not build clients or touch the network
+    import_seconds = measure_import_seconds()
+    print(f"import main: {import_seconds:.3f}s (budget {args.import_budget}s)", file=sys.stderr)
+
+    installed = fakes.install(
+        args.gemini_latency, args.serpapi_latency, args.image_edge, args.text_chars
+    )
+    app = importlib.import_module("main").app
+
+    report = asyncio.run(run(args, installed, app, import_seconds))
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as out:
+        json.dump(report, out, indent=2, sort_keys=True)
+        out.write("\n")
+    print(f"Wrote {args.out}", file=sys.stderr)
+
+    if args.import_budget and import_seconds > args.import_budget:
+        print(f"FAIL: importing main took {import_seconds:.3f}s, over the {args.import_budget}s budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
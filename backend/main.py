@@ -1,9 +1,48 @@
+import contextlib
+from dotenv import load_dotenv
+
+# Loaded once, before any module reads its settings from the environment
+load_dotenv()
+
 from fastapi import FastAPI
-from routers import tryon, furniture_placement, furniture_library, analysis_search
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import tryon, furniture_placement, furniture_library, analysis_search, images, jobs
 from fastapi.middleware.cors import CORSMiddleware
+from utils.model_calls import model_scheduler
+from utils.hedging import hedging_stats
+from utils.preprocess import preprocess_stats
+from utils.room_pool import room_pool, ROOM_POOL_ENABLED
+from utils.jobs import job_queue
+from utils.similarity import furniture_index
+from utils.catalog import product_catalog
+from utils.clients import clients
+from utils import repository  # noqa: F401 - registers the database client
+from utils.metrics import registry, MetricsMiddleware
+from utils.uploads import BodySizeLimitMiddleware, MAX_REQUEST_UPLOAD_BYTES
+
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients.start()
+    # Use counts are synced either way; rooms are only generated ahead of time when the pool is enabled
+    room_pool.start(furniture_placement.generate_empty_room if ROOM_POOL_ENABLED else None)
+    job_queue.start()
+    furniture_index.start()
+    try:
+        yield
+    finally:
+        await furniture_index.stop()
+        await room_pool.stop()
+        await job_queue.stop()
+        await product_catalog.stop()
+        await clients.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+# Added before CORS so CORS stays the outermost layer and 413s still carry CORS headers.
+# Leaves 1MB of headroom over the upload budget for the non-file form fields.
+app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=MAX_REQUEST_UPLOAD_BYTES + 1024 * 1024)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,7 +52,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so request timings and status codes include everything below it
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(tryon.router, prefix="/api")
 app.include_router(furniture_placement.router, prefix="/api")
 app.include_router(furniture_library.router, prefix="/api")
 app.include_router(analysis_search.router, prefix="/api")
+app.include_router(images.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+
+
+@app.get("/api/model-calls/stats")
+async def model_call_stats():
+    return {
+        **model_scheduler.stats(),
+        "image_preprocessing": preprocess_stats.snapshot(),
+        "jobs": job_queue.stats(),
+        "furniture_index": furniture_index.stats(),
+        "product_catalog": product_catalog.stats(),
+        "hedging": hedging_stats(),
+    }
+
+
+@app.get("/api/ready")
+async def ready():
+    """200 once startup finished and every client pre-warmed; 503 while warming or if a client failed."""
+    readiness = clients.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,7 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Path
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Path, Query
 from fastapi.responses import JSONResponse
-from utils.db_client import supabase
-import base64
+from utils import repository
+from utils.image_store import image_data_url, image_url, thumbnail_url, decoded_image_cache, IMAGE_COLUMNS
+from utils.uploads import read_image_upload
+from utils.pagination import split_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.similarity import furniture_index, text_query
+from utils.furniture import save_furniture
+import asyncio
 import traceback
 
 router = APIRouter()
@@ -13,60 +18,139 @@ async def upload_furniture(
     furniture_image: UploadFile = File(...)
 ):
     try:
-        allowed_types = ["image/png", "image/jpeg", "image/webp"]
-        if furniture_image.content_type not in allowed_types:
-            raise HTTPException(status_code=400, detail="Unsupported image type")
-
-        bytes_data = await furniture_image.read()
-        b64 = base64.b64encode(bytes_data).decode("utf-8")
-
-        data = {
-            "session_id": session_id,
-            "description": name,
-            "image_base64": b64
-        }
-
-        result = supabase.table("furnitures").insert(data).execute()
+        allowed_types = {"image/png", "image/jpeg", "image/webp"}
+        bytes_data, mime_type = await read_image_upload(furniture_image, allowed_types, field="furniture_image")
+        saved = await save_furniture(session_id, bytes_data, mime_type, name)
 
         return JSONResponse({
             "status": "success",
             "message": "Furniture uploaded",
-            "id": result.data[0]["id"]
+            "id": saved["id"],
+            "trimmed": saved["trimmed"],
+            "near_duplicates": saved["near_duplicates"]
         })
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Upload failed")
 
 @router.get("/furniture/all")
-async def get_all_furniture(session_id: str = None):
+async def get_all_furniture(
+    session_id: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = Query(None)
+):
     try:
-        query = supabase.table("furnitures").select("id, session_id, created_at, image_base64, description").order("created_at", desc=True)
-        if session_id:
-            query = query.eq("session_id", session_id)
-        result = query.execute()
-
-        items = result.data or []
+        filters = {"session_id": session_id} if session_id else {}
+        rows = await repository.furnitures.page(("id", "session_id", "created_at", "description", "image_hash"), limit, cursor, **filters)
+        items, next_cursor = split_page(rows, limit)
 
         furnitures = [
             {
                 "id": item["id"],
                 "name": item.get("description") or "Furniture",
                 "created_at": item["created_at"],
-                "image": f"data:image/png;base64,{item['image_base64']}"
+                "thumbnail_url": thumbnail_url(item, "furniture")
             } for item in items
         ]
-        return {"furnitures": furnitures}
+        return {"furnitures": furnitures, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail="Failed to load furniture library")
+
+def similarity_results(matches: list) -> list:
+    return [
+        {
+            "id": match["id"],
+            "name": match.get("description") or "Furniture",
+            "created_at": match["created_at"],
+            "thumbnail_url": image_url(match, "thumb"),
+            "score": match["score"]
+        } for match in matches
+    ]
+
+async def drop_deleted(matches: list) -> list:
+    """Removes matches whose rows another worker deleted since the index last synced."""
+    if not matches:
+        return matches
+    existing = {row["id"] for row in await repository.furnitures.get_many([match["id"] for match in matches], ("id",))}
+    for match in matches:
+        if match["id"] not in existing:
+            furniture_index.remove(match["id"])
+    return [match for match in matches if match["id"] in existing]
+
+@router.get("/furniture/similar")
+async def get_similar_furniture(
+    to: str = Query(..., description="ID of the furniture to compare against"),
+    session_id: str = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE)
+):
+    try:
+        embedding = furniture_index.embedding_of(to)
+        if embedding is None:
+            # Possibly uploaded through another worker since the last background sync
+            await furniture_index.refresh(force=True)
+            embedding = furniture_index.embedding_of(to)
+        if embedding is None:
+            raise HTTPException(status_code=404, detail="Furniture not found")
+
+        matches = await drop_deleted(furniture_index.nearest(embedding, limit, session_id=session_id, exclude=to))
+        return {"furnitures": similarity_results(matches)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to find similar furniture")
+
+@router.get("/furniture/search")
+async def search_furniture(
+    q: str = Query(..., min_length=1),
+    session_id: str = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE)
+):
+    try:
+        vector, words = text_query(q)
+        if vector is None and not words:
+            return {"furnitures": []}
+        matches = await drop_deleted(furniture_index.nearest(vector, limit, session_id=session_id, words=words))
+        return {"furnitures": similarity_results(matches)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to search furniture")
+
+@router.get("/furniture/{furniture_id}/image")
+async def get_furniture_image(furniture_id: str = Path(..., description="ID of the furniture")):
+    try:
+        row = await repository.furnitures.get(furniture_id, ("image_base64", *IMAGE_COLUMNS))
+        if not row:
+            raise HTTPException(status_code=404, detail="Furniture not found")
+
+        image = await asyncio.to_thread(image_data_url, row, "image_base64")
+        if not image:
+            raise HTTPException(status_code=404, detail="Image data not found")
+
+        return {"image": image}
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to fetch furniture image")
     
 @router.delete("/furniture/{furniture_id}")
 async def delete_furniture(furniture_id: str = Path(..., description="ID of the furniture")):
     try:
-        result = supabase.table("furnitures").delete().eq("id", furniture_id).execute()
-        if not result.data:  # empty list means no matching row
+        if not await repository.furnitures.delete(furniture_id):
             raise HTTPException(status_code=404, detail="Furniture not found")
+        decoded_image_cache.pop(("furniture", furniture_id))
+        furniture_index.remove(furniture_id)
         return {"status": "success", "message": "Furniture deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
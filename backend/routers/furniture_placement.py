@@ -1,108 +1,135 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException, Query
 from fastapi.responses import JSONResponse
-from utils.db_client import supabase
-from dotenv import load_dotenv
-import os
-from google import genai
+from utils import repository
+from utils.clients import gemini
+from utils.model_calls import generate_content, generate_content_stream, response_parts, set_call_context
+from utils.room_pool import room_pool, pool_key
+from utils.image_store import store_image, load_image, image_data_url, image_url, thumbnail_url, decoded_image_cache, IMAGE_COLUMNS
+from utils.uploads import read_image_upload, UploadBudget
+from utils.blob_store import blob_store
+from utils.furniture import save_furniture
+from utils.trim import load_trimmed, trimmed_or_original
+from utils.jobs import job_queue, submit_or_503
+from utils.sse import sse_event, sse_response, relay
+from utils.negotiation import preferred_format, image_response, JSON
+from utils.base64_helpers import to_data_url
+from utils.logs import log_event, log_exception
+from utils.preprocess import prepare_for_model, PreprocessReport
+from utils.pagination import split_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.cache import TTLCache
+from utils.singleflight import SingleFlight
+from utils.metrics import register_cache
 from google.genai import types
-import traceback
-import base64
-
-load_dotenv()
+import asyncio
+import hashlib
+import json
+import os
+import time
 
 router = APIRouter()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("Missing GEMINI_API_KEY in .env")
+PLACEMENT_HISTORY_MAX_DEPTH = int(os.getenv("PLACEMENT_HISTORY_MAX_DEPTH", "50"))
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Saved composites keyed on session + the room they were placed into + the items added,
+# so repeating a step (e.g. redo after undo) returns the stored composite without a model call
+placement_cache = TTLCache(
+    max_entries=int(os.getenv("PLACEMENT_CACHE_MAX_ENTRIES", "4096")),
+    ttl_seconds=float(os.getenv("PLACEMENT_CACHE_TTL_SECONDS", "86400")),
+)
+register_cache("placements", placement_cache)
+# Identical placements in flight (same cache key) share one model call
+placement_flight = SingleFlight()
 
 @router.get("/designs/all")
-async def get_all_designs():
+async def get_all_designs(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = Query(None)
+):
     try:
-        result = supabase.table("room_designs").select("id, session_id, created_at, design_metadata, description").order("created_at", desc=True).execute()
+        page = await repository.designs.page(("id", "session_id", "created_at", "design_metadata", "description", "image_hash"), limit, cursor)
+        rows, next_cursor = split_page(page, limit)
 
         designs = []
-        if result.data:
-            for design in result.data:
-                designs.append({
-                    "id": design.get("id"),
-                    "session_id": design.get("session_id"),
-                    "created_at": design.get("created_at"),
-                    "metadata": design.get("design_metadata"),
-                    "description": design.get("description")
-                })
-
-        return JSONResponse(content={"designs": designs})
+        for design in rows:
+            designs.append({
+                "id": design.get("id"),
+                "session_id": design.get("session_id"),
+                "created_at": design.get("created_at"),
+                "metadata": design.get("design_metadata"),
+                "description": design.get("description"),
+                "thumbnail_url": thumbnail_url(design, "design")
+            })
+
+        return JSONResponse(content={"designs": designs, "next_cursor": next_cursor})
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching all designs: {e}")
-        traceback.print_exc()
+        log_exception("designs_fetch_failed", e)
         raise HTTPException(status_code=500, detail="Failed to fetch designs")
 
 @router.get("/designs/{session_id}")
-async def get_designs_by_session(session_id: str):
+async def get_designs_by_session(
+    session_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = Query(None)
+):
     try:
-        result = supabase.table("room_designs").select("id, created_at, design_metadata, description").eq("session_id", session_id).order("created_at", desc=True).execute()
+        page = await repository.designs.page(("id", "created_at", "design_metadata", "description", "image_hash"), limit, cursor, session_id=session_id)
+        rows, next_cursor = split_page(page, limit)
 
         designs = []
-        if result.data:
-            for design in result.data:
-                designs.append({
-                    "id": design.get("id"),
-                    "created_at": design.get("created_at"),
-                    "metadata": design.get("design_metadata"),
-                    "description": design.get("description")
-                })
-
-        return JSONResponse(content={"designs": designs})
+        for design in rows:
+            designs.append({
+                "id": design.get("id"),
+                "created_at": design.get("created_at"),
+                "metadata": design.get("design_metadata"),
+                "description": design.get("description"),
+                "thumbnail_url": thumbnail_url(design, "design")
+            })
+
+        return JSONResponse(content={"designs": designs, "next_cursor": next_cursor})
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching designs: {e}")
-        traceback.print_exc()
+        log_exception("designs_fetch_failed", e, session_id=session_id)
         raise HTTPException(status_code=500, detail="Failed to fetch designs")
 
 @router.get("/design/{design_id}/image")
 async def get_design_image_by_id(design_id: str):
     try:
-        result = supabase.table("room_designs").select("generated_image_data").eq("id", design_id).maybe_single().execute()
+        row = await repository.designs.get(design_id, ("generated_image_data", *IMAGE_COLUMNS))
 
-        if not result.data:
+        if not row:
             raise HTTPException(status_code=404, detail="Design not found")
 
-        image_base64 = result.data.get("generated_image_data")
-        if not image_base64:
+        image_url = await asyncio.to_thread(image_data_url, row, "generated_image_data")
+        if not image_url:
             raise HTTPException(status_code=404, detail="Image data not found")
 
-        image_url = f"data:image/png;base64,{image_base64}"
-
         return JSONResponse(content={"image": image_url})
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error fetching design image: {e}")
-        traceback.print_exc()
+        log_exception("design_image_fetch_failed", e, design_id=design_id)
         raise HTTPException(status_code=500, detail="Failed to fetch design image")
 
 @router.get("/designs/{session_id}/{design_id}/image")
 async def get_design_image(session_id: str, design_id: str):
     try:
-        result = supabase.table("room_designs").select("generated_image_data").eq("id", design_id).eq("session_id", session_id).maybe_single().execute()
+        row = await repository.designs.get(design_id, ("generated_image_data", *IMAGE_COLUMNS), session_id=session_id)
 
-        if not result.data:
+        if not row:
             raise HTTPException(status_code=404, detail="Design not found")
 
-        image_base64 = result.data.get("generated_image_data")
-        if not image_base64:
+        image_url = await asyncio.to_thread(image_data_url, row, "generated_image_data")
+        if not image_url:
             raise HTTPException(status_code=404, detail="Image data not found")
 
-        image_url = f"data:image/png;base64,{image_base64}"
-
         return JSONResponse(content={"image": image_url})
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error fetching design image: {e}")
-        traceback.print_exc()
+        log_exception("design_image_fetch_failed", e, design_id=design_id)
         raise HTTPException(status_code=500, detail="Failed to fetch design image")
 
 @router.post("/rooms/upload")
@@ -112,47 +139,52 @@ async def upload_room(
     room_description: str = Form("")
 ):
     try:
-        ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
-        if room_image.content_type not in ALLOWED_MIME_TYPES:
-            raise HTTPException(400, "Unsupported file type")
+        data, mime_type = await read_image_upload(room_image, field="room_image")
+        image_columns = await asyncio.to_thread(store_image, data, mime_type)
 
-        data = await room_image.read()
-        image_b64 = base64.b64encode(data).decode("utf-8")
-
-        result = supabase.table("room_designs").insert({
+        inserted = await repository.designs.insert({
             "session_id": session_id,
-            "generated_image_data": image_b64,
+            **image_columns,
             "description": room_description,
             "design_metadata": {"room_type": "user_uploaded", "style": "custom"}
-        }).execute()
+        })
 
-        return {"status": "success", "room_id": result.data[0]["id"]}
+        return {"status": "success", "room_id": inserted[0]["id"]}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, str(e))
     
 @router.get("/rooms/all")
-async def get_user_rooms(session_id: str = Query(...)):
+async def get_user_rooms(
+    session_id: str = Query(...),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = Query(None)
+):
     try:
-        result = supabase.table("room_designs").select(
-            "id, session_id, generated_image_data, design_metadata, description, created_at"
-        ).eq("session_id", session_id).order("created_at", desc=True).execute()
+        page = await repository.designs.page(
+            ("id", "session_id", "design_metadata", "description", "created_at", "image_hash"),
+            limit, cursor, session_id=session_id
+        )
+        rows, next_cursor = split_page(page, limit)
 
         rooms = []
-        if result.data:
-            for r in result.data:
-                rooms.append({
-                    "id": r.get("id"),
-                    "session_id": r.get("session_id"),
-                    "image": f"data:image/png;base64,{r.get('generated_image_data')}" if r.get("generated_image_data") else None,
-                    "description": r.get("description") or "",
-                    "metadata": r.get("design_metadata") or {}
-                })
-
-        return JSONResponse({"rooms": rooms})
+        for r in rows:
+            rooms.append({
+                "id": r.get("id"),
+                "session_id": r.get("session_id"),
+                "created_at": r.get("created_at"),
+                "thumbnail_url": thumbnail_url(r, "design"),
+                "description": r.get("description") or "",
+                "metadata": r.get("design_metadata") or {}
+            })
+
+        return JSONResponse({"rooms": rooms, "next_cursor": next_cursor})
+    except HTTPException:
+        raise
     except Exception as e:
-        print("Error fetching user rooms:", e)
-        traceback.print_exc()
+        log_exception("user_rooms_fetch_failed", e)
         raise HTTPException(status_code=500, detail="Failed to fetch rooms")
 
 @router.post("/furnitures/upload")
@@ -162,137 +194,107 @@ async def upload_furniture(
     furniture_description: str = Form("")
 ):
     try:
-        ALLOWED_MIME_TYPES = {
-            "image/jpeg", "image/png", "image/webp",
-            "image/heic", "image/heif"
-        }
+        furniture_bytes, mime_type = await read_image_upload(furniture_image, field="furniture_image")
 
-        if furniture_image.content_type not in ALLOWED_MIME_TYPES:
-            raise HTTPException(400, "Unsupported file type")
+        saved = await save_furniture(session_id, furniture_bytes, mime_type, furniture_description)
 
-        furniture_bytes = await furniture_image.read()
-        furniture_b64 = base64.b64encode(furniture_bytes).decode("utf-8")
-
-        result = supabase.table("furnitures").insert({
-            "session_id": session_id,
-            "image_base64": furniture_b64,
-            "description": furniture_description
-        }).execute()
-
-        return {"status": "success", "furniture_id": result.data[0]["id"]}
+        return {
+            "status": "success",
+            "furniture_id": saved["id"],
+            "trimmed": saved["trimmed"],
+            "near_duplicates": saved["near_duplicates"]
+        }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@router.post("/place-furniture")
-async def place_furniture(
-    session_id: str = Form(...),
-    design_id: str = Form(None),
-    user_room_id: str = Form(None),
-    furniture_ids: str = Form(None),
-    furniture_images: list[UploadFile] = File([]),
-    furniture_descriptions: str = Form("")
-):
-    try:
-        MAX_IMAGE_SIZE_MB = 10
-        ALLOWED_MIME_TYPES = {
-            "image/jpeg",
-            "image/png",
-            "image/webp",
-            "image/heic",
-            "image/heif",
-        }
-
-        # --- Prepare furniture images ---
-        furniture_bytes_list = []
-        furniture_desc_list = []
-
-        # 1. From library
-        if furniture_ids:
-            ids = [fid.strip() for fid in furniture_ids.split(",") if fid.strip()]
-            for fid in ids:
-                row = supabase.table("furnitures").select("image_base64, description") \
-                    .eq("id", fid).maybe_single().execute()
-                if not row.data:
-                    continue  # skip invalid IDs
-                furniture_bytes_list.append(base64.b64decode(row.data["image_base64"]))
-                furniture_desc_list.append(row.data.get("description", "Furniture"))
-
-        # 2. From new uploads
-        if furniture_images:
-            descs = furniture_descriptions.split(",") if furniture_descriptions else []
-            for idx, img in enumerate(furniture_images):
-                if img.content_type not in ALLOWED_MIME_TYPES:
-                    raise HTTPException(400, f"Unsupported file type: {img.content_type}")
-                data = await img.read()
-                size_mb = len(data) / (1024*1024)
-                if size_mb > MAX_IMAGE_SIZE_MB:
-                    raise HTTPException(400, f"Image exceeds {MAX_IMAGE_SIZE_MB}MB")
-                furniture_bytes_list.append(data)
-                furniture_desc_list.append(descs[idx] if idx < len(descs) else "Furniture")
-
-        if not furniture_bytes_list:
-            raise HTTPException(400, "No furniture images provided")
-
-        # === Get or generate room image ===
-        room_image_bytes = None
-        room_metadata = {}
-
-        if user_room_id:
-            room_row = supabase.table("room_designs") \
-            .select("*") \
-            .eq("id", user_room_id) \
-            .maybe_single() \
-            .execute()
-            
-            if not room_row or not room_row.data or not room_row.data.get("generated_image_data"):
-                raise HTTPException(404, "User room not found")
-            
-            # Decode the image
-            room_image_bytes = base64.b64decode(room_row.data["generated_image_data"])
-            room_metadata = room_row.data.get("design_metadata", {})
-
-        elif design_id:
-            # Fetch the design by ID only
-            room_row = supabase.table("room_designs").select("*")\
-                .eq("id", design_id).maybe_single().execute()
-
-            if not room_row or not room_row.data:
-                raise HTTPException(404, "Design not found")
-
-            if not room_row.data.get("generated_image_data"):
-                raise HTTPException(404, "Design image not found")
-
-            # Decode the image
-            room_image_bytes = base64.b64decode(room_row.data["generated_image_data"])
-            room_metadata = room_row.data.get("design_metadata", {})
-                
-        if not room_image_bytes:
-            # Generate neutral empty room
-            prompt_empty_room = "Generate a neutral empty room with natural lighting for furniture placement"
-            response_empty = client.models.generate_content(
-                model="gemini-2.5-flash-image",
-                contents=[prompt_empty_room],
-                config=types.GenerateContentConfig(response_modalities=["IMAGE"])
-            )
-            if response_empty.candidates and response_empty.candidates[0].content.parts:
-                part = response_empty.candidates[0].content.parts[0]
-                if hasattr(part, "inline_data") and part.inline_data:
-                    room_image_bytes = part.inline_data.data
-                    room_metadata = {"room_type": "empty", "style": "neutral", "design_type": "interior"}
-            if not room_image_bytes:
-                raise HTTPException(500, "Failed to generate base room image")
-
-        # --- Prepare prompt for AI ---
-        furniture_details = "\n".join([f"{i+1}. Description: {d}" for i, d in enumerate(furniture_desc_list)])
-        prompt = f"""
+def load_furniture_image(row: dict):
+    return load_trimmed(row.get("image_hash")) or load_image(row, "image_base64")
+
+async def fetch_library_furniture(ids: list[str]):
+    """Returns (id, image_bytes, description) for each known ID in request order, using one batched query for cache misses.
+
+    The image is the copy trimmed to the object at upload time when there is one.
+    """
+    found = {}
+    for fid in ids:
+        cached = decoded_image_cache.get(("furniture", fid))
+        if cached is not None:
+            found[fid] = cached
+
+    missing = [fid for fid in dict.fromkeys(ids) if fid not in found]
+    if missing:
+        rows = await repository.furnitures.get_many(missing, ("id", "image_base64", "description", *IMAGE_COLUMNS))
+        # Blob reads block, so they run in worker threads, all rows at once
+        images = await asyncio.gather(*(asyncio.to_thread(load_furniture_image, row) for row in rows))
+        for row, image_bytes in zip(rows, images):
+            if not image_bytes:
+                continue
+            entry = (image_bytes, row.get("description", "Furniture"))
+            decoded_image_cache.set(("furniture", row["id"]), entry, len(image_bytes))
+            found[row["id"]] = entry
+
+    # Invalid IDs are skipped
+    return [(fid, *found[fid]) for fid in ids if fid in found]
+
+async def fetch_room(room_id: str):
+    """Returns (image_bytes, design_metadata) for a room_designs row, or None if it has no image."""
+    cached = decoded_image_cache.get(("room", room_id))
+    if cached is not None:
+        return cached
+
+    room_row = await repository.designs.get(room_id, ("generated_image_data", "design_metadata", *IMAGE_COLUMNS))
+    if not room_row:
+        return None
+
+    room_image_bytes = await asyncio.to_thread(load_image, room_row, "generated_image_data")
+    if not room_image_bytes:
+        return None
+
+    entry = (room_image_bytes, room_row.get("design_metadata") or {})
+    decoded_image_cache.set(("room", room_id), entry, len(room_image_bytes))
+    return entry
+
+async def generate_empty_room(room_type: str, style: str):
+    """Generates a furnishing-free base room; returns (image_bytes, mime_type) or None."""
+    if pool_key(room_type, style) == pool_key("empty", "neutral"):
+        prompt_empty_room = "Generate a neutral empty room with natural lighting for furniture placement"
+    else:
+        prompt_empty_room = f"Generate an empty, unfurnished {room_type} in a {style} style with natural lighting for furniture placement"
+
+    response_empty = await generate_content(
+        gemini(),
+        model="gemini-2.5-flash-image",
+        contents=[prompt_empty_room],
+        config=types.GenerateContentConfig(response_modalities=["IMAGE"])
+    )
+    if response_empty.candidates and response_empty.candidates[0].content.parts:
+        part = response_empty.candidates[0].content.parts[0]
+        if hasattr(part, "inline_data") and part.inline_data:
+            return part.inline_data.data, getattr(part.inline_data, "mime_type", None) or "image/png"
+    return None
+
+PLACEMENT_MODEL = "gemini-2.5-flash-image"
+
+def build_placement_prompt(room_metadata: dict, furniture_desc_list: list[str], placed_desc_list: list[str] = ()) -> str:
+    furniture_details = "\n".join([f"{i+1}. Description: {d}" for i, d in enumerate(furniture_desc_list)])
+    placed_section = ""
+    if placed_desc_list:
+        placed_details = "\n".join([f"{i+1}. Description: {d}" for i, d in enumerate(placed_desc_list)])
+        placed_section = f"""
+Furniture already in the room (keep it exactly where and as it is; do not move, remove or restyle it):
+{placed_details}
+"""
+    return f"""
 You are a professional AI interior designer specializing in furniture placement.
 
 Room context:
 - Room Type: {room_metadata.get('room_type', 'unknown')}
 - Style: {room_metadata.get('style', 'unknown')}
 - Design Type: {room_metadata.get('design_type', 'interior')}
-
+{placed_section}
 Furniture to place:
 {furniture_details}
 
@@ -305,50 +307,446 @@ Output:
 - A short description of placement for each item.
 """
 
-        # --- Send to AI ---
-        contents = [prompt, types.Part.from_bytes(data=room_image_bytes, mime_type="image/png")]
-        for fb in furniture_bytes_list:
-            contents.append(types.Part.from_bytes(data=fb, mime_type="image/png"))
+def parse_placement_response(response):
+    """Returns (image_data, image_mime_type, text) from a generate_content response."""
+    image_data = None
+    text_response = "No description available."
+    image_mime_type = "image/png"
+
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, "inline_data") and part.inline_data:
+                image_data = part.inline_data.data
+                image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
+            elif hasattr(part, "text") and part.text:
+                text_response = part.text
+    return image_data, image_mime_type, text_response
+
+async def resolve_room(design_id: str, user_room_id: str, room_type: str, style: str):
+    """Returns (room_image_bytes, room_metadata) for the selected room, or a neutral base room."""
+    if user_room_id:
+        room = await fetch_room(user_room_id)
+        if not room:
+            raise HTTPException(404, "User room not found")
+        return room
+
+    if design_id:
+        room = await fetch_room(design_id)
+        if not room:
+            raise HTTPException(404, "Design not found")
+        return room
+
+    # Use a pre-generated neutral room, generating one only if the pool is empty
+    room_image_bytes = await room_pool.take(room_type, style)
+    if not room_image_bytes:
+        generated = await generate_empty_room(room_type, style)
+        if not generated:
+            raise HTTPException(500, "Failed to generate base room image")
+        room_image_bytes = generated[0]
+        await asyncio.to_thread(room_pool.add, room_type, style, *generated)
+    return room_image_bytes, {"room_type": room_type, "style": style, "design_type": "interior"}
+
+async def resolve_furniture(furniture_ids: list[str], uploaded_images: list[bytes], uploaded_descriptions: list[str]) -> list[tuple]:
+    """Returns (image_bytes, item) pairs, where `item` identifies the piece in a placement's lineage."""
+    items = []
+
+    # 1. From library
+    for fid, image_bytes, description in await fetch_library_furniture(furniture_ids):
+        items.append((image_bytes, {"furniture_id": fid, "description": description}))
+
+    # 2. From new uploads
+    for idx, data in enumerate(uploaded_images):
+        description = uploaded_descriptions[idx] if idx < len(uploaded_descriptions) else "Furniture"
+        image_hash = (await asyncio.to_thread(store_image, data, derivatives=False))["image_hash"]
+        trimmed = await asyncio.to_thread(trimmed_or_original, data)
+        items.append((trimmed, {"image_hash": image_hash, "description": description}))
+
+    if not items:
+        raise HTTPException(400, "No furniture images provided")
+    return items
+
+async def plan_placement(
+    session_id: str,
+    placement_id: str,
+    design_id: str,
+    user_room_id: str,
+    furniture_ids: list[str],
+    uploaded_images: list[bytes],
+    uploaded_descriptions: list[str],
+    room_type: str,
+    style: str
+) -> dict:
+    """Resolves the room and furniture for one placement.
+
+    With `placement_id` the room is that earlier composite, and only the new items are
+    sent; the ones it already shows are named in the prompt so the model keeps them.
+    """
+    items = await resolve_furniture(furniture_ids, uploaded_images, uploaded_descriptions)
+
+    if placement_id:
+        room = await fetch_room(placement_id)
+        if not room:
+            raise HTTPException(404, "Placement not found")
+        room_image_bytes, room_metadata = room
+        placement = room_metadata.get("placement") or {}
+        lineage = {
+            "base_design_id": placement.get("base_design_id", placement_id),
+            "parent_design_id": placement_id,
+            "ancestors": (placement.get("ancestors", []) + [placement_id])[-PLACEMENT_HISTORY_MAX_DEPTH:],
+            "furniture": placement.get("furniture", []),
+        }
+    else:
+        room_image_bytes, room_metadata = await resolve_room(design_id, user_room_id, room_type, style)
+        # A room picked from the pool has no row, so its placements start a lineage without a base
+        base_design_id = user_room_id or design_id
+        lineage = {
+            "base_design_id": base_design_id,
+            "parent_design_id": base_design_id,
+            "ancestors": [base_design_id] if base_design_id else [],
+            "furniture": [],
+        }
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-            )
+    cache_key = None
+    if lineage["parent_design_id"]:
+        added = json.dumps([item for _, item in items], sort_keys=True)
+        cache_key = f"{session_id}:{lineage['parent_design_id']}:" + hashlib.sha256(added.encode("utf-8")).hexdigest()
+
+    return {
+        "session_id": session_id,
+        "room_image": room_image_bytes,
+        "room_metadata": {key: value for key, value in room_metadata.items() if key != "placement"},
+        "lineage": lineage,
+        "items": items,
+        "cache_key": cache_key,
+    }
+
+async def cached_placement(plan: dict):
+    """The composite saved earlier for the same items on the same room (e.g. redo after undo), or None."""
+    if plan["cache_key"] is None:
+        return None
+    cached = placement_cache.get(plan["cache_key"])
+    if cached is None:
+        return None
+    room = await fetch_room(cached["design_id"])
+    if not room:
+        return None
+    return {**cached, "image_data": room[0], "model_seconds": None, "cached": True}
+
+async def prepare_placement_contents(plan: dict, report: PreprocessReport) -> list:
+    # --- Prepare prompt for AI ---
+    prompt = build_placement_prompt(
+        plan["room_metadata"],
+        [item["description"] for _, item in plan["items"]],
+        [item["description"] for item in plan["lineage"]["furniture"]],
+    )
+
+    # --- Downscale room + furniture images for the model ---
+    prepared_images = await asyncio.gather(*(
+        prepare_for_model(image_bytes, "image/png", PLACEMENT_MODEL, report)
+        for image_bytes in [plan["room_image"], *(image_bytes for image_bytes, _ in plan["items"])]
+    ))
+
+    # --- Send to AI ---
+    contents = [prompt]
+    for image_bytes, mime_type in prepared_images:
+        contents.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
+    return contents
+
+async def save_placement(plan: dict, image_data: bytes, image_mime_type: str, text_response: str) -> dict:
+    """Stores the composite as a room_designs row with its lineage; failures are logged, not raised."""
+    added = [item for _, item in plan["items"]]
+    placement = {
+        "base_design_id": plan["lineage"]["base_design_id"],
+        "parent_design_id": plan["lineage"]["parent_design_id"],
+        # Oldest first, so the history endpoint can fetch the whole chain in one query
+        "ancestors": plan["lineage"]["ancestors"],
+        "furniture": plan["lineage"]["furniture"] + added,
+        "added": added,
+    }
+    metadata = {**plan["room_metadata"], "placement": placement}
+    result = {
+        "image_data": image_data,
+        "image_mime_type": image_mime_type,
+        "text": text_response,
+        "design_id": None,
+        "image_hash": None,
+        "placement": placement,
+        "cached": False,
+    }
+    try:
+        image_columns = await asyncio.to_thread(store_image, image_data, image_mime_type)
+        result["image_hash"] = image_columns["image_hash"]
+        inserted = await repository.designs.insert({
+            "session_id": plan["session_id"],
+            **image_columns,
+            "design_metadata": metadata,
+            "description": text_response,
+        })
+        if inserted:
+            design_id = inserted[0].get("id")
+            result["design_id"] = design_id
+            # The next "add to" step starts from this composite, so keep it decoded
+            decoded_image_cache.set(("room", design_id), (image_data, metadata), len(image_data))
+            if plan["cache_key"] is not None:
+                placement_cache.set(plan["cache_key"], {key: value for key, value in result.items() if key != "image_data"})
+    except Exception as db_error:
+        log_exception("placement_save_failed", db_error)
+    return result
+
+async def run_place_furniture(plan: dict, report: PreprocessReport, emit=None) -> dict:
+    """Returns the saved composite for this plan, or generates one.
+
+    Identical placements running at the same time wait on a single model call. With `emit`,
+    a call started here streams from the model and passes its SSE events to `emit`.
+    """
+    cached = await cached_placement(plan)
+    if cached is not None:
+        return cached
+
+    if emit is None:
+        generate = lambda: generate_placement(plan, report)
+    else:
+        generate = lambda: stream_placement(plan, report, emit)
+    if plan["cache_key"] is None:
+        return await generate()
+    result, shared = await placement_flight.do(plan["cache_key"], generate)
+    return {**result, "cached": True} if shared else result
+
+async def generate_placement(plan: dict, report: PreprocessReport) -> dict:
+    contents = await prepare_placement_contents(plan, report)
+
+    model_started_at = time.perf_counter()
+    response = await generate_content(
+        gemini(),
+        model=PLACEMENT_MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE']
         )
+    )
+    model_seconds = time.perf_counter() - model_started_at
+    log_event(
+        "place_furniture",
+        images=report.images,
+        bytes_original=report.original_bytes,
+        bytes_sent=report.sent_bytes,
+        preprocess_seconds=round(report.seconds, 3),
+        model_seconds=round(model_seconds, 2),
+        already_placed=len(plan["lineage"]["furniture"]),
+    )
+
+    # --- Parse AI output ---
+    image_data, image_mime_type, text_response = parse_placement_response(response)
+    if not image_data:
+        raise HTTPException(500, "AI failed to generate furniture placement image")
+
+    result = await save_placement(plan, image_data, image_mime_type, text_response)
+    return {**result, "model_seconds": model_seconds}
+
+def placement_fields(result: dict, design_id: str, user_room_id: str) -> dict:
+    """IDs and lineage returned with a placement image, in every response format."""
+    return {
+        "text": result["text"],
+        "design_id": result["design_id"],
+        "parent_design_id": result["placement"]["parent_design_id"],
+        "base_design_id": result["placement"]["base_design_id"],
+        "furniture": result["placement"]["furniture"],
+        "cached": result["cached"],
+        "original_design_id": design_id,
+        "user_room_id": user_room_id,
+    }
+
+async def run_place_furniture_job(payload: dict) -> dict:
+    set_call_context("place_furniture", payload["session_id"])
+    uploaded_images = await asyncio.gather(*(
+        asyncio.to_thread(blob_store.get, image_hash) for image_hash in payload["uploaded_image_hashes"]
+    ))
+    plan = await plan_placement(
+        payload["session_id"], payload.get("placement_id"), payload["design_id"], payload["user_room_id"],
+        payload["furniture_ids"], uploaded_images, payload["uploaded_descriptions"], payload["room_type"], payload["style"]
+    )
+    result = await run_place_furniture(plan, PreprocessReport())
+    return {
+        "image_hash": result["image_hash"],
+        "image_url": image_url(result),
+        **placement_fields(result, payload["design_id"], payload["user_room_id"]),
+    }
+
+job_queue.register("place_furniture", run_place_furniture_job)
+
+async def stream_placement(plan: dict, report: PreprocessReport, emit) -> dict:
+    """generate_placement from the streaming model call, passing stage and text events to `emit` as they happen."""
+    emit(sse_event("stage", {"stage": "preprocessing"}))
+    contents = await prepare_placement_contents(plan, report)
+
+    emit(sse_event("stage", {"stage": "model_started", "bytes_sent": report.sent_bytes}))
+    model_started_at = time.perf_counter()
+    image_data = None
+    image_mime_type = "image/png"
+    text_parts = []
+    async for chunk in generate_content_stream(
+        gemini(),
+        model=PLACEMENT_MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+    ):
+        for part in response_parts(chunk):
+            if getattr(part, "inline_data", None):
+                image_data = part.inline_data.data
+                image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
+            elif getattr(part, "text", None):
+                text_parts.append(part.text)
+                emit(sse_event("text", {"delta": part.text}))
+
+    if not image_data:
+        raise HTTPException(500, "AI failed to generate furniture placement image")
+    text_response = "".join(text_parts) or "No description available."
+    result = await save_placement(plan, image_data, image_mime_type, text_response)
+    return {**result, "model_seconds": time.perf_counter() - model_started_at}
+
+async def stream_place_furniture(plan: dict, design_id: str, user_room_id: str):
+    """SSE events for one placement: stage updates, description text as it arrives, then the image.
+
+    Goes through run_place_furniture, so a saved composite or an identical placement already
+    in flight is replayed as a short stream instead of starting another model call.
+    """
+    yield sse_event("stage", {"stage": "uploaded", "images": len(plan["items"])})
+
+    events = asyncio.Queue()
+    run = asyncio.ensure_future(run_place_furniture(plan, PreprocessReport(), emit=events.put_nowait))
+    try:
+        async for event in relay(events, run):
+            yield event
+        result = run.result()
+    finally:
+        # Only stops this caller waiting; a shared call keeps running for the others
+        run.cancel()
+
+    if result["cached"]:
+        yield sse_event("text", {"delta": result["text"]})
+    yield sse_event("stage", {
+        "stage": "persisted", "design_id": result["design_id"], "image_hash": result["image_hash"], "cached": result["cached"]
+    })
+    yield sse_event("image", {
+        "image": image_url(result) or to_data_url(result["image_data"], result["image_mime_type"]),
+        **placement_fields(result, design_id, user_room_id),
+    })
+
+def split_ids(furniture_ids: str) -> list[str]:
+    if not furniture_ids:
+        return []
+    return [fid.strip() for fid in furniture_ids.split(",") if fid.strip()]
+
+def split_descriptions(furniture_descriptions: str) -> list[str]:
+    return furniture_descriptions.split(",") if furniture_descriptions else []
 
-        # --- Parse AI output ---
-        image_data = None
-        text_response = "No description available."
-        image_mime_type = "image/png"
-
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, "inline_data") and part.inline_data:
-                    image_data = part.inline_data.data
-                    image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
-                elif hasattr(part, "text") and part.text:
-                    text_response = part.text
-
-        if not image_data:
-            raise HTTPException(500, "AI failed to generate furniture placement image")
+@router.post("/place-furniture")
+async def place_furniture(
+    request: Request,
+    session_id: str = Form(...),
+    design_id: str = Form(None),
+    user_room_id: str = Form(None),
+    placement_id: str = Form(None),
+    furniture_ids: str = Form(None),
+    furniture_images: list[UploadFile] = File([]),
+    furniture_descriptions: str = Form(""),
+    room_type: str = Form("empty"),
+    style: str = Form("neutral"),
+    mode: str = Form("sync")
+):
+    try:
+        set_call_context("place_furniture", session_id)
+        upload_budget = UploadBudget()
+        uploaded_images = []
+        for img in furniture_images:
+            data, _ = await read_image_upload(img, budget=upload_budget, field="furniture_images")
+            uploaded_images.append(data)
+
+        if mode == "job":
+            job_id = submit_or_503("place_furniture", {
+                "session_id": session_id,
+                "design_id": design_id,
+                "user_room_id": user_room_id,
+                "placement_id": placement_id,
+                "furniture_ids": split_ids(furniture_ids),
+                "uploaded_image_hashes": [
+                    columns["image_hash"] for columns in await asyncio.gather(*(
+                        asyncio.to_thread(store_image, data, derivatives=False) for data in uploaded_images
+                    ))
+                ],
+                "uploaded_descriptions": split_descriptions(furniture_descriptions),
+                "room_type": room_type,
+                "style": style,
+            })
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status_url": f"/api/jobs/{job_id}"})
+
+        plan = await plan_placement(
+            session_id, placement_id, design_id, user_room_id, split_ids(furniture_ids), uploaded_images,
+            split_descriptions(furniture_descriptions), room_type, style
+        )
+        if mode == "stream":
+            return sse_response(stream_place_furniture(plan, design_id, user_room_id), "/api/place-furniture")
+
+        preprocess_report = PreprocessReport()
+        result = await run_place_furniture(plan, preprocess_report)
+
+        headers = preprocess_report.headers(result["model_seconds"])
+        fields = placement_fields(result, design_id, user_room_id)
+        response_format = preferred_format(request.headers.get("accept"))
+        if response_format != JSON:
+            return image_response(
+                response_format, result["image_data"], result["image_mime_type"],
+                {**fields, "image_hash": result["image_hash"]}, url=image_url(result), headers=headers
+            )
 
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
-        image_url = f"data:{image_mime_type};base64,{image_base64}"
+        data_url = to_data_url(result["image_data"], result["image_mime_type"])
 
         return JSONResponse(content={
-            "image": image_url,
-            "text": text_response,
-            "original_design_id": design_id,
-            "user_room_id": user_room_id
-        })
+            "image": data_url,
+            **fields,
+        }, headers={**headers, "Vary": "Accept"})
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in furniture placement: {e}")
-        traceback.print_exc()
+        log_exception("place_furniture_failed", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    
-    
\ No newline at end of file
+
+@router.get("/placements/{design_id}/history")
+async def get_placement_history(design_id: str):
+    """Steps from the base room to this composite, oldest first.
+
+    Undo and redo move along this list; every step is a stored design, so no model call is needed.
+    """
+    try:
+        columns = ("id", "created_at", "design_metadata", "description", "image_hash")
+        row = await repository.designs.get(design_id, columns)
+        if not row:
+            raise HTTPException(status_code=404, detail="Placement not found")
+        placement = (row.get("design_metadata") or {}).get("placement") or {}
+        ancestors = placement.get("ancestors")
+        if ancestors is None:
+            # Saved before ancestors were recorded: only the parent is known
+            ancestors = [placement["parent_design_id"]] if placement.get("parent_design_id") else []
+        ancestors = ancestors[-(PLACEMENT_HISTORY_MAX_DEPTH - 1):] if PLACEMENT_HISTORY_MAX_DEPTH > 1 else []
+
+        # The base room may be a user room or a pooled room, which have no room_designs row
+        by_id = {found["id"]: found for found in await repository.designs.get_many(ancestors, columns)}
+        steps = []
+        for step in [*(by_id[ancestor] for ancestor in ancestors if ancestor in by_id), row]:
+            step_placement = (step.get("design_metadata") or {}).get("placement")
+            steps.append({
+                "design_id": step["id"],
+                "created_at": step.get("created_at"),
+                "parent_design_id": step_placement.get("parent_design_id") if step_placement else None,
+                "added": step_placement.get("added", []) if step_placement else [],
+                "text": step.get("description"),
+                "image_url": image_url(step),
+                "thumbnail_url": image_url(step, "thumb"),
+            })
+        return JSONResponse(content={"history": steps})
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_exception("placement_history_fetch_failed", e, design_id=design_id)
+        raise HTTPException(status_code=500, detail="Failed to fetch placement history")
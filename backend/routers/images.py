@@ -0,0 +1,123 @@
+from fastapi import APIRouter, HTTPException, Request, Response, Query
+from utils.blob_store import blob_store, BlobNotFound
+from utils import repository
+from utils.image_store import describe_image, load_image
+from utils.derivatives import VARIANTS, DERIVATIVE_VERSION, derivative_key, derivative_mime_type, output_format, schedule_derivatives
+import asyncio
+import re
+import traceback
+
+router = APIRouter()
+
+IMAGE_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Listing kind -> (table, base64 column) for rows that predate the blob store
+LEGACY_IMAGES = {
+    "design": (repository.designs, "generated_image_data"),
+    "furniture": (repository.furnitures, "image_base64"),
+}
+
+def parse_range(range_header: str, size: int):
+    """Returns (start, end) inclusive for a single-range header, None to ignore it, or raises 416."""
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def load_variant(image_hash: str, variant: str):
+    """Returns (data, mime_type, etag, immutable)."""
+    if variant != "original":
+        try:
+            data = blob_store.get(derivative_key(image_hash, variant))
+            return data, derivative_mime_type(), f'"{image_hash}-{variant}-{output_format()}-v{DERIVATIVE_VERSION}"', True
+        except BlobNotFound:
+            pass
+
+    data = blob_store.get(image_hash)
+    mime_type, width, _ = describe_image(data, "application/octet-stream")
+    if variant != "original":
+        # Variant not rendered yet: serve the original without pinning it in caches
+        if width:
+            schedule_derivatives(image_hash, data)
+        return data, mime_type, f'"{image_hash}"', False
+    return data, mime_type, f'"{image_hash}"', True
+
+@router.get("/images/{image_hash}")
+async def get_image(
+    request: Request,
+    image_hash: str,
+    variant: str = Query("original")
+):
+    if not IMAGE_HASH_PATTERN.match(image_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if variant != "original" and variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown variant: {variant}")
+
+    try:
+        # Blob reads (local disk or Supabase Storage) block, so they run in a worker thread
+        data, mime_type, etag, immutable = await asyncio.to_thread(load_variant, image_hash, variant)
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except Exception as e:
+        print(f"Error reading image {image_hash}: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to fetch image")
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else "no-cache",
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(range_header, len(data))
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(content=data[start:end + 1], status_code=206, media_type=mime_type, headers=headers)
+
+    return Response(content=data, media_type=mime_type, headers=headers)
+
+@router.get("/images/legacy/{kind}/{row_id}")
+async def get_legacy_image(kind: str, row_id: str):
+    """Serves a row's image by id, for rows not yet moved to the blob store by scripts.migrate_images_to_blobs."""
+    if kind not in LEGACY_IMAGES:
+        raise HTTPException(status_code=404, detail="Image not found")
+    table, column = LEGACY_IMAGES[kind]
+
+    try:
+        row = await table.get(row_id, ("id", column, "image_hash"))
+        data = await asyncio.to_thread(load_image, row, column) if row else None
+    except BlobNotFound:
+        data = None
+    except Exception as e:
+        print(f"Error reading {kind} image {row_id}: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="Failed to fetch image")
+    if not data:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    mime_type, _, _ = describe_image(data, "image/png")
+    # The row may be migrated later, so the response is revalidated rather than pinned
+    return Response(content=data, media_type=mime_type, headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException, Query
+from utils.jobs import job_queue
+
+router = APIRouter()
+
+MAX_WAIT_SECONDS = 30.0
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS)):
+    """Job status; with `wait`, holds the request open until the job finishes or the wait runs out."""
+    job = await job_queue.wait(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,74 +1,66 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
-from utils.base64_helpers import array_buffer_to_base64
-from utils.db_client import supabase
-from dotenv import load_dotenv
+from utils.blob_store import blob_store
+from utils.base64_helpers import to_data_url
+from utils import repository
+from utils.clients import gemini
+from utils.model_calls import generate_content, generate_content_stream, response_parts, summarize_parts, set_call_context
+from utils.logs import log_event, log_exception
+from utils.metrics import register_cache
+from utils.image_store import store_image, image_url
+from utils.uploads import read_image_upload
+from utils.preprocess import prepare_for_model, PreprocessReport
+from utils.cache import ByteLRUCache
+from utils.singleflight import SingleFlight
+from utils.jobs import job_queue, submit_or_503
+from utils.sse import sse_event, sse_response, relay
+from utils.negotiation import preferred_format, image_response, JSON
 import os
-from google import genai
 from google.genai import types
-import traceback
-import base64
-
-load_dotenv()
+import time
+import hashlib
+import asyncio
+import json
 
 router = APIRouter()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("Missing GEMINI_API_KEY in .env")
+TRYON_MODEL = "gemini-2.5-flash-image"
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Finished try-on results keyed on image hash + normalized parameters
+tryon_cache = ByteLRUCache(
+    int(float(os.getenv("TRYON_CACHE_MB", "128")) * 1024 * 1024),
+    ttl_seconds=float(os.getenv("TRYON_CACHE_TTL_SECONDS", "3600")),
+)
+register_cache("try_on_results", tryon_cache)
+tryon_flight = SingleFlight()
 
-@router.post("/try-on")
-async def try_on(
-    place_image: UploadFile = File(...),
-    design_type: str = Form(...),
-    room_type: str = Form(...),
-    style: str = Form(...),
-    background_color: str = Form(...),
-    foreground_color: str = Form(...),
-    instructions: str = Form(""),
-    session_id: str = Form(...)
-):
-    try:
-        
-        MAX_IMAGE_SIZE_MB = 10
-        ALLOWED_MIME_TYPES = {
-            "image/jpeg",
-            "image/png",
-            "image/webp",
-            "image/heic",
-            "image/heif",
-        }
-
-        if place_image.content_type not in ALLOWED_MIME_TYPES:
-            raise HTTPException(
-                status_code=400, detail=f"Unsupported file type for place_image: {place_image.content_type}"
-            )
+TRYON_BATCH_MAX_VARIANTS = int(os.getenv("TRYON_BATCH_MAX_VARIANTS", "6"))
+PARAM_FIELDS = ("design_type", "room_type", "style", "background_color", "foreground_color", "instructions")
 
-        place_bytes = await place_image.read()
+def normalize_params(params: dict) -> dict:
+    """Canonical form of the design parameters, used only for cache keys."""
+    normalized = {key: " ".join(str(value).split()).lower() for key, value in params.items()}
+    normalized["instructions"] = " ".join(params.get("instructions", "").split())
+    return normalized
 
-        size_in_mb_for_place_image = len(place_bytes) / (1024 * 1024)
-        if size_in_mb_for_place_image > MAX_IMAGE_SIZE_MB:
-            raise HTTPException(status_code=400, detail="Image exceeds 10MB size limit for place_image")
-        
-       
-        place_b64 = array_buffer_to_base64(place_bytes)
+def cache_key(image_hash: str, params: dict) -> str:
+    return image_hash + ":" + hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
 
-        prompt = f"""
+def build_prompt(params: dict) -> str:
+    return f"""
         You are a professional AI interior and exterior designer.
         Your task is to redesign a user's uploaded space.
 
         ### User Input
-        - **Design Type:** {design_type}
-        - **Room Type:** {room_type}
-        - **Style:** {style}
-        - **Background Color Preference:** {background_color}
-        - **Foreground Color Preference:** {foreground_color}
-        - **Instructions:** {instructions}
+        - **Design Type:** {params["design_type"]}
+        - **Room Type:** {params["room_type"]}
+        - **Style:** {params["style"]}
+        - **Background Color Preference:** {params["background_color"]}
+        - **Foreground Color Preference:** {params["foreground_color"]}
+        - **Instructions:** {params["instructions"]}
 
         ### Objective:
-        1. Apply the chosen design style (e.g., {style}) to the uploaded {room_type}.
+        1. Apply the chosen design style (e.g., {params["style"]}) to the uploaded {params["room_type"]}.
         2. Enhance the space visually while respecting the structure of the original layout.
         3. Harmonize background/foreground color preferences subtly in the decor.
         4. Produce a **photo-realistic redesign image** and a **short textual description**.
@@ -84,95 +76,461 @@ async def try_on(
         - A realistic redesigned image of the space.
         - A short caption describing the redesign, highlighting how it aligns with the selected preferences and suggesting improvements.
         """
-               
-   
-        
-        print(prompt)
-
-        contents=[
-            prompt,
-            types.Part.from_bytes(
-                data=place_b64,
-                mime_type= place_image.content_type,
-            )
-        ]        
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image",
-            contents=contents,
-            config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
-            )
+
+def parse_design_response(response):
+    """Returns (image_data, image_mime_type, text) from a generate_content response."""
+    image_data = None
+    image_mime_type = "image/png"
+    text_response = "No Description available."
+    parts = response_parts(response)
+    for part in parts:
+        if hasattr(part, "inline_data") and part.inline_data:
+            image_data = part.inline_data.data
+            image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
+        elif hasattr(part, "text") and part.text:
+            text_response = part.text
+
+    if not parts:
+        log_event("try_on_empty_response", candidates=len(response.candidates or []))
+    return image_data, image_mime_type, text_response
+
+def design_row(session_id: str, image_data: bytes, image_mime_type: str, params: dict, text_response: str) -> dict:
+    """Stores the image blob and returns the room_designs row that points at it."""
+    return {
+        "session_id": session_id,
+        **store_image(image_data, image_mime_type),
+        "design_metadata": params,
+        "description": text_response
+    }
+
+async def save_design(session_id: str, image_data: bytes, image_mime_type: str, params: dict, text_response: str):
+    """Inserts a room_designs row; returns (design_id, image_hash). Failures are logged, not raised."""
+    design_id = None
+    image_hash = None
+    try:
+        row = await asyncio.to_thread(design_row, session_id, image_data, image_mime_type, params, text_response)
+        image_hash = row["image_hash"]
+        inserted = await repository.designs.insert(row)
+
+        if inserted:
+            design_id = inserted[0].get("id")
+            log_event("design_saved", debug=True, design_id=design_id)
+    except Exception as db_error:
+        log_exception("design_save_failed", db_error)
+    return design_id, image_hash
+
+async def save_designs(session_id: str, items: list[tuple]) -> list[tuple]:
+    """Bulk version of save_design for (image_data, image_mime_type, params, text) tuples.
+
+    All rows go in one insert; returns (design_id, image_hash) per input, in order.
+    """
+    saved = [(None, None)] * len(items)
+    try:
+        rows = list(await asyncio.gather(*(
+            asyncio.to_thread(design_row, session_id, image_data, image_mime_type, params, text_response)
+            for image_data, image_mime_type, params, text_response in items
+        )))
+        saved = [(None, row["image_hash"]) for row in rows]
+        inserted = await repository.designs.insert(rows)
+
+        # Inserted rows come back in the order they were sent
+        for idx, record in enumerate(inserted):
+            saved[idx] = (record.get("id"), rows[idx]["image_hash"])
+        log_event("designs_saved", debug=True, count=len(inserted))
+    except Exception as db_error:
+        log_exception("designs_save_failed", db_error, count=len(items))
+    return saved
+
+def build_contents(model_bytes: bytes, model_mime_type: str, params: dict) -> list:
+    prompt = build_prompt(params)
+    log_event("try_on_prompt", debug=True, prompt=prompt)
+
+    return [
+        prompt,
+        types.Part.from_bytes(
+            data=model_bytes,
+            mime_type=model_mime_type,
         )
+    ]
 
+async def prepare_contents(place_bytes: bytes, place_mime_type: str, params: dict, report: PreprocessReport) -> list:
+    model_bytes, model_mime_type = await prepare_for_model(place_bytes, place_mime_type, TRYON_MODEL, report)
+    return build_contents(model_bytes, model_mime_type, params)
 
-        print(response)
-        
-        image_data = None
-        text_response = "No Description available."
-        if response.candidates and len(response.candidates) > 0:
-            parts = response.candidates[0].content.parts
+async def call_design_model(contents: list):
+    """Returns (image_data, image_mime_type, text, model_seconds)."""
+    model_started_at = time.perf_counter()
+    response = await generate_content(
+        gemini(),
+        model=TRYON_MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(
+        response_modalities=['TEXT', 'IMAGE']
+        )
+    )
+    model_seconds = time.perf_counter() - model_started_at
+    log_event("try_on_response", debug=True, parts=summarize_parts(response_parts(response)))
 
-            if parts:
-                print("Number of parts in response:", len(parts))
+    return (*parse_design_response(response), model_seconds)
 
-                for part in parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        image_data = part.inline_data.data
-                        image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
-                        print("Image data received, length:", len(image_data))
-                        print("MIME type:", image_mime_type)
+async def generate_design(place_bytes: bytes, place_mime_type: str, params: dict, session_id: str, report: PreprocessReport) -> dict:
+    contents = await prepare_contents(place_bytes, place_mime_type, params, report)
+    image_data, image_mime_type, text_response, model_seconds = await call_design_model(contents)
+    log_event(
+        "try_on",
+        bytes_original=report.original_bytes,
+        bytes_sent=report.sent_bytes,
+        preprocess_seconds=round(report.seconds, 3),
+        model_seconds=round(model_seconds, 2),
+    )
 
-                    elif hasattr(part, "text") and part.text:
-                        text_response = part.text
-                        preview = (text_response[:100] + "...") if len(text_response) > 100 else text_response
-                        print("Text response received:", preview)
-            else:
-                print("No parts found in the response candidate.")
-        else:
-            print("No candidates found in the API response.")
+    design_id = None
+    image_hash = None
+    if image_data:
+        design_id, image_hash = await save_design(session_id, image_data, image_mime_type, params, text_response)
 
-        image_url = None
-        generated_image_base64 = None
-        if image_data:
-            generated_image_base64 = base64.b64encode(image_data).decode("utf-8")
-            image_url = f"data:{image_mime_type};base64,{generated_image_base64}"
+    return {
+        "image_data": image_data,
+        "image_mime_type": image_mime_type,
+        "text": text_response,
+        "design_id": design_id,
+        "image_hash": image_hash,
+        "session_id": session_id,
+        "model_seconds": model_seconds,
+    }
+
+async def run_try_on(place_bytes: bytes, place_mime_type: str, params: dict, session_id: str, report: PreprocessReport, emit=None) -> dict:
+    """Generates (or reuses) a design for these inputs.
+
+    Identical submissions share one cached result, and concurrent ones wait on a single
+    upstream call. A cached design from another session is re-saved as a row for this
+    session, pointing at the same blob. With `emit`, a call started here streams from the
+    model and passes its SSE events to `emit`; a joined or cached call emits nothing.
+    """
+    key = cache_key(hashlib.sha256(place_bytes).hexdigest(), normalize_params(params))
+    result = tryon_cache.get(key)
+    cached = result is not None
+    if not cached:
+        if emit is None:
+            generate = lambda: generate_design(place_bytes, place_mime_type, params, session_id, report)
         else:
-            image_url = None
+            generate = lambda: stream_design(place_bytes, place_mime_type, params, session_id, report, emit)
+        result, cached = await tryon_flight.do(key, generate)
+        if not cached and result["image_data"] and result["design_id"]:
+            size = len(result["image_data"]) + len(result["text"])
+            tryon_cache.set(key, result, size)
+
+    if cached and result["image_data"] and (result["session_id"] != session_id or not result["design_id"]):
+        design_id, image_hash = await save_design(session_id, result["image_data"], result["image_mime_type"], params, result["text"])
+        result = {**result, "design_id": design_id, "image_hash": image_hash, "session_id": session_id}
+
+    return {**result, "cached": cached}
+
+async def run_try_on_job(payload: dict) -> dict:
+    set_call_context("try_on", payload["session_id"])
+    place_bytes = await asyncio.to_thread(blob_store.get, payload["image_hash"])
+    result = await run_try_on(
+        place_bytes, payload["image_mime_type"], payload["params"], payload["session_id"], PreprocessReport()
+    )
+    if not result["image_data"]:
+        raise HTTPException(status_code=502, detail="Model returned no image")
+    return {
+        "design_id": result["design_id"],
+        "image_hash": result["image_hash"],
+        "image_url": image_url(result),
+        "text": result["text"],
+        "cached": result["cached"],
+    }
+
+job_queue.register("try_on", run_try_on_job)
+
+def result_image(result: dict) -> str:
+    """Binary endpoint URL of a stored result, or an inline data URL if storing it failed."""
+    url = image_url(result)
+    if url:
+        return url
+    return to_data_url(result["image_data"], result["image_mime_type"])
+
+async def stream_design(place_bytes: bytes, place_mime_type: str, params: dict, session_id: str, report: PreprocessReport, emit) -> dict:
+    """generate_design from the streaming model call, passing stage and text events to `emit` as they happen."""
+    emit(sse_event("stage", {"stage": "preprocessing"}))
+    contents = await prepare_contents(place_bytes, place_mime_type, params, report)
+
+    emit(sse_event("stage", {"stage": "model_started", "bytes_sent": report.sent_bytes}))
+    model_started_at = time.perf_counter()
+    image_data = None
+    image_mime_type = "image/png"
+    text_parts = []
+    async for chunk in generate_content_stream(
+        gemini(),
+        model=TRYON_MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+    ):
+        for part in response_parts(chunk):
+            if getattr(part, "inline_data", None):
+                image_data = part.inline_data.data
+                image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
+            elif getattr(part, "text", None):
+                text_parts.append(part.text)
+                emit(sse_event("text", {"delta": part.text}))
+
+    if not image_data:
+        raise HTTPException(status_code=502, detail="Model returned no image")
+    text_response = "".join(text_parts) or "No Description available."
+
+    design_id, image_hash = await save_design(session_id, image_data, image_mime_type, params, text_response)
+    return {
+        "image_data": image_data,
+        "image_mime_type": image_mime_type,
+        "text": text_response,
+        "design_id": design_id,
+        "image_hash": image_hash,
+        "session_id": session_id,
+        "model_seconds": time.perf_counter() - model_started_at,
+    }
+
+async def stream_try_on(place_bytes: bytes, place_mime_type: str, params: dict, session_id: str):
+    """SSE events for one try-on: stage updates, description text as it arrives, then the image.
+
+    Goes through run_try_on, so a cached result or an identical call already in flight is
+    replayed as a short stream instead of starting another model call.
+    """
+    yield sse_event("stage", {"stage": "uploaded", "bytes": len(place_bytes)})
+
+    events = asyncio.Queue()
+    run = asyncio.ensure_future(
+        run_try_on(place_bytes, place_mime_type, params, session_id, PreprocessReport(), emit=events.put_nowait)
+    )
+    try:
+        async for event in relay(events, run):
+            yield event
+        result = run.result()
+    finally:
+        # Only stops this caller waiting; a shared call keeps running for the others
+        run.cancel()
+
+    if not result["image_data"]:
+        raise HTTPException(status_code=502, detail="Model returned no image")
+    if result["cached"]:
+        yield sse_event("text", {"delta": result["text"]})
+    yield sse_event("stage", {"stage": "persisted", "design_id": result["design_id"], "cached": result["cached"]})
+    yield sse_event("image", {"image": result_image(result), "text": result["text"], "design_id": result["design_id"]})
+
+def parse_variants(variants: str, defaults: dict) -> list[dict]:
+    """Parses the JSON list of variant parameter sets; fields a variant leaves out come from `defaults`."""
+    try:
+        items = json.loads(variants)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="variants must be a JSON list of parameter objects")
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise HTTPException(status_code=400, detail="variants must be a JSON list of parameter objects")
+    if len(items) > TRYON_BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"At most {TRYON_BATCH_MAX_VARIANTS} variants per request")
+
+    params_list = []
+    for idx, item in enumerate(items):
+        params = {field: item.get(field, defaults.get(field)) for field in PARAM_FIELDS}
+        missing = [field for field, value in params.items() if value is None]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Variant {idx} is missing: {', '.join(missing)}")
+        params_list.append({field: str(value) for field, value in params.items()})
+    return params_list
+
+async def run_try_on_batch(place_bytes: bytes, place_mime_type: str, params_list: list[dict], session_id: str, report: PreprocessReport) -> list[dict]:
+    """Generates one design per parameter set from a single preprocessed copy of the image.
 
-        design_id = None
-        if generated_image_base64:
-            try:
-                design_record = supabase.table("room_designs").insert({
+    Variants run concurrently under the shared model limiter, new rows are written in one
+    insert, and a failed variant carries an `error` instead of failing the batch.
+    """
+    image_hash = hashlib.sha256(place_bytes).hexdigest()
+    keys = [cache_key(image_hash, normalize_params(params)) for params in params_list]
+    results = [tryon_cache.get(key) for key in keys]
+    cached = [result is not None for result in results]
+    errors = [None] * len(params_list)
+
+    # One model call per distinct parameter set that is not cached yet
+    pending = {}
+    for idx, key in enumerate(keys):
+        if results[idx] is None:
+            pending.setdefault(key, []).append(idx)
+
+    if pending:
+        model_bytes, model_mime_type = await prepare_for_model(place_bytes, place_mime_type, TRYON_MODEL, report)
+        outcomes = await asyncio.gather(*(
+            call_design_model(build_contents(model_bytes, model_mime_type, params_list[indexes[0]]))
+            for indexes in pending.values()
+        ), return_exceptions=True)
+
+        for indexes, outcome in zip(pending.values(), outcomes):
+            if isinstance(outcome, Exception):
+                log_exception("try_on_variant_failed", outcome, style=params_list[indexes[0]]["style"])
+                error = "Model call failed"
+            elif not outcome[0]:
+                error = "Model returned no image"
+            else:
+                error = None
+            for idx in indexes:
+                if error:
+                    errors[idx] = error
+                    continue
+                image_data, image_mime_type, text_response, model_seconds = outcome
+                results[idx] = {
+                    "image_data": image_data,
+                    "image_mime_type": image_mime_type,
+                    "text": text_response,
+                    "design_id": None,
+                    "image_hash": None,
                     "session_id": session_id,
-                    "generated_image_data": generated_image_base64,
-                    "design_metadata": {
-                        "design_type": design_type,
-                        "room_type": room_type,
-                        "style": style,
-                        "background_color": background_color,
-                        "foreground_color": foreground_color,
-                        "instructions": instructions
-                    },
-                    "description": text_response
-                }).execute()
-
-                if design_record.data and len(design_record.data) > 0:
-                    design_id = design_record.data[0].get("id")
-                    print(f"Design saved to database with ID: {design_id}")
-            except Exception as db_error:
-                print(f"Failed to save design to database: {db_error}")
-                traceback.print_exc()
+                    "model_seconds": model_seconds,
+                }
+
+    to_save = [
+        idx for idx, result in enumerate(results)
+        if result is not None and (result["session_id"] != session_id or not result["design_id"])
+    ]
+    saved = await save_designs(session_id, [
+        (results[idx]["image_data"], results[idx]["image_mime_type"], params_list[idx], results[idx]["text"])
+        for idx in to_save
+    ])
+    for idx, (design_id, saved_hash) in zip(to_save, saved):
+        results[idx] = {**results[idx], "design_id": design_id, "image_hash": saved_hash, "session_id": session_id}
+        if not cached[idx] and design_id:
+            tryon_cache.set(keys[idx], results[idx], len(results[idx]["image_data"]) + len(results[idx]["text"]))
+
+    return [
+        {**(result or {}), "params": params, "cached": was_cached, "error": error}
+        for result, params, was_cached, error in zip(results, params_list, cached, errors)
+    ]
+
+@router.post("/try-on")
+async def try_on(
+    request: Request,
+    place_image: UploadFile = File(...),
+    design_type: str = Form(...),
+    room_type: str = Form(...),
+    style: str = Form(...),
+    background_color: str = Form(...),
+    foreground_color: str = Form(...),
+    instructions: str = Form(""),
+    session_id: str = Form(...),
+    mode: str = Form("sync")
+):
+    try:
+        set_call_context("try_on", session_id)
+        place_bytes, place_mime_type = await read_image_upload(place_image, field="place_image")
+
+        params = {
+            "design_type": design_type,
+            "room_type": room_type,
+            "style": style,
+            "background_color": background_color,
+            "foreground_color": foreground_color,
+            "instructions": instructions
+        }
+
+        if mode == "job":
+            # Keep only the blob hash in the job payload; the worker reads the bytes back
+            place_columns = await asyncio.to_thread(store_image, place_bytes, place_mime_type, derivatives=False)
+            job_id = submit_or_503("try_on", {
+                "image_hash": place_columns["image_hash"],
+                "image_mime_type": place_mime_type,
+                "params": params,
+                "session_id": session_id,
+            })
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status_url": f"/api/jobs/{job_id}"})
+        if mode == "stream":
+            return sse_response(stream_try_on(place_bytes, place_mime_type, params, session_id), "/api/try-on")
+
+        preprocess_report = PreprocessReport()
+        result = await run_try_on(place_bytes, place_mime_type, params, session_id, preprocess_report)
+
+        headers = preprocess_report.headers(None if result["cached"] else result["model_seconds"])
+        headers["X-Cache"] = "HIT" if result["cached"] else "MISS"
+
+        response_format = preferred_format(request.headers.get("accept"))
+        if response_format != JSON:
+            if not result["image_data"]:
+                raise HTTPException(status_code=502, detail="Model returned no image")
+            return image_response(
+                response_format, result["image_data"], result["image_mime_type"],
+                {"text": result["text"], "design_id": result["design_id"], "image_hash": result["image_hash"]},
+                url=image_url(result), headers=headers,
+            )
+
+        data_url = None
+        if result["image_data"]:
+            data_url = to_data_url(result["image_data"], result["image_mime_type"])
 
         return JSONResponse(
         content={
-            "image": image_url,
-            "text": text_response,
-            "design_id": design_id
+            "image": data_url,
+            "text": result["text"],
+            "design_id": result["design_id"]
+        },
+        headers={**headers, "Vary": "Accept"}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_exception("try_on_failed", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post("/try-on/batch")
+async def try_on_batch(
+    place_image: UploadFile = File(...),
+    variants: str = Form(...),
+    session_id: str = Form(...),
+    design_type: str = Form(None),
+    room_type: str = Form(None),
+    style: str = Form(None),
+    background_color: str = Form(None),
+    foreground_color: str = Form(None),
+    instructions: str = Form("")
+):
+    try:
+        set_call_context("try_on_batch", session_id)
+        place_bytes, place_mime_type = await read_image_upload(place_image, field="place_image")
+
+        defaults = {
+            "design_type": design_type,
+            "room_type": room_type,
+            "style": style,
+            "background_color": background_color,
+            "foreground_color": foreground_color,
+            "instructions": instructions
         }
+        params_list = parse_variants(variants, defaults)
+
+        preprocess_report = PreprocessReport()
+        results = await run_try_on_batch(place_bytes, place_mime_type, params_list, session_id, preprocess_report)
+
+        items = []
+        for result in results:
+            if result["error"]:
+                items.append({"params": result["params"], "error": result["error"]})
+                continue
+            items.append({
+                "params": result["params"],
+                "image": result_image(result),
+                "text": result["text"],
+                "design_id": result["design_id"],
+                "cached": result["cached"]
+            })
+
+        model_seconds = [result["model_seconds"] for result in results if not result["error"] and not result["cached"]]
+        return JSONResponse(
+        content={
+            "results": items,
+            "succeeded": sum(1 for result in results if not result["error"]),
+            "failed": sum(1 for result in results if result["error"])
+        },
+        headers=preprocess_report.headers(max(model_seconds) if model_seconds else None)
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in /api/try-on endpoint: {e}")
-        traceback.print_exc()
+        log_exception("try_on_batch_failed", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
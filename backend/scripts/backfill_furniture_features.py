@@ -0,0 +1,68 @@
+"""Stores similarity features for furniture images uploaded before features were computed at upload.
+
+The furniture index only loads stored features, so rows without them are left out of
+similar-item and search results until this has run (and the workers have restarted).
+Rows are read oldest first in keyset-paginated batches. Images that already have features
+are skipped, so the script can be stopped and re-run.
+
+Usage (from backend/):
+    python -m scripts.backfill_furniture_features [--batch-size 50] [--dry-run]
+"""
+import argparse
+import asyncio
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils import repository
+from utils.blob_store import blob_store
+from utils.clients import clients
+from utils.similarity import compute_features, features_key, store_features
+
+
+async def backfill(batch_size: int, dry_run: bool):
+    computed = 0
+    failed = 0
+    after = None
+
+    while True:
+        rows = await repository.furnitures.page_after(("id", "created_at", "image_hash"), batch_size, after)
+        if not rows:
+            break
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+        for row in rows:
+            image_hash = row.get("image_hash")
+            if not image_hash or blob_store.exists(features_key(image_hash)):
+                continue
+            if dry_run:
+                computed += 1
+                continue
+            try:
+                embedding, phash = await asyncio.to_thread(compute_features, blob_store.get(image_hash))
+                await asyncio.to_thread(store_features, image_hash, embedding, phash)
+                computed += 1
+            except Exception as e:
+                failed += 1
+                print(f"Failed to compute features for furniture {row['id']}: {e}")
+                traceback.print_exc()
+
+        print(f"computed={computed} failed={failed}")
+
+    await clients.close()
+    return computed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store similarity features for existing furniture images")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the images missing features")
+    args = parser.parse_args()
+
+    computed, failed = asyncio.run(backfill(args.batch_size, args.dry_run))
+    print(f"done: {'missing' if args.dry_run else 'computed'}={computed} failed={failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Moves base64 image columns into the blob store.
+
+Rows are read in small keyset-paginated batches (ordered by id) so the whole
+table is never held in memory. Each row is decoded, written to the blob store
+and updated with its hash/MIME/dimensions; the legacy column is cleared unless
+--keep-legacy is given.
+
+Usage (from backend/):
+    python -m scripts.migrate_images_to_blobs [--batch-size 20] [--table furnitures] [--dry-run]
+"""
+import argparse
+import base64
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.db_client import supabase
+from utils.image_store import store_image
+
+TABLES = {
+    "room_designs": "generated_image_data",
+    "furnitures": "image_base64",
+}
+
+
+def iter_legacy_rows(table: str, legacy_column: str, batch_size: int):
+    last_id = None
+    while True:
+        query = supabase().table(table).select(f"id, {legacy_column}") \
+            .is_("image_hash", "null") \
+            .not_.is_(legacy_column, "null") \
+            .order("id") \
+            .limit(batch_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def migrate_table(table: str, legacy_column: str, batch_size: int, dry_run: bool, keep_legacy: bool):
+    migrated = 0
+    failed = 0
+    bytes_moved = 0
+
+    for rows in iter_legacy_rows(table, legacy_column, batch_size):
+        for row in rows:
+            try:
+                data = base64.b64decode(row[legacy_column])
+                if dry_run:
+                    migrated += 1
+                    bytes_moved += len(data)
+                    continue
+
+                update = store_image(data)
+                if not keep_legacy:
+                    update[legacy_column] = None
+                supabase().table(table).update(update).eq("id", row["id"]).execute()
+                migrated += 1
+                bytes_moved += len(data)
+            except Exception as e:
+                failed += 1
+                print(f"[{table}] Failed to migrate row {row['id']}: {e}")
+                traceback.print_exc()
+            finally:
+                row.pop(legacy_column, None)
+
+        print(f"[{table}] migrated={migrated} failed={failed} bytes={bytes_moved}")
+
+    return migrated, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move base64 image columns into the blob store")
+    parser.add_argument("--table", choices=sorted(TABLES), action="append")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--keep-legacy", action="store_true", help="Do not clear the base64 column after copying")
+    args = parser.parse_args()
+
+    for table in args.table or list(TABLES):
+        migrated, failed = migrate_table(table, TABLES[table], args.batch_size, args.dry_run, args.keep_legacy)
+        print(f"[{table}] done: migrated={migrated} failed={failed}")
+
+
+if __name__ == "__main__":
+    main()
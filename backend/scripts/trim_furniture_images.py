@@ -0,0 +1,70 @@
+"""Stores trimmed copies of furniture images uploaded before upload-time trimming existed.
+
+Rows are read oldest first in keyset-paginated batches. Images that already have a
+trimmed copy are skipped, so the script can be stopped and re-run.
+
+Usage (from backend/):
+    python -m scripts.trim_furniture_images [--batch-size 50] [--dry-run]
+"""
+import argparse
+import asyncio
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils import repository
+from utils.blob_store import blob_store
+from utils.clients import clients
+from utils.trim import store_trimmed, trim_image, trimmed_key
+
+
+async def trim_existing(batch_size: int, dry_run: bool):
+    trimmed = 0
+    kept = 0
+    failed = 0
+    after = None
+
+    while True:
+        rows = await repository.furnitures.page_after(("id", "created_at", "image_hash"), batch_size, after)
+        if not rows:
+            break
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+        for row in rows:
+            image_hash = row.get("image_hash")
+            if not image_hash or blob_store.exists(trimmed_key(image_hash)):
+                continue
+            try:
+                data = blob_store.get(image_hash)
+                if dry_run:
+                    done = await asyncio.to_thread(trim_image, data) is not None
+                else:
+                    done = await asyncio.to_thread(store_trimmed, image_hash, data)
+                if done:
+                    trimmed += 1
+                else:
+                    kept += 1
+            except Exception as e:
+                failed += 1
+                print(f"Failed to trim furniture {row['id']}: {e}")
+                traceback.print_exc()
+
+        print(f"trimmed={trimmed} kept={kept} failed={failed}")
+
+    await clients.close()
+    return trimmed, kept, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store trimmed copies of existing furniture images")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--dry-run", action="store_true", help="Only report which images would be trimmed")
+    args = parser.parse_args()
+
+    trimmed, kept, failed = asyncio.run(trim_existing(args.batch_size, args.dry_run))
+    print(f"done: trimmed={trimmed} kept={kept} failed={failed}")
+
+
+if __name__ == "__main__":
+    main()
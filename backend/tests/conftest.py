@@ -0,0 +1,20 @@
+"""Test settings, applied before any app module reads its configuration at import.
+
+Everything runs offline: the data layer is SQLite and blobs go to a temporary directory.
+"""
+import os
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="ati-tests-")
+
+os.environ.update({
+    "DB_BACKEND": "sqlite",
+    "DB_SQLITE_PATH": os.path.join(_data_dir, "app.sqlite3"),
+    "BLOB_STORE_BACKEND": "local",
+    "BLOB_STORE_DIR": os.path.join(_data_dir, "blobs"),
+    "JOBS_DB_PATH": os.path.join(_data_dir, "jobs.sqlite3"),
+    "ROOM_POOL_ENABLED": "false",
+    "ROOM_POOL_DB_PATH": os.path.join(_data_dir, "room_pool.sqlite3"),
+    "CATALOG_DB_PATH": os.path.join(_data_dir, "catalog.sqlite3"),
+    "PREWARM_CLIENTS": "false",
+})
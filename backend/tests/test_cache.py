@@ -0,0 +1,121 @@
+from utils.cache import TTLCache, ByteLRUCache, BKTree, NearestHashCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expired_entry_is_a_miss():
+    cache = TTLCache(max_entries=4, ttl_seconds=-1)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_byte_lru_cache_evicts_by_total_size():
+    cache = ByteLRUCache(max_bytes=10)
+    cache.set("a", "A", 4)
+    cache.set("b", "B", 4)
+    cache.get("a")
+    cache.set("c", "C", 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.current_bytes == 8
+
+
+def test_byte_lru_cache_replacing_a_key_updates_its_size():
+    cache = ByteLRUCache(max_bytes=10)
+    cache.set("a", "small", 2)
+    cache.set("a", "large", 7)
+
+    assert cache.current_bytes == 7
+    assert cache.pop("a") == "large"
+    assert cache.current_bytes == 0
+
+
+def test_byte_lru_cache_skips_values_larger_than_the_budget():
+    cache = ByteLRUCache(max_bytes=10)
+    cache.set("a", "A", 4)
+    cache.set("huge", "H", 11)
+
+    assert cache.get("huge") is None
+    assert cache.get("a") == "A"
+
+
+def test_byte_lru_cache_expired_entry_frees_its_bytes():
+    cache = ByteLRUCache(max_bytes=10, ttl_seconds=-1)
+    cache.set("a", "A", 4)
+
+    assert cache.get("a") is None
+    assert cache.current_bytes == 0
+
+
+def test_bk_tree_finds_every_hash_within_the_radius():
+    tree = BKTree()
+    hashes = [0b0000, 0b0001, 0b0011, 0b0111, 0b1111, 0b1111 << 20]
+    for value in hashes + [0b0001]:
+        tree.add(value)
+
+    assert tree.size == len(hashes)
+    assert tree.search(0b0000, 2) == [(0, 0b0000), (1, 0b0001), (2, 0b0011)]
+    assert tree.search(0b1111 << 20, 0) == [(0, 0b1111 << 20)]
+    assert BKTree().search(0, 64) == []
+
+
+def test_bk_tree_search_matches_a_full_scan():
+    values = [(idx * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF for idx in range(300)]
+    tree = BKTree()
+    for value in values:
+        tree.add(value)
+    probe = values[17] ^ 0b101
+
+    expected = sorted(((value ^ probe).bit_count(), value) for value in set(values) if (value ^ probe).bit_count() <= 12)
+    assert tree.search(probe, 12) == expected
+
+
+def test_nearest_hash_cache_returns_the_closest_entry_within_range():
+    cache = NearestHashCache(max_entries=8, ttl_seconds=60, max_distance=3)
+    cache.set(0b0000_0000, "far")
+    cache.set(0b1111_0000, "near")
+
+    assert cache.get(0b1111_0001) == "near"
+    assert cache.get(0b0000_0111) == "far"
+    assert cache.get(0b0101_0101) is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_nearest_hash_cache_skips_evicted_and_expired_entries():
+    cache = NearestHashCache(max_entries=1, ttl_seconds=60, max_distance=4)
+    cache.set(0b0000, "old")
+    cache.set(0b1111_0000_0000, "new")
+
+    assert cache.get(0b0001) is None
+    assert cache.get(0b1111_0000_0001) == "new"
+
+    expired = NearestHashCache(max_entries=4, ttl_seconds=-1, max_distance=4)
+    expired.set(0b0000, "value")
+    assert expired.get(0b0000) is None
+    assert len(expired) == 0
+
+
+def test_nearest_hash_cache_rebuilds_its_tree_once_evictions_pile_up():
+    cache = NearestHashCache(max_entries=2, ttl_seconds=60, max_distance=0)
+    for value in range(200):
+        cache.set(value, value)
+
+    assert len(cache) == 2
+    assert cache.stats()["indexed_hashes"] <= 2 * len(cache) + 64
+    assert cache.get(199) == 199
+    assert cache.get(0) is None
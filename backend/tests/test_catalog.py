@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from utils import catalog
+from utils.catalog import ProductCatalog
+
+
+def product(title, link=None):
+    return {"title": title, "link": link or f"https://shop.example/{title.replace(' ', '-')}", "price": "$10", "source": "Shop", "thumbnail": None}
+
+
+@pytest.fixture
+def products(tmp_path):
+    return ProductCatalog(str(tmp_path / "catalog.sqlite3"))
+
+
+def titles(found):
+    return [item["title"] for item in found]
+
+
+def test_exact_query_hits_come_first_in_their_original_order(products):
+    products.record("sofa", "grey velvet sofa", [product("Velvet sofa B"), product("Velvet sofa A")])
+    products.record("chair", "grey velvet chair", [product("Grey velvet armchair")])
+
+    found, stale, exact = products.search("sofa", "grey velvet sofa", 3)
+
+    assert exact == 2
+    assert titles(found)[:2] == ["Velvet sofa B", "Velvet sofa A"]
+    assert not stale
+
+
+def test_reworded_query_finds_products_through_bm25(products):
+    products.record("q1", "mid century walnut coffee table", [product("Walnut coffee table"), product("Brass floor lamp")])
+
+    found, stale, exact = products.search("q2", "walnut coffee table mid century", 5)
+
+    assert exact == 0
+    assert titles(found) == ["Walnut coffee table", "Brass floor lamp"]
+    # Never fetched live under this key, so it still needs a refresh
+    assert stale
+
+
+def test_matches_covering_too_few_query_words_are_dropped(products):
+    products.record("q1", "oak bookshelf", [product("Oak bookshelf")])
+
+    found, _, _ = products.search("q2", "oak dining table with bench", 5)
+
+    assert found == []
+
+
+def test_recording_a_product_again_keeps_one_row_and_both_queries(products):
+    lamp = product("Arc lamp", link="https://shop.example/arc")
+    products.record("q1", "arc floor lamp", [lamp])
+    products.record("q2", "modern reading light", [lamp])
+
+    found, _, _ = products.search("q3", "reading light", 5)
+
+    assert titles(found) == ["Arc lamp"]
+    assert products.stats()["products"] == 1
+
+
+def test_results_older_than_the_ttl_are_stale(products, monkeypatch):
+    products.record("sofa", "sofa", [product("Sofa")])
+    monkeypatch.setattr(catalog, "CATALOG_TTL_SECONDS", -1)
+
+    found, stale, _ = products.search("sofa", "sofa", 3)
+
+    assert titles(found) == ["Sofa"]
+    assert stale
+
+
+def test_products_past_the_max_age_are_not_served(products, monkeypatch):
+    products.record("sofa", "sofa", [product("Sofa")])
+    monkeypatch.setattr(catalog, "CATALOG_MAX_AGE_SECONDS", -1)
+
+    assert products.search("sofa", "sofa", 3) == ([], False, 0)
+
+
+def test_background_refresh_runs_once_per_query(products):
+    async def scenario():
+        runs = 0
+
+        async def refresh():
+            nonlocal runs
+            runs += 1
+            await asyncio.sleep(0.01)
+
+        products.refresh_in_background("sofa", refresh)
+        products.refresh_in_background("sofa", refresh)
+        await asyncio.gather(*products._refreshing.values())
+        return runs, products.stats()["refreshing"]
+
+    assert asyncio.run(scenario()) == (1, 0)
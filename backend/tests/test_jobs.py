@@ -0,0 +1,155 @@
+import asyncio
+import time
+import pytest
+from utils import jobs
+from utils.jobs import JobQueue, QueueFull, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+
+
+def make_queue(tmp_path, workers=1, max_queued=10):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), workers, max_queued)
+
+
+async def echo(payload):
+    await asyncio.sleep(0.01)
+    return {"echo": payload["value"]}
+
+
+async def blocked(payload):
+    await asyncio.sleep(60)
+
+
+def test_job_runs_and_stores_its_result(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path)
+        queue.register("echo", echo)
+        queue.start()
+        try:
+            job_id = queue.submit("echo", {"value": 7})
+            return await queue.wait(job_id, 5)
+        finally:
+            await queue.stop()
+
+    job = asyncio.run(scenario())
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"echo": 7}
+    assert job["attempts"] == 1
+
+
+def test_job_of_unknown_kind_fails_without_stopping_the_worker(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path)
+        queue.register("echo", echo)
+        queue.register("retired", echo)
+        queue.start()
+        try:
+            orphan = queue.submit("retired", {"value": 1})
+            del queue.handlers["retired"]
+            after = queue.submit("echo", {"value": 2})
+            return await queue.wait(orphan, 5), await queue.wait(after, 5)
+        finally:
+            await queue.stop()
+
+    orphan, after = asyncio.run(scenario())
+    assert orphan["status"] == FAILED
+    assert after["status"] == SUCCEEDED
+
+
+def test_only_one_queue_claims_a_job(tmp_path):
+    first = make_queue(tmp_path)
+    second = make_queue(tmp_path)
+    first.register("echo", echo)
+    first._queue = asyncio.Queue()
+    job_id = first.submit("echo", {"value": 1})
+
+    assert first._claim(job_id) == ("echo", {"value": 1})
+    assert second._claim(job_id) is None
+    assert first.get(job_id)["status"] == RUNNING
+
+
+def test_submit_refuses_when_the_queue_is_full(tmp_path):
+    queue = make_queue(tmp_path, max_queued=1)
+    queue.register("echo", echo)
+    queue._queue = asyncio.Queue()
+    queue.submit("echo", {"value": 1})
+
+    with pytest.raises(QueueFull) as error:
+        queue.submit("echo", {"value": 2})
+    assert error.value.retry_after >= 1
+
+
+def test_stale_running_job_is_requeued_but_a_live_one_is_not(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_STALE_SECONDS", 30)
+    owner = make_queue(tmp_path)
+    sibling = make_queue(tmp_path)
+    owner.register("echo", echo)
+    owner._queue = asyncio.Queue()
+    stale = owner.submit("echo", {"value": 1})
+    live = owner.submit("echo", {"value": 2})
+    owner._claim(stale)
+    owner._claim(live)
+    owner._update("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - 60, stale))
+
+    assert sibling._requeue_stale() == [stale]
+    assert sibling.get(stale)["status"] == QUEUED
+    assert sibling.get(live)["status"] == RUNNING
+
+
+def test_heartbeat_keeps_own_jobs_and_stops_ones_taken_away(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path, workers=2)
+        queue.register("blocked", blocked)
+        queue.start()
+        try:
+            kept = queue.submit("blocked", {})
+            lost = queue.submit("blocked", {})
+            while len(queue._running) < 2:
+                await asyncio.sleep(0.01)
+            before = queue._execute("SELECT heartbeat_at FROM jobs WHERE id = ?", (kept,))[0][0]
+            # Another process requeued it, e.g. after a long pause here
+            queue._update("UPDATE jobs SET status = ?, owner = NULL WHERE id = ?", (QUEUED, lost))
+            await asyncio.sleep(0.01)
+            await queue._beat()
+            await asyncio.sleep(0.01)
+            after = queue._execute("SELECT heartbeat_at FROM jobs WHERE id = ?", (kept,))[0][0]
+            return before, after, kept in queue._running, lost in queue._running
+        finally:
+            await queue.stop()
+
+    before, after, kept_running, lost_running = asyncio.run(scenario())
+    assert after > before
+    assert kept_running
+    assert not lost_running
+
+
+def test_cancel_stops_a_running_job(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path)
+        queue.register("blocked", blocked)
+        queue.start()
+        try:
+            job_id = queue.submit("blocked", {})
+            while job_id not in queue._running:
+                await asyncio.sleep(0.01)
+            queue.cancel(job_id)
+            await asyncio.sleep(0.01)
+            return queue.get(job_id), len(queue._running)
+        finally:
+            await queue.stop()
+
+    job, running = asyncio.run(scenario())
+    assert job["status"] == CANCELLED
+    assert running == 0
+
+
+def test_stop_hands_running_jobs_back_to_the_queue(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path)
+        queue.register("blocked", blocked)
+        queue.start()
+        job_id = queue.submit("blocked", {})
+        while job_id not in queue._running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue.get(job_id)
+
+    assert asyncio.run(scenario())["status"] == QUEUED
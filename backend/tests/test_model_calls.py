@@ -0,0 +1,199 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from utils import model_calls
+from utils.model_calls import ModelCallScheduler, TokenBucket, set_call_context, retryable_status
+
+
+class UpstreamError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"upstream returned {code}")
+        self.code = code
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(model_calls, "GEMINI_RETRY_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(model_calls, "GEMINI_RETRY_MAX_SECONDS", 0.01)
+    monkeypatch.setattr(model_calls, "GEMINI_RETRY_ATTEMPTS", 3)
+
+
+def test_token_bucket_allows_a_burst_then_refills_over_time():
+    bucket = TokenBucket(per_minute=2)
+    start = bucket.updated_at
+
+    assert bucket.take(start) and bucket.take(start)
+    assert not bucket.take(start)
+    assert bucket.seconds_until_token(start) == pytest.approx(30)
+    assert bucket.take(start + 30)
+
+
+def test_token_bucket_without_a_quota_never_runs_out():
+    bucket = TokenBucket(per_minute=0)
+    assert all(bucket.take(bucket.updated_at) for _ in range(1000))
+    assert bucket.seconds_until_token(bucket.updated_at) == 0
+
+
+def test_drain_empties_the_bucket_after_a_429():
+    bucket = TokenBucket(per_minute=60)
+    bucket.drain()
+    assert not bucket.take(bucket.updated_at)
+
+
+def test_sessions_are_served_round_robin():
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+        order = []
+        release = asyncio.Event()
+
+        async def call(name):
+            order.append(name)
+            if name == "a1":
+                await release.wait()
+
+        async def session(session_id, names):
+            set_call_context("test", session_id)
+            await asyncio.gather(*(scheduler.call("model", lambda name=name: call(name)) for name in names))
+
+        batch = asyncio.ensure_future(session("a", ["a1", "a2", "a3"]))
+        await asyncio.sleep(0.01)
+        single = asyncio.ensure_future(session("b", ["b1"]))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(batch, single)
+        return order, scheduler.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+    # Session b joined the rotation behind a's next call, not behind a's whole batch
+    assert order == ["a1", "a2", "b1", "a3"]
+    assert in_flight == 0
+
+
+def test_exhausted_quota_holds_calls_even_with_free_slots(monkeypatch):
+    monkeypatch.setitem(model_calls.MODEL_CALL_DEADLINES, "test", 0.05)
+
+    async def scenario():
+        scheduler = ModelCallScheduler(4, {"model": 1}, 0)
+        set_call_context("test", "session")
+        await scheduler.call("model", lambda: asyncio.sleep(0))
+        with pytest.raises(HTTPException) as error:
+            await scheduler.call("model", lambda: asyncio.sleep(0))
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) == pytest.approx(60, abs=1)
+
+
+def test_call_queued_past_its_deadline_gets_503(monkeypatch):
+    monkeypatch.setitem(model_calls.MODEL_CALL_DEADLINES, "test", 0.05)
+
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+        holder = asyncio.ensure_future(scheduler.call("model", lambda: asyncio.sleep(0.3)))
+        await asyncio.sleep(0.01)
+        set_call_context("test", "late")
+        with pytest.raises(HTTPException) as error:
+            await scheduler.call("model", lambda: asyncio.sleep(0))
+        await holder
+        return error.value, scheduler
+
+    error, scheduler = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    assert scheduler.deadline_exceeded == 1
+    assert scheduler.waiting == 0
+
+
+def test_call_running_past_its_deadline_gets_504(monkeypatch):
+    monkeypatch.setitem(model_calls.MODEL_CALL_DEADLINES, "test", 0.05)
+
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+        set_call_context("test", "slow")
+        with pytest.raises(HTTPException) as error:
+            await scheduler.call("model", lambda: asyncio.sleep(1))
+        return error.value, scheduler.in_flight
+
+    error, in_flight = asyncio.run(scenario())
+    assert error.status_code == 504
+    assert in_flight == 0
+
+
+def test_retryable_errors_are_retried_with_backoff():
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+        attempts = 0
+
+        async def flaky():
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise UpstreamError(503)
+            return "ok"
+
+        return await scheduler.call("model", flaky), attempts, scheduler.retries
+
+    assert asyncio.run(scenario()) == ("ok", 3, 2)
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+        attempts = 0
+
+        async def rejected():
+            nonlocal attempts
+            attempts += 1
+            raise UpstreamError(400)
+
+        with pytest.raises(UpstreamError):
+            await scheduler.call("model", rejected)
+        return attempts, scheduler.failed_calls
+
+    assert asyncio.run(scenario()) == (1, 1)
+
+
+def test_exhausted_retries_of_a_429_become_a_429_with_retry_after():
+    async def scenario():
+        scheduler = ModelCallScheduler(1, {}, 0)
+
+        async def throttled():
+            raise UpstreamError(429)
+
+        with pytest.raises(HTTPException) as error:
+            await scheduler.call("model", throttled)
+        return error.value, scheduler.retries
+
+    error, retries = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert retries == model_calls.GEMINI_RETRY_ATTEMPTS - 1
+
+
+def test_retry_delay_is_capped_exponential_backoff(monkeypatch):
+    monkeypatch.setattr(model_calls.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(model_calls, "GEMINI_RETRY_ATTEMPTS", 10)
+    scheduler = ModelCallScheduler(1, {}, 0)
+
+    delays = [scheduler.retry_delay("model", UpstreamError(503), attempt) for attempt in range(5)]
+
+    assert delays == [0.001, 0.002, 0.004, 0.008, 0.01]
+
+
+@pytest.mark.parametrize("code, status", [(429, 429), (500, 500), (503, 503), (400, None), (404, None)])
+def test_retryable_status(code, status):
+    assert retryable_status(UpstreamError(code)) == status
+
+
+def test_hedge_reservation_takes_a_real_slot():
+    scheduler = ModelCallScheduler(2, {}, 0)
+    scheduler.in_flight = 1
+
+    release = scheduler.reserve_hedge("model")
+    assert release is not None
+    assert scheduler.in_flight == 2
+    assert scheduler.reserve_hedge("model") is None
+
+    release()
+    assert scheduler.in_flight == 1
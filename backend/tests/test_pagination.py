@@ -0,0 +1,64 @@
+import asyncio
+import base64
+import pytest
+from fastapi import HTTPException
+from utils.pagination import encode_cursor, decode_cursor, split_page
+from utils.repository import SqliteBackend
+
+COLUMNS = ("id", "created_at", "session_id")
+
+
+def rows(count):
+    return [{"id": f"id-{idx:02d}", "created_at": f"2025-01-01T00:00:{idx:02d}"} for idx in range(count)]
+
+
+def test_cursor_round_trips_the_keyset():
+    cursor = encode_cursor({"id": "abc", "created_at": "2025-01-01T00:00:00+00:00", "description": "ignored"})
+    assert decode_cursor(cursor) == ("2025-01-01T00:00:00+00:00", "abc")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'["only one"]').decode(),
+    base64.urlsafe_b64encode(b"42").decode(),
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_split_page_with_an_extra_row_points_at_the_last_kept_row():
+    page, cursor = split_page(rows(4), 3)
+    assert [row["id"] for row in page] == ["id-00", "id-01", "id-02"]
+    assert decode_cursor(cursor) == ("2025-01-01T00:00:02", "id-02")
+
+
+@pytest.mark.parametrize("count", [0, 2, 3])
+def test_split_page_without_an_extra_row_is_the_last_page(count):
+    page, cursor = split_page(rows(count), 3)
+    assert len(page) == count
+    assert cursor is None
+
+
+def test_keyset_pages_cover_every_row_once_across_created_at_ties(tmp_path):
+    async def scenario():
+        backend = SqliteBackend(str(tmp_path / "app.sqlite3"))
+        # Pairs of rows share a timestamp, so only the id tie-break keeps pages apart
+        await backend.insert("furnitures", [
+            {"id": f"id-{idx:02d}", "created_at": f"2025-01-01T00:00:{idx // 2:02d}", "session_id": "s"}
+            for idx in range(7)
+        ], ("id",))
+
+        seen = []
+        cursor = None
+        while True:
+            decoded = decode_cursor(cursor) if cursor else None
+            page, cursor = split_page(await backend.page("furnitures", COLUMNS, {"session_id": "s"}, 3 + 1, decoded), 3)
+            seen.extend(row["id"] for row in page)
+            if cursor is None:
+                return seen
+
+    seen = asyncio.run(scenario())
+    assert seen == [f"id-{idx:02d}" for idx in reversed(range(7))]
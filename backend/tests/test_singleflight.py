@@ -0,0 +1,57 @@
+import asyncio
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flight = SingleFlight()
+        runs = 0
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        return runs, results, flight
+
+    runs, results, flight = asyncio.run(scenario())
+    assert runs == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert all(result == "result" for result, _ in results)
+    assert flight.coalesced == 2
+    assert len(flight) == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+def test_error_reaches_every_waiter_and_is_not_kept():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+
+        outcomes = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        return outcomes, len(flight)
+
+    outcomes, in_flight = asyncio.run(scenario())
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert in_flight == 0
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from routers import tryon
+from utils.cache import ByteLRUCache
+from utils.preprocess import PreprocessReport
+
+DEFAULTS = {
+    "design_type": "interior",
+    "room_type": "living room",
+    "style": "modern",
+    "background_color": "white",
+    "foreground_color": "grey",
+    "instructions": "",
+}
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """Replaces preprocessing, the model and the database; records which styles reached the model."""
+    calls = []
+    saved = []
+
+    async def prepare_for_model(data, mime_type, model_name, report):
+        return data, mime_type
+
+    async def call_design_model(contents):
+        style = contents[0].split("**Style:**")[1].splitlines()[0].strip()
+        calls.append(style)
+        await asyncio.sleep(0)
+        if style == "broken":
+            raise RuntimeError("upstream failed")
+        if style == "blank":
+            return None, "image/png", "No Description available.", 0.1
+        return f"image-{style}".encode(), "image/png", f"text-{style}", 0.1
+
+    async def save_designs(session_id, items):
+        saved.extend(items)
+        return [(f"design-{len(saved) - len(items) + idx}", f"hash-{idx}") for idx in range(len(items))]
+
+    monkeypatch.setattr(tryon, "prepare_for_model", prepare_for_model)
+    monkeypatch.setattr(tryon, "call_design_model", call_design_model)
+    monkeypatch.setattr(tryon, "save_designs", save_designs)
+    monkeypatch.setattr(tryon, "tryon_cache", ByteLRUCache(1024 * 1024))
+    return calls, saved
+
+
+def run_batch(params_list, session_id="session"):
+    return asyncio.run(tryon.run_try_on_batch(b"photo", "image/png", params_list, session_id, PreprocessReport()))
+
+
+def test_parse_variants_fills_fields_from_the_defaults():
+    params_list = tryon.parse_variants(json.dumps([{"style": "boho"}, {"style": "japandi", "room_type": "bedroom"}]), DEFAULTS)
+
+    assert [params["style"] for params in params_list] == ["boho", "japandi"]
+    assert params_list[0]["room_type"] == "living room"
+    assert params_list[1]["room_type"] == "bedroom"
+
+
+@pytest.mark.parametrize("variants", ["not json", "{}", "[]", "[1, 2]"])
+def test_parse_variants_rejects_anything_but_a_list_of_objects(variants):
+    with pytest.raises(HTTPException) as error:
+        tryon.parse_variants(variants, DEFAULTS)
+    assert error.value.status_code == 400
+
+
+def test_parse_variants_enforces_the_variant_limit():
+    variants = json.dumps([{"style": str(idx)} for idx in range(tryon.TRYON_BATCH_MAX_VARIANTS + 1)])
+    with pytest.raises(HTTPException):
+        tryon.parse_variants(variants, DEFAULTS)
+
+
+def test_parse_variants_reports_missing_fields():
+    with pytest.raises(HTTPException) as error:
+        tryon.parse_variants(json.dumps([{"style": "boho"}]), {"style": "modern"})
+    assert "room_type" in error.value.detail
+
+
+def test_equivalent_variants_share_one_model_call(model):
+    calls, saved = model
+    results = run_batch([{**DEFAULTS, "style": "Boho"}, {**DEFAULTS, "style": " boho "}, {**DEFAULTS, "style": "minimal"}])
+
+    assert sorted(calls) == ["Boho", "minimal"]
+    assert [result["error"] for result in results] == [None, None, None]
+    assert results[0]["image_data"] == results[1]["image_data"] == b"image-Boho"
+    assert len(saved) == 3
+
+
+def test_a_failed_variant_does_not_fail_the_batch(model):
+    results = run_batch([{**DEFAULTS, "style": "broken"}, {**DEFAULTS, "style": "blank"}, {**DEFAULTS, "style": "boho"}])
+
+    assert [result["error"] for result in results] == ["Model call failed", "Model returned no image", None]
+    assert results[2]["design_id"] is not None
+
+
+def test_cached_variants_skip_the_model(model):
+    calls, _ = model
+    run_batch([{**DEFAULTS, "style": "boho"}])
+    results = run_batch([{**DEFAULTS, "style": "boho"}, {**DEFAULTS, "style": "minimal"}])
+
+    assert calls == ["boho", "minimal"]
+    assert [result["cached"] for result in results] == [True, False]
@@ -1,4 +1,13 @@
 import base64
+from utils.metrics import stage_seconds
 
 def array_buffer_to_base64(data: bytes) -> str:
-    return base64.b64encode(data).decode('utf-8')
\ No newline at end of file
+    with stage_seconds.time(stage="base64_encode"):
+        return base64.b64encode(data).decode('utf-8')
+
+def base64_to_bytes(data: str) -> bytes:
+    with stage_seconds.time(stage="base64_decode"):
+        return base64.b64decode(data)
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{array_buffer_to_base64(data)}"
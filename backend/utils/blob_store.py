@@ -0,0 +1,132 @@
+import mmap
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "blobs"))
+BLOB_STORE_BUCKET = os.getenv("BLOB_STORE_BUCKET", "images")
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+class BlobStore(ABC):
+    """Content-addressed storage: blobs are written once under their SHA-256 hex digest."""
+
+    @abstractmethod
+    def put(self, digest: str, data: bytes, mime_type: str) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, digest: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, digest: str) -> None:
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs on disk as <root>/ab/cd/<digest> so no directory grows unbounded."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, digest: str, data: bytes, mime_type: str) -> None:
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file in the same shard and rename, so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def open(self, digest: str) -> mmap.mmap:
+        """Returns a read-only memory map of the blob; callers should close it when done."""
+        path = self.path_for(digest)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    raise BlobNotFound(digest)
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def get(self, digest: str) -> bytes:
+        with self.open(digest) as mapped:
+            return mapped[:]
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.unlink(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+
+
+class SupabaseBlobStore(BlobStore):
+    """Stores blobs in a Supabase Storage bucket using the same sharded key layout.
+
+    `get_client` is called on each use, so the Supabase client is only built once a blob is touched.
+    """
+
+    def __init__(self, get_client, bucket: str):
+        self.get_client = get_client
+        self.bucket_name = bucket
+
+    @property
+    def bucket(self):
+        return self.get_client().storage.from_(self.bucket_name)
+
+    @staticmethod
+    def key_for(digest: str) -> str:
+        return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def put(self, digest: str, data: bytes, mime_type: str) -> None:
+        # Keys are content-addressed, so overwriting an existing blob rewrites the same bytes;
+        # that is cheaper than a list() round trip before every upload
+        self.bucket.upload(self.key_for(digest), data, {"content-type": mime_type, "upsert": "true"})
+
+    def get(self, digest: str) -> bytes:
+        try:
+            return self.bucket.download(self.key_for(digest))
+        except Exception as e:
+            raise BlobNotFound(digest) from e
+
+    def exists(self, digest: str) -> bool:
+        folder, name = self.key_for(digest).rsplit("/", 1)
+        return any(entry.get("name") == name for entry in self.bucket.list(folder, {"search": name}))
+
+    def delete(self, digest: str) -> None:
+        self.bucket.remove([self.key_for(digest)])
+
+
+def create_blob_store() -> BlobStore:
+    if BLOB_STORE_BACKEND == "supabase":
+        from utils.db_client import supabase
+        return SupabaseBlobStore(supabase, BLOB_STORE_BUCKET)
+    if BLOB_STORE_BACKEND == "local":
+        return LocalBlobStore(BLOB_STORE_DIR)
+    raise ValueError(f"Unknown BLOB_STORE_BACKEND: {BLOB_STORE_BACKEND}")
+
+
+blob_store = create_blob_store()
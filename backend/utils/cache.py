@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire `ttl_seconds` after they are set."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ByteLRUCache:
+    """LRU cache bounded by the total byte size of its values rather than the entry count.
+
+    Entries optionally expire `ttl_seconds` after they are set.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            size, expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.current_bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[0]
+            self._data[key] = (size, expires_at, value)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted_size, _, _) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self.current_bytes -= entry[0]
+            return entry[2]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes, finding every hash within a Hamming radius without a full scan."""
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value: int):
+        if self._root is None:
+            self._root = (value, {})
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list:
+        """(distance, hash) pairs within `radius` bits of `value`, closest first."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= radius:
+                found.append((distance, node[0]))
+            # Triangle inequality: only subtrees at distance-radius..distance+radius can hold matches
+            for edge, child in node[1].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class NearestHashCache:
+    """LRU cache keyed on 64-bit perceptual hashes; a lookup returns the closest live entry within `max_distance` bits.
+
+    Hashes are indexed in a BK-tree. Evicted ones stay in the tree until they outnumber the
+    live entries, and then the tree is rebuilt.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_distance: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._data = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int):
+        with self._lock:
+            now = time.monotonic()
+            for _, candidate in self._tree.search(key, self.max_distance):
+                entry = self._data.get(candidate)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at < now:
+                    del self._data[candidate]
+                    continue
+                self._data.move_to_end(candidate)
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def set(self, key: int, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            self._tree.add(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            if self._tree.size > 2 * len(self._data) + 64:
+                self._tree = BKTree()
+                for live in self._data:
+                    self._tree.add(live)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "indexed_hashes": self._tree.size,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import traceback
+from utils.blob_store import BLOB_STORE_DIR
+from utils.metrics import registry, Counter
+
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", os.path.join(os.path.dirname(BLOB_STORE_DIR), "catalog.sqlite3"))
+CATALOG_MIN_HITS = int(os.getenv("CATALOG_MIN_HITS", "3"))
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "86400"))
+CATALOG_MAX_AGE_SECONDS = float(os.getenv("CATALOG_MAX_AGE_SECONDS", str(30 * 86400)))
+CATALOG_MIN_TERM_COVERAGE = float(os.getenv("CATALOG_MIN_TERM_COVERAGE", "0.6"))
+CATALOG_REFRESH_CONCURRENCY = int(os.getenv("CATALOG_REFRESH_CONCURRENCY", "2"))
+
+PRODUCT_FIELDS = ("title", "link", "price", "source", "thumbnail")
+
+catalog_lookups = registry.register(Counter(
+    "ati_catalog_lookups_total", "Product catalog lookups by outcome (fresh, stale, miss).", ("outcome",)
+))
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def product_key(product: dict) -> str:
+    identity = product.get("link") or f"{product.get('title')}|{product.get('source')}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+class ProductCatalog:
+    """SQLite catalog of every product SerpAPI returned, searchable with FTS5/BM25.
+
+    Products are indexed on their title and on every query that returned them, so a
+    reworded query still finds what an earlier search brought back.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._refreshing = {}
+        self._refresh_semaphore = None
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY,
+                product_key TEXT NOT NULL UNIQUE,
+                title TEXT, link TEXT, price TEXT, source TEXT, thumbnail TEXT,
+                queries TEXT NOT NULL DEFAULT '',
+                last_seen REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                query_key TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS search_products (
+                query_key TEXT NOT NULL,
+                product_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (query_key, product_id)
+            )
+        """)
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "title, queries, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        # Keep the external-content FTS index in step with the products table
+        self._db.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts(rowid, title, queries) VALUES (new.id, new.title, new.queries);
+            END
+        """)
+        self._db.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, title, queries) VALUES ('delete', old.id, old.title, old.queries);
+                INSERT INTO products_fts(rowid, title, queries) VALUES (new.id, new.title, new.queries);
+            END
+        """)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def record(self, query_key: str, query: str, products: list):
+        """Upserts the products a live search returned and remembers that this query was fetched now."""
+        now = time.time()
+        normalized = " ".join(tokenize(query))
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM search_products WHERE query_key = ?", (query_key,))
+                for position, product in enumerate(products):
+                    key = product_key(product)
+                    existing = self._db.execute("SELECT id, queries FROM products WHERE product_key = ?", (key,)).fetchone()
+                    values = tuple(product.get(field) for field in PRODUCT_FIELDS)
+                    if existing is None:
+                        product_id = self._db.execute(
+                            "INSERT INTO products (product_key, title, link, price, source, thumbnail, queries, last_seen) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, *values, normalized, now),
+                        ).lastrowid
+                    else:
+                        product_id = existing["id"]
+                        queries = existing["queries"]
+                        if normalized not in queries.split("\n"):
+                            queries = f"{queries}\n{normalized}" if queries else normalized
+                        self._db.execute(
+                            "UPDATE products SET title = ?, link = ?, price = ?, source = ?, thumbnail = ?, queries = ?, last_seen = ? "
+                            "WHERE id = ?",
+                            (*values, queries, now, product_id),
+                        )
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO search_products (query_key, product_id, position) VALUES (?, ?, ?)",
+                        (query_key, product_id, position),
+                    )
+                self._db.execute("INSERT OR REPLACE INTO searches (query_key, fetched_at) VALUES (?, ?)", (query_key, now))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def search(self, query_key: str, query: str, limit: int):
+        """Returns (products, stale, exact) from the catalog alone.
+
+        Products a live search returned for this exact query come first (`exact` of them),
+        then BM25 matches covering enough of the query's words. `stale` means the answer
+        should be refreshed; a query that was never fetched live is always stale.
+        """
+        now = time.time()
+        oldest = now - CATALOG_MAX_AGE_SECONDS
+        columns = ", ".join(f"p.{field}" for field in PRODUCT_FIELDS)
+
+        searched = self._execute("SELECT fetched_at FROM searches WHERE query_key = ?", (query_key,))
+        rows = self._execute(
+            f"SELECT p.id, {columns}, p.last_seen FROM search_products s JOIN products p ON p.id = s.product_id "
+            "WHERE s.query_key = ? AND p.last_seen >= ? ORDER BY s.position LIMIT ?",
+            (query_key, oldest, limit),
+        )
+        exact = len(rows)
+
+        terms = list(dict.fromkeys(tokenize(query)))
+        if len(rows) < limit and terms:
+            match = " OR ".join(f'"{term}"' for term in terms)
+            seen = {row["id"] for row in rows}
+            candidates = self._execute(
+                f"SELECT p.id, {columns}, p.last_seen, p.queries FROM products_fts f JOIN products p ON p.id = f.rowid "
+                "WHERE products_fts MATCH ? AND p.last_seen >= ? ORDER BY bm25(products_fts, 1.0, 0.5) LIMIT ?",
+                (match, oldest, limit * 10),
+            )
+            for row in candidates:
+                if row["id"] in seen:
+                    continue
+                words = set(tokenize(f"{row['title']} {row['queries']}"))
+                if sum(term in words for term in terms) / len(terms) < CATALOG_MIN_TERM_COVERAGE:
+                    continue
+                rows.append(row)
+                seen.add(row["id"])
+                if len(rows) >= limit:
+                    break
+
+        fetched_at = searched[0]["fetched_at"] if searched else None
+        stale = (
+            fetched_at is None
+            or now - fetched_at > CATALOG_TTL_SECONDS
+            or any(now - row["last_seen"] > CATALOG_TTL_SECONDS for row in rows)
+        )
+        return [{field: row[field] for field in PRODUCT_FIELDS} for row in rows], stale, exact
+
+    def _get_refresh_semaphore(self) -> asyncio.Semaphore:
+        if self._refresh_semaphore is None:
+            self._refresh_semaphore = asyncio.Semaphore(max(1, CATALOG_REFRESH_CONCURRENCY))
+        return self._refresh_semaphore
+
+    async def _refresh(self, query_key: str, refresh):
+        try:
+            async with self._get_refresh_semaphore():
+                await refresh()
+        except Exception as e:
+            print(f"Catalog refresh failed for {query_key}: {e}")
+            traceback.print_exc()
+        finally:
+            self._refreshing.pop(query_key, None)
+
+    def refresh_in_background(self, query_key: str, refresh):
+        """Runs `refresh()` (a coroutine function doing the live search) once per query at a time."""
+        if query_key not in self._refreshing:
+            self._refreshing[query_key] = asyncio.create_task(self._refresh(query_key, refresh))
+
+    async def stop(self):
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refreshing.clear()
+
+    def stats(self) -> dict:
+        return {
+            "products": self._execute("SELECT COUNT(*) FROM products")[0][0],
+            "searches": self._execute("SELECT COUNT(*) FROM searches")[0][0],
+            "refreshing": len(self._refreshing),
+        }
+
+
+product_catalog = ProductCatalog(CATALOG_DB_PATH)
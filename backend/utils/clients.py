@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+from fastapi import HTTPException
+
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "true").lower() == "true"
+PREWARM_TIMEOUT_SECONDS = float(os.getenv("PREWARM_TIMEOUT_SECONDS", "10"))
+PREWARM_GEMINI_MODEL = os.getenv("PREWARM_GEMINI_MODEL", "gemini-2.5-flash")
+
+
+def require_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise HTTPException(status_code=503, detail=f"{name} is not configured")
+    return value
+
+
+class ClientRegistry:
+    """Process-wide API clients, built on first use so importing the app never touches credentials or the network.
+
+    Each entry has a factory, and optionally an async `warm(client)` that opens its pooled
+    connections ahead of the first request and an async `close(client)` run at shutdown.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._warm_task = None
+        self.started = False
+        self.warm_state = {}
+
+    def register(self, name: str, factory, warm=None, close=None):
+        self._entries[name] = (factory, warm, close)
+
+    def get(self, name: str):
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._entries[name][0]()
+                    self._clients[name] = client
+        return client
+
+    async def _warm_one(self, name: str, warm):
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(warm(self.get(name)), PREWARM_TIMEOUT_SECONDS)
+            self.warm_state[name] = {"warm": True, "seconds": round(time.perf_counter() - started_at, 3)}
+        except Exception as e:
+            print(f"Pre-warming {name} failed: {e!r}")
+            self.warm_state[name] = {"warm": False, "error": getattr(e, "detail", None) or repr(e)}
+
+    async def _prewarm(self):
+        targets = [(name, warm) for name, (_, warm, _) in self._entries.items() if warm is not None]
+        for name, _ in targets:
+            self.warm_state[name] = {"warm": False}
+        await asyncio.gather(*(self._warm_one(name, warm) for name, warm in targets))
+
+    def start(self, prewarm: bool = PREWARM_CLIENTS):
+        """Marks the worker started; pre-warming runs in the background and gates readiness."""
+        self.started = True
+        if prewarm and self._warm_task is None:
+            self._warm_task = asyncio.create_task(self._prewarm())
+
+    async def close(self):
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+            try:
+                await self._warm_task
+            except asyncio.CancelledError:
+                pass
+            self._warm_task = None
+        for name, client in list(self._clients.items()):
+            close = self._entries[name][2]
+            if close is None:
+                continue
+            try:
+                await close(client)
+            except Exception:
+                traceback.print_exc()
+        self._clients.clear()
+        self.started = False
+
+    def readiness(self) -> dict:
+        warming = self._warm_task is not None and not self._warm_task.done()
+        ready = self.started and not warming and all(state["warm"] for state in self.warm_state.values())
+        return {
+            "ready": ready,
+            "started": self.started,
+            "warming": warming,
+            "created": sorted(self._clients),
+            "prewarm": self.warm_state,
+        }
+
+
+clients = ClientRegistry()
+
+
+def _create_gemini():
+    from google import genai
+    return genai.Client(api_key=require_env("GEMINI_API_KEY"))
+
+
+async def _warm_gemini(client):
+    # A model metadata lookup opens the async client's pooled TLS connection without spending quota
+    await client.aio.models.get(model=PREWARM_GEMINI_MODEL)
+
+
+async def _close_gemini(client):
+    await client.aio.aclose()
+
+
+clients.register("gemini", _create_gemini, warm=_warm_gemini, close=_close_gemini)
+# The SerpAPI client opens a fresh connection per search, so there is nothing to pre-warm
+clients.register("serpapi", lambda: require_env("SERPAPI_API_KEY"))
+
+
+def gemini():
+    return clients.get("gemini")
+
+
+def serpapi_key() -> str:
+    return clients.get("serpapi")
@@ -1,13 +1,58 @@
 from supabase import create_client, Client
 import os
-from dotenv import load_dotenv
+from utils.clients import clients
+from utils.metrics import db_query_seconds
 
-load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+class TimedQuery:
+    """Wraps a PostgREST query builder so that execute() is recorded per table."""
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in .env")
+    def __init__(self, builder, table: str):
+        self._builder = builder
+        self._table = table
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    def execute(self, *args, **kwargs):
+        with db_query_seconds.time(table=self._table):
+            return self._builder.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if hasattr(attr, "execute"):
+            # Properties such as .not_ return the next builder directly
+            return TimedQuery(attr, self._table)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return TimedQuery(result, self._table) if hasattr(result, "execute") else result
+        return chained
+
+
+class TimedClient:
+    """Supabase client whose table queries feed the per-table latency histogram."""
+
+    def __init__(self, client: Client):
+        self._client = client
+
+    def table(self, name: str) -> TimedQuery:
+        return TimedQuery(self._client.table(name), name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _create_supabase() -> TimedClient:
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in .env")
+    return TimedClient(create_client(url, key))
+
+
+clients.register("supabase", _create_supabase)
+
+
+def supabase() -> TimedClient:
+    """The shared Supabase client, created (and the credentials checked) on first use."""
+    return clients.get("supabase")
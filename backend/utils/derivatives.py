@@ -0,0 +1,107 @@
+import hashlib
+import io
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, features
+from utils.blob_store import blob_store
+from utils.cache import TTLCache
+
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "webp").lower()
+DERIVATIVE_RETRY_SECONDS = float(os.getenv("DERIVATIVE_RETRY_SECONDS", "3600"))
+
+# Bump when the variant specs below change so clients and the blob store pick up new renders
+DERIVATIVE_VERSION = 1
+
+# variant -> (max long edge in pixels or None to keep the original size, encoder quality)
+VARIANTS = {
+    "thumb": (256, 70),
+    "medium": (1024, 80),
+    "full": (None, 85),
+}
+
+FORMAT_MIME_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="derivatives")
+
+# Hashes queued or rendering, and hashes whose render failed recently; neither is submitted again
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+_failed = TTLCache(10000, DERIVATIVE_RETRY_SECONDS)
+
+
+def avif_supported() -> bool:
+    try:
+        return features.check_module("avif")
+    except ValueError:
+        # Pillow before 11.2 does not know the "avif" module
+        return False
+
+
+def output_format() -> str:
+    if DERIVATIVE_FORMAT == "avif" and avif_supported():
+        return "avif"
+    return "webp"
+
+
+def derivative_key(image_hash: str, variant: str) -> str:
+    """Blob key of a rendered variant; deterministic in the source hash and variant spec."""
+    spec = f"{image_hash}:{variant}:{output_format()}:{DERIVATIVE_VERSION}"
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+
+def derivative_mime_type() -> str:
+    return FORMAT_MIME_TYPES[output_format()]
+
+
+def render_variants(data: bytes) -> dict:
+    """Decodes the image once and renders every variant; returns {variant: encoded bytes}."""
+    fmt = output_format()
+    rendered = {}
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        for variant, (max_edge, quality) in VARIANTS.items():
+            resized = img
+            if max_edge and max(img.size) > max_edge:
+                resized = img.copy()
+                resized.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, format=fmt.upper(), quality=quality)
+            rendered[variant] = out.getvalue()
+    return rendered
+
+
+def build_derivatives(image_hash: str, data: bytes):
+    try:
+        rendered = render_variants(data)
+        mime_type = derivative_mime_type()
+        for variant, variant_bytes in rendered.items():
+            blob_store.put(derivative_key(image_hash, variant), variant_bytes, mime_type)
+    except Exception as e:
+        _failed.set(image_hash, True)
+        print(f"Failed to render derivatives for {image_hash}: {e}")
+        traceback.print_exc()
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(image_hash)
+
+
+def schedule_derivatives(image_hash: str, data: bytes):
+    """Queues variant rendering on the worker pool unless the variants already exist.
+
+    Nothing is queued while a render of the same image is pending, or for
+    DERIVATIVE_RETRY_SECONDS after one failed.
+    """
+    if image_hash in _in_flight or _failed.get(image_hash) is not None:
+        return None
+    if all(blob_store.exists(derivative_key(image_hash, variant)) for variant in VARIANTS):
+        return None
+    with _in_flight_lock:
+        if image_hash in _in_flight:
+            return None
+        _in_flight.add(image_hash)
+    return executor.submit(build_derivatives, image_hash, data)
@@ -0,0 +1,44 @@
+import asyncio
+from utils import repository
+from utils.image_store import store_image
+from utils.logs import log_exception
+from utils.similarity import furniture_index, compute_features, store_features
+from utils.trim import store_trimmed
+
+
+async def save_furniture(session_id: str, data: bytes, mime_type: str, description: str) -> dict:
+    """Stores an uploaded furniture image with its trimmed copy and similarity features, then inserts and indexes the row.
+
+    Shared by both furniture upload routes. Returns {"id", "trimmed", "near_duplicates"}.
+    Features are best effort: if they cannot be computed the upload still succeeds and the item
+    stays out of the index until scripts.backfill_furniture_features has run.
+    """
+    image_columns = await asyncio.to_thread(store_image, data, mime_type)
+    image_hash = image_columns["image_hash"]
+    trimmed = await asyncio.to_thread(store_trimmed, image_hash, data)
+
+    features = None
+    near_duplicates = []
+    try:
+        embedding, phash = await asyncio.to_thread(compute_features, data)
+        await asyncio.to_thread(store_features, image_hash, embedding, phash)
+        near_duplicates = furniture_index.near_duplicates(embedding, phash, session_id)
+        features = (embedding, phash)
+    except Exception as e:
+        log_exception("furniture_features_failed", e, image_hash=image_hash)
+
+    inserted = await repository.furnitures.insert(
+        {"session_id": session_id, "description": description, **image_columns},
+        returning=("id", "created_at"),
+    )
+    row = inserted[0]
+    if features is not None:
+        furniture_index.add({
+            "id": row["id"],
+            "session_id": session_id,
+            "created_at": row["created_at"],
+            "description": description,
+            "image_hash": image_hash,
+        }, *features)
+
+    return {"id": row["id"], "trimmed": trimmed, "near_duplicates": near_duplicates}
@@ -0,0 +1,123 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+from utils.metrics import registry, Counter
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MAX_EXTRA = int(os.getenv("HEDGE_MAX_EXTRA", "1"))
+
+hedged_requests = registry.register(Counter(
+    "ati_hedged_requests_total",
+    "Hedged calls by stage and which attempt won (primary, hedge) or failed.",
+    ("stage", "outcome"),
+))
+
+trackers = {}
+
+
+class LatencyTracker:
+    """Recent latencies of one upstream call, used to decide when it is slow enough to hedge.
+
+    The threshold is the HEDGE_QUANTILE of the last HEDGE_WINDOW samples. Until there are
+    HEDGE_MIN_SAMPLES, the configured `default_seconds` is used instead.
+    """
+
+    def __init__(self, name: str, default_seconds: float):
+        self.name = name
+        self.default_seconds = default_seconds
+        self._samples = collections.deque(maxlen=HEDGE_WINDOW)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        trackers[name] = self
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> float:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return self.default_seconds
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {
+            "samples": len(self._samples),
+            "hedge_after_seconds": round(self.threshold(), 3),
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def hedging_stats() -> dict:
+    return {name: tracker.stats() for name, tracker in trackers.items()}
+
+
+async def hedged(tracker: LatencyTracker, fn, reserve=None):
+    """Awaits `fn()`, starting a duplicate when it has not returned by the tracker's threshold.
+
+    The first attempt to succeed wins and the others are cancelled. An attempt that fails
+    while another is still running is ignored; when every attempt fails, the last error is raised.
+    `reserve()`, when given, is called before each duplicate and returns a function that frees
+    what it reserved, called once that duplicate ends; once it returns None, no more are started.
+    """
+    tracker.calls += 1
+    if not HEDGE_ENABLED:
+        return await fn()
+
+    async def attempt():
+        started_at = time.perf_counter()
+        result = await fn()
+        return result, time.perf_counter() - started_at
+
+    primary = asyncio.ensure_future(attempt())
+    tasks = [primary]
+    started = 1
+    error = None
+    try:
+        while tasks:
+            can_hedge = started <= HEDGE_MAX_EXTRA
+            done, _ = await asyncio.wait(
+                tasks,
+                timeout=tracker.threshold() if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                release = reserve() if reserve is not None else None
+                if reserve is not None and release is None:
+                    started = HEDGE_MAX_EXTRA + 1
+                    continue
+                tracker.hedges += 1
+                started += 1
+                task = asyncio.ensure_future(attempt())
+                if release is not None:
+                    # A done callback also runs for a task cancelled before it started
+                    task.add_done_callback(lambda _, release=release: release())
+                tasks.append(task)
+                continue
+            for task in done:
+                won = task is not primary
+                tasks.remove(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                result, seconds = task.result()
+                tracker.observe(seconds)
+                if won:
+                    tracker.hedge_wins += 1
+                hedged_requests.inc(stage=tracker.name, outcome="hedge" if won else "primary")
+                return result
+        hedged_requests.inc(stage=tracker.name, outcome="failed")
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
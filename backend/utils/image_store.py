@@ -0,0 +1,85 @@
+import hashlib
+import io
+import os
+from PIL import Image, UnidentifiedImageError
+from utils.base64_helpers import base64_to_bytes, to_data_url
+from utils.blob_store import blob_store
+from utils.cache import ByteLRUCache
+from utils.derivatives import schedule_derivatives
+from utils.metrics import register_cache
+
+PIL_FORMAT_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+    "HEIF": "image/heif",
+    "AVIF": "image/avif",
+}
+
+IMAGE_COLUMNS = ("image_hash", "image_mime_type", "image_width", "image_height")
+
+# Decoded room/furniture images keyed by ("room" | "furniture", row id)
+decoded_image_cache = ByteLRUCache(int(float(os.getenv("DECODED_IMAGE_CACHE_MB", "256")) * 1024 * 1024))
+register_cache("decoded_images", decoded_image_cache)
+
+
+def describe_image(data: bytes, fallback_mime_type: str = "image/png"):
+    """Returns (mime_type, width, height) by reading only the image header."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return PIL_FORMAT_MIME_TYPES.get(img.format, fallback_mime_type), img.width, img.height
+    except (UnidentifiedImageError, OSError):
+        return fallback_mime_type, None, None
+
+
+def store_image(data: bytes, mime_type: str = "image/png", derivatives: bool = True) -> dict:
+    """Writes the image to the blob store (once per distinct content) and returns its row columns.
+
+    Thumbnail/preview variants are rendered in the background unless `derivatives` is False.
+    Blob writes block, so async callers run this with asyncio.to_thread.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    mime_type, width, height = describe_image(data, mime_type)
+    blob_store.put(digest, data, mime_type)
+    if derivatives and width:
+        schedule_derivatives(digest, data)
+    return {
+        "image_hash": digest,
+        "image_mime_type": mime_type,
+        "image_width": width,
+        "image_height": height,
+    }
+
+
+def load_image(row: dict, legacy_column: str):
+    """Returns the raw image bytes for a row, falling back to the legacy base64 column. Blocking."""
+    if row.get("image_hash"):
+        return blob_store.get(row["image_hash"])
+    if row.get(legacy_column):
+        return base64_to_bytes(row[legacy_column])
+    return None
+
+
+def image_data_url(row: dict, legacy_column: str):
+    """The row's image as a data: URL. Blocking, like load_image."""
+    if row.get("image_hash"):
+        data = blob_store.get(row["image_hash"])
+        return to_data_url(data, row.get('image_mime_type') or 'image/png')
+    if row.get(legacy_column):
+        return f"data:image/png;base64,{row[legacy_column]}"
+    return None
+
+
+def thumbnail_url(row: dict, kind: str):
+    """Thumbnail URL for a listing row; rows still on the base64 column get the by-id legacy endpoint."""
+    return image_url(row, "thumb") or f"/api/images/legacy/{kind}/{row['id']}"
+
+
+def image_url(row: dict, variant: str = None):
+    """Relative URL of the binary image endpoint for a row, or None for rows still on base64 columns."""
+    if not row.get("image_hash"):
+        return None
+    if variant:
+        return f"/api/images/{row['image_hash']}?variant={variant}"
+    return f"/api/images/{row['image_hash']}"
@@ -0,0 +1,335 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from fastapi import HTTPException
+from utils.blob_store import BLOB_STORE_DIR
+from utils.metrics import registry, Gauge
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(BLOB_STORE_DIR), "jobs.sqlite3"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "100"))
+JOBS_RETENTION_SECONDS = float(os.getenv("JOBS_RETENTION_SECONDS", "86400"))
+JOBS_HEARTBEAT_SECONDS = float(os.getenv("JOBS_HEARTBEAT_SECONDS", "10"))
+JOBS_STALE_SECONDS = float(os.getenv("JOBS_STALE_SECONDS", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Bounded generation queue persisted in SQLite so queued jobs survive a worker restart.
+
+    Handlers are registered per job kind and receive the JSON payload given at submit time;
+    whatever JSON-serializable dict they return becomes the job result.
+
+    Several processes can share the database. A job is claimed with a conditional UPDATE,
+    so only one of them runs it, and its owner refreshes `heartbeat_at` while it runs.
+    Running jobs whose heartbeat is older than JOBS_STALE_SECONDS are requeued.
+    """
+
+    def __init__(self, db_path: str, workers: int, max_queued: int):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.handlers = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker_tasks = []
+        self._running = {}
+        self._finished = {}
+        self._avg_job_seconds = 30.0
+        self._heartbeat_task = None
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                heartbeat_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Databases created before jobs had owners
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _update(self, sql: str, params=()) -> int:
+        """Runs an UPDATE and returns how many rows it changed."""
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def _notify(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _finish(self, job_id: str, status: str, result=None, error=None) -> bool:
+        """Records how a job this worker ran ended; False if it was cancelled or requeued meanwhile."""
+        finished = await asyncio.to_thread(
+            self._update,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, RUNNING, self.owner),
+        )
+        self._notify(job_id)
+        return bool(finished)
+
+    def queued_count(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,))[0][0]
+
+    def retry_after(self) -> int:
+        return max(1, int(self.queued_count() * self._avg_job_seconds / max(1, self.workers)))
+
+    def submit(self, kind: str, payload: dict) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        if self.queued_count() >= self.max_queued:
+            raise QueueFull(self.retry_after())
+
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(payload), now, now),
+        )
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        rows = self._execute(
+            "SELECT id, kind, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+        row = dict(rows[0])
+        row["result"] = json.loads(row["result"]) if row["result"] else None
+        if row["status"] == QUEUED:
+            row["position"] = self._execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?", (QUEUED, row["created_at"])
+            )[0][0]
+        return row
+
+    async def wait(self, job_id: str, timeout: float):
+        """Waits up to `timeout` seconds for the job to finish and returns its latest state."""
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or timeout <= 0:
+            return job
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.get(job_id)
+
+    def cancel(self, job_id: str):
+        """Cancels a queued or running job; returns its state, or None if it does not exist."""
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return job
+        # A job running in another process is stopped by that process's next heartbeat
+        self._update(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+        )
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        self._notify(job_id)
+        return self.get(job_id)
+
+    def _claim(self, job_id: str):
+        """Marks a queued job as running here and returns (kind, payload), or None if it was not queued."""
+        now = time.time()
+        claimed = self._update(
+            "UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND status = ?",
+            (RUNNING, self.owner, now, now, job_id, QUEUED),
+        )
+        if not claimed:
+            # Cancelled, or another worker got it first
+            return None
+        rows = self._execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,))
+        return rows[0]["kind"], json.loads(rows[0]["payload"])
+
+    async def _run_job(self, job_id: str):
+        # SQLite calls block, so they run in a worker thread rather than on the event loop
+        claimed = await asyncio.to_thread(self._claim, job_id)
+        if claimed is None:
+            return
+        kind, payload = claimed
+
+        started_at = time.perf_counter()
+        task = None
+        try:
+            # Inside the try so a job of an unknown kind (e.g. queued by a newer release) fails instead of the worker
+            task = asyncio.ensure_future(self.handlers[kind](payload))
+            self._running[job_id] = task
+            result = await task
+            await self._finish(job_id, SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            if task is None or not task.cancelled() or asyncio.current_task().cancelling():
+                raise
+            # cancel() or the heartbeat already recorded the status
+        except HTTPException as e:
+            await self._finish(job_id, FAILED, error=str(e.detail))
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            traceback.print_exc()
+            await self._finish(job_id, FAILED, error="Internal Server Error")
+        finally:
+            self._running.pop(job_id, None)
+            elapsed = time.perf_counter() - started_at
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _requeue_stale(self) -> list:
+        """Requeues running jobs whose owner stopped sending heartbeats; returns their ids."""
+        cutoff = time.time() - JOBS_STALE_SECONDS
+        stale = self._execute(
+            "SELECT id FROM jobs WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?) ORDER BY created_at",
+            (RUNNING, cutoff),
+        )
+        requeued = []
+        for row in stale:
+            # Re-checked in the UPDATE in case the owner was only slow, or another process got there first
+            if self._update(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (QUEUED, time.time(), row["id"], RUNNING, cutoff),
+            ):
+                requeued.append(row["id"])
+        return requeued
+
+    def _refresh_heartbeats(self, job_ids: list) -> list:
+        """Refreshes the heartbeat of these jobs; returns the ones no longer marked as running here."""
+        now = time.time()
+        return [
+            job_id for job_id in job_ids
+            if not self._update(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (now, job_id, RUNNING, self.owner),
+            )
+        ]
+
+    async def _beat(self):
+        """Keeps the jobs running here alive, stops those no longer ours and queues stale ones."""
+        lost = await asyncio.to_thread(self._refresh_heartbeats, list(self._running))
+        for job_id in lost:
+            task = self._running.get(job_id)
+            if task is not None:
+                task.cancel()
+        for job_id in await asyncio.to_thread(self._requeue_stale):
+            self._queue.put_nowait(job_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOBS_HEARTBEAT_SECONDS)
+            try:
+                await self._beat()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+                traceback.print_exc()
+
+    def start(self):
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue()
+        # Jobs left running by a worker that stopped are retried; a live sibling's jobs are not touched
+        self._requeue_stale()
+        self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+            (SUCCEEDED, FAILED, CANCELLED, time.time() - JOBS_RETENTION_SECONDS),
+        )
+        for row in self._execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)):
+            self._queue.put_nowait(row["id"])
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        tasks = [*self._worker_tasks, self._heartbeat_task] if self._heartbeat_task else list(self._worker_tasks)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        self._heartbeat_task = None
+        # Hand what was running here straight back to the queue instead of waiting for it to go stale
+        await asyncio.to_thread(
+            self._update,
+            "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE status = ? AND owner = ?",
+            (QUEUED, time.time(), RUNNING, self.owner),
+        )
+
+    def stats(self) -> dict:
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "running": len(self._running),
+            "counts": counts,
+            "avg_job_seconds": self._avg_job_seconds,
+        }
+
+
+job_queue = JobQueue(JOBS_DB_PATH, JOBS_WORKERS, JOBS_MAX_QUEUED)
+
+registry.register(Gauge(
+    "ati_jobs", "Background jobs by status.", ("status",),
+    callback=lambda: {(status,): count for status, count in job_queue.stats()["counts"].items()}
+))
+
+
+def submit_or_503(kind: str, payload: dict) -> str:
+    try:
+        return job_queue.submit(kind, payload)
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many queued jobs, try again later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
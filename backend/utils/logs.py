@@ -0,0 +1,48 @@
+import json
+import os
+import random
+import time
+import traceback
+
+# Share of debug events (prompts, model response summaries) that are written out
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "300"))
+
+
+def _cap(value):
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        return value[:LOG_MAX_FIELD_CHARS] + f"...(+{len(value) - LOG_MAX_FIELD_CHARS} chars)"
+    if isinstance(value, dict):
+        return {key: _cap(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_cap(item) for item in value]
+    return value
+
+
+def log_event(event: str, debug: bool = False, **fields):
+    """Writes one JSON log line. Binary fields are replaced by their size and long strings are cut.
+
+    `debug` events are only written for a LOG_SAMPLE_RATE share of calls.
+    """
+    if debug and random.random() >= LOG_SAMPLE_RATE:
+        return
+    record = {"ts": round(time.time(), 3), "event": event, **_cap(fields)}
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def log_exception(event: str, error: BaseException, **fields):
+    """Writes one JSON log line for a caught exception, with its type, message and full traceback.
+
+    The traceback is not cut to LOG_MAX_FIELD_CHARS; the other fields are, as in log_event.
+    """
+    record = {
+        "ts": round(time.time(), 3),
+        "event": event,
+        **_cap(fields),
+        "error_type": type(error).__name__,
+        "error": _cap(str(error)),
+        "traceback": "".join(traceback.format_exception(error)),
+    }
+    print(json.dumps(record, ensure_ascii=False, default=str))
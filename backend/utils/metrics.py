@@ -0,0 +1,250 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Seconds; spans a cache hit (ms) through a slow image generation (a minute)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Bytes; 1KB through 32MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """A settable gauge, or one read from `callback() -> {label values tuple: value}` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list[str]:
+        if self.callback is not None:
+            items = list(self.callback().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self.header()
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "ati_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+))
+http_request_seconds = registry.register(Histogram(
+    "ati_http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route")
+))
+http_request_bytes = registry.register(Histogram(
+    "ati_http_request_bytes", "Request body size.", ("route",), buckets=SIZE_BUCKETS
+))
+http_response_bytes = registry.register(Histogram(
+    "ati_http_response_bytes", "Response body size.", ("route",), buckets=SIZE_BUCKETS
+))
+http_in_flight = registry.register(Gauge(
+    "ati_http_requests_in_flight", "Requests currently being handled."
+))
+stage_seconds = registry.register(Histogram(
+    "ati_stage_duration_seconds", "Time spent in each processing stage.", ("stage",)
+))
+model_call_seconds = registry.register(Histogram(
+    "ati_model_call_duration_seconds", "Gemini call latency by model, excluding queueing.", ("model",)
+))
+model_wait_seconds = registry.register(Histogram(
+    "ati_model_call_wait_seconds", "Time spent waiting for a Gemini call slot.", ("model",)
+))
+model_call_errors = registry.register(Counter(
+    "ati_model_call_errors_total", "Failed Gemini calls by model.", ("model",)
+))
+model_call_retries = registry.register(Counter(
+    "ati_model_call_retries_total", "Gemini calls retried after a retryable error, by model and status.", ("model", "status")
+))
+model_call_deadline_exceeded = registry.register(Counter(
+    "ati_model_call_deadline_exceeded_total", "Gemini calls abandoned because the endpoint's deadline ran out.", ("model",)
+))
+serpapi_seconds = registry.register(Histogram(
+    "ati_serpapi_duration_seconds", "SerpAPI search latency (cache misses only).", ("outcome",)
+))
+db_query_seconds = registry.register(Histogram(
+    "ati_db_query_duration_seconds", "Supabase query latency by table.", ("table",)
+))
+
+_caches = {}
+
+
+def register_cache(name: str, cache):
+    """Exposes a cache's hit/miss counts and hit ratio; `cache` needs a stats() with hits and misses."""
+    _caches[name] = cache
+
+
+def _cache_stat(field: str):
+    def collect():
+        values = {}
+        for name, cache in _caches.items():
+            stats = cache.stats()
+            if field == "hit_ratio":
+                lookups = stats["hits"] + stats["misses"]
+                values[(name,)] = stats["hits"] / lookups if lookups else 0.0
+            else:
+                values[(name,)] = stats[field]
+        return values
+    return collect
+
+
+registry.register(Gauge("ati_cache_hits", "Cache hits since start.", ("cache",), callback=_cache_stat("hits")))
+registry.register(Gauge("ati_cache_misses", "Cache misses since start.", ("cache",), callback=_cache_stat("misses")))
+registry.register(Gauge("ati_cache_hit_ratio", "Cache hits over lookups since start.", ("cache",), callback=_cache_stat("hit_ratio")))
+registry.register(Gauge("ati_cache_entries", "Entries currently cached.", ("cache",), callback=_cache_stat("entries")))
+
+
+class MetricsMiddleware:
+    """Records per-route request counts, latency, in-flight requests and body sizes.
+
+    Routes are labelled by their path template (/api/jobs/{job_id}), never the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started_at = time.perf_counter()
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+        http_in_flight.inc()
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            http_in_flight.dec()
+            method = scope.get("method", "")
+            http_requests.inc(method=method, route=route, status=status)
+            http_request_seconds.observe(time.perf_counter() - started_at, method=method, route=route)
+            http_request_bytes.observe(request_bytes, route=route)
+            http_response_bytes.observe(response_bytes, route=route)
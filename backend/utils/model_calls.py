@@ -0,0 +1,402 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import random
+import time
+import httpx
+from fastapi import HTTPException
+from utils.hedging import hedged
+from utils.metrics import (
+    registry, Gauge, model_call_seconds, model_wait_seconds, model_call_errors,
+    model_call_retries, model_call_deadline_exceeded,
+)
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_DEFAULT_RPM = float(os.getenv("GEMINI_DEFAULT_RPM", "500"))
+GEMINI_RETRY_ATTEMPTS = int(os.getenv("GEMINI_RETRY_ATTEMPTS", "4"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "1"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "20"))
+MODEL_CALL_DEFAULT_DEADLINE_SECONDS = float(os.getenv("MODEL_CALL_DEFAULT_DEADLINE_SECONDS", "120"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_model_values(value: str) -> dict:
+    """Parses "name=number,name=number" into {name: float}."""
+    values = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, number = item.split("=", 1)
+            values[name.strip()] = float(number)
+    return values
+
+
+# Requests per minute allowed per model; 0 disables the limit for that model
+GEMINI_QUOTA_RPM = parse_model_values(os.getenv("GEMINI_QUOTA_RPM", "gemini-2.5-flash-image=500,gemini-2.5-flash=1000"))
+# Seconds an endpoint may spend on its model calls, queueing and retries included
+MODEL_CALL_DEADLINES = parse_model_values(
+    os.getenv("MODEL_CALL_DEADLINES", "try_on=120,try_on_batch=180,place_furniture=150,analyze_and_search=45")
+)
+
+_call_session = contextvars.ContextVar("model_call_session", default="")
+_call_deadline = contextvars.ContextVar("model_call_deadline", default=None)
+
+
+def set_call_context(endpoint: str, session_id: str = None):
+    """Tags the model calls made from here on (in this request or job) for fair queuing and deadlines.
+
+    Calls are queued per `session_id`, and all of them together must finish within the
+    endpoint's budget from MODEL_CALL_DEADLINES. Calls made without a context (e.g. the
+    room pool) share one queue and have no deadline.
+    """
+    _call_session.set(session_id or "")
+    _call_deadline.set(time.monotonic() + MODEL_CALL_DEADLINES.get(endpoint, MODEL_CALL_DEFAULT_DEADLINE_SECONDS))
+
+
+def remaining_seconds():
+    deadline = _call_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """Per-minute request quota: refills continuously and allows a burst of up to one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60 if per_minute > 0 else None
+        self.capacity = max(1.0, per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now: float) -> bool:
+        if self.rate is None:
+            return True
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, now: float) -> float:
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def drain(self):
+        """After a 429 the upstream quota is evidently spent, whatever our own count says."""
+        if self.rate is not None:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class ModelCallScheduler:
+    """Single queue in front of every Gemini call.
+
+    A call is started when a concurrency slot is free and its model's token bucket has a
+    token. Waiting calls are grouped by session and served round-robin, so one session's
+    batch cannot starve the others; within a session calls keep their order.
+    """
+
+    def __init__(self, limit: int, quotas: dict, default_rpm: float):
+        self.limit = max(1, limit)
+        self.quotas = quotas
+        self.default_rpm = default_rpm
+        self._buckets = {}
+        self._queues = {}
+        self._order = collections.deque()
+        self._wakeup = None
+        self.in_flight = 0
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.retries = 0
+        self.hedge_calls = 0
+        self.deadline_exceeded = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_call_seconds = 0.0
+        self.calls_by_model = {}
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def bucket(self, model: str) -> TokenBucket:
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            bucket = self._buckets[model] = TokenBucket(self.quotas.get(model, self.default_rpm))
+        return bucket
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.in_flight < self.limit and self._order:
+            served = False
+            throttled_for = None
+            for _ in range(len(self._order)):
+                session = self._order.popleft()
+                queue = self._queues[session]
+                while queue and queue[0][1].done():
+                    queue.popleft()  # gave up waiting
+                if queue:
+                    bucket = self.bucket(queue[0][0])
+                    if bucket.take(now):
+                        queue.popleft()[1].set_result(None)
+                        self.in_flight += 1
+                        served = True
+                    else:
+                        delay = bucket.seconds_until_token(now)
+                        throttled_for = delay if throttled_for is None else min(throttled_for, delay)
+                if queue:
+                    self._order.append(session)
+                else:
+                    del self._queues[session]
+                if served:
+                    break
+            if not served:
+                if throttled_for is not None and self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later(throttled_for, self._on_wakeup)
+                return
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    async def _acquire(self, model: str):
+        session = _call_session.get()
+        future = asyncio.get_running_loop().create_future()
+        if session not in self._queues:
+            self._queues[session] = collections.deque()
+            self._order.append(session)
+        entry = (model, future)
+        self._queues[session].append(entry)
+        self._dispatch()
+
+        timeout = remaining_seconds()
+        try:
+            if timeout is None:
+                await future
+            else:
+                await asyncio.wait_for(future, max(timeout, 0))
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            model_call_deadline_exceeded.inc(model=model)
+            raise HTTPException(
+                status_code=503,
+                detail="The model is busy; try again shortly",
+                headers={"Retry-After": str(max(1, math.ceil(self.bucket(model).seconds_until_token(time.monotonic()))))},
+            )
+        except BaseException:
+            # Granted just as the caller was cancelled: hand the slot on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            queue = self._queues.get(session)
+            if queue and entry in queue:
+                queue.remove(entry)
+                if not queue:
+                    del self._queues[session]
+                    self._order.remove(session)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, model: str):
+        """Holds one call slot for the body of the `async with`, e.g. for the length of a stream."""
+        queued_at = time.perf_counter()
+        await self._acquire(model)
+
+        wait_seconds = time.perf_counter() - queued_at
+        model_wait_seconds.observe(wait_seconds, model=model)
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.failed_calls += 1
+            model_call_errors.inc(model=model)
+            raise
+        finally:
+            call_seconds = time.perf_counter() - started_at
+            model_call_seconds.observe(call_seconds, model=model)
+            self.total_calls += 1
+            self.total_call_seconds += call_seconds
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            self._release()
+
+    def retry_delay(self, model: str, error: Exception, attempt: int) -> float:
+        """Seconds to back off before retrying `error`, or raises when it should not be retried."""
+        status = retryable_status(error)
+        if status is None:
+            raise error
+        if status == 429:
+            self.bucket(model).drain()
+        # Full jitter, so callers that failed together do not retry together
+        delay = random.uniform(0, min(GEMINI_RETRY_MAX_SECONDS, GEMINI_RETRY_BASE_SECONDS * 2 ** attempt))
+        remaining = remaining_seconds()
+        if attempt + 1 >= GEMINI_RETRY_ATTEMPTS or (remaining is not None and delay >= remaining):
+            retry_after = str(max(1, math.ceil(delay)))
+            if status == 429:
+                raise HTTPException(status_code=429, detail="Model quota exhausted; try again shortly", headers={"Retry-After": retry_after})
+            raise HTTPException(status_code=503, detail="The model is temporarily unavailable", headers={"Retry-After": retry_after})
+        self.retries += 1
+        model_call_retries.inc(model=model, status=status)
+        return delay
+
+    async def within_deadline(self, model: str, awaitable):
+        remaining = remaining_seconds()
+        if remaining is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(remaining, 0))
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            model_call_deadline_exceeded.inc(model=model)
+            raise HTTPException(status_code=504, detail="The model did not answer in time")
+
+    def reserve_hedge(self, model: str):
+        """Takes a slot and a quota token for a duplicate call if nothing is queued; returns the slot's release, or None."""
+        if self.waiting or self.in_flight >= self.limit:
+            return None
+        if not self.bucket(model).take(time.monotonic()):
+            return None
+        self.in_flight += 1
+        self.hedge_calls += 1
+        return self._release
+
+    async def call(self, model: str, call, hedge=None):
+        """Runs `call()` in a slot, retrying retryable errors with backoff within the deadline.
+
+        With a `hedge` LatencyTracker the call is hedged once it holds its slot, so the
+        threshold and samples cover service time only, never time spent queued.
+        """
+        if hedge is not None:
+            unhedged = call
+            call = lambda: hedged(hedge, unhedged, reserve=lambda: self.reserve_hedge(model))
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(model):
+                    return await self.within_deadline(model, call())
+            except HTTPException:
+                raise
+            except Exception as e:
+                delay = self.retry_delay(model, e, attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "sessions_waiting": len(self._queues),
+            "total_calls": self.total_calls,
+            "failed_calls": self.failed_calls,
+            "retries": self.retries,
+            "hedge_calls": self.hedge_calls,
+            "deadline_exceeded": self.deadline_exceeded,
+            "avg_wait_seconds": self.total_wait_seconds / self.total_calls if self.total_calls else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_call_seconds": self.total_call_seconds / self.total_calls if self.total_calls else 0.0,
+            "calls_by_model": dict(self.calls_by_model),
+            "quota_tokens": {
+                model: round(bucket.available(now), 2) for model, bucket in self._buckets.items() if bucket.rate is not None
+            },
+        }
+
+
+def retryable_status(error: Exception):
+    """HTTP status of a retryable Gemini failure (429/5xx, or 503 for a dropped connection), else None."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code if code in RETRYABLE_STATUSES else None
+    if isinstance(error, httpx.TransportError):
+        return 503
+    return None
+
+
+model_scheduler = ModelCallScheduler(GEMINI_MAX_CONCURRENCY, GEMINI_QUOTA_RPM, GEMINI_DEFAULT_RPM)
+
+registry.register(Gauge(
+    "ati_model_calls_in_flight", "Gemini calls currently running.",
+    callback=lambda: {(): model_scheduler.in_flight}
+))
+registry.register(Gauge(
+    "ati_model_calls_waiting", "Gemini calls queued for a slot or quota token.",
+    callback=lambda: {(): model_scheduler.waiting}
+))
+registry.register(Gauge(
+    "ati_model_call_sessions_waiting", "Sessions with at least one queued Gemini call.",
+    callback=lambda: {(): len(model_scheduler._queues)}
+))
+
+
+async def generate_content(client, model: str, contents, config=None, hedge=None):
+    """Runs `generate_content` on the SDK's async client through the scheduler, hedged with `hedge` if given."""
+    return await model_scheduler.call(
+        model,
+        lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+        hedge=hedge,
+    )
+
+
+async def generate_content_stream(client, model: str, contents, config=None):
+    """Yields response chunks from `generate_content_stream`, holding a call slot until the stream ends.
+
+    Failures before the first chunk are retried like `generate_content`; later ones are raised.
+    """
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async with model_scheduler.slot(model):
+                stream = await model_scheduler.within_deadline(
+                    model, client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+                )
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+            return
+        except HTTPException:
+            raise
+        except Exception as e:
+            if started:
+                raise
+            delay = model_scheduler.retry_delay(model, e, attempt)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def response_parts(response) -> list:
+    """Parts of the first candidate of a response or stream chunk, or [] when there are none."""
+    if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts
+    return []
+
+
+def summarize_parts(parts) -> list:
+    """Loggable outline of response parts: kinds and sizes instead of the payloads."""
+    summary = []
+    for part in parts:
+        if getattr(part, "inline_data", None):
+            summary.append({"image": part.inline_data.mime_type, "bytes": len(part.inline_data.data or b"")})
+        elif getattr(part, "text", None):
+            summary.append({"text_chars": len(part.text)})
+    return summary
@@ -0,0 +1,91 @@
+import json
+import uuid
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+JSON = "json"
+IMAGE = "image"
+MULTIPART = "multipart"
+URL = "url"
+
+# IDs copied into X-... headers when the body is only the image or its URL
+ID_FIELDS = ("design_id", "parent_design_id", "original_design_id", "user_room_id", "image_hash")
+
+
+def _format_for(media_type: str):
+    if media_type.startswith("image/"):
+        return IMAGE
+    if media_type in ("multipart/mixed", "multipart/*"):
+        return MULTIPART
+    if media_type == "text/uri-list":
+        return URL
+    if media_type in ("application/json", "application/*"):
+        return JSON
+    return None
+
+
+def preferred_format(accept: str) -> str:
+    """Picks how to return a generated image from the Accept header.
+
+    `image/*` returns the raw image, `multipart/mixed` a JSON part plus the image,
+    `text/uri-list` only the stored blob's URL. Anything else, including no header
+    or `*/*`, keeps the JSON body with a data URL that existing clients expect.
+    """
+    best, best_q = JSON, 0.0
+    for item in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in item.split(";")]
+        response_format = _format_for(media_type.lower())
+        if response_format is None:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # Earlier entries win ties, as listed by the client
+        if q > best_q:
+            best, best_q = response_format, q
+    return best
+
+
+def _id_headers(metadata: dict) -> dict:
+    return {
+        "X-" + "-".join(word.capitalize() for word in field.split("_")): str(metadata[field])
+        for field in ID_FIELDS
+        if metadata.get(field) is not None
+    }
+
+
+def image_response(response_format: str, image_data: bytes, mime_type: str, metadata: dict, url: str = None, headers: dict = None) -> Response:
+    """Returns the image in a non-JSON format chosen by `preferred_format`; the bytes are sent as they came from the model."""
+    headers = {**(headers or {}), **_id_headers(metadata), "Vary": "Accept"}
+    if url:
+        headers["X-Image-Url"] = url
+
+    if response_format == IMAGE:
+        return Response(content=image_data, media_type=mime_type, headers=headers)
+
+    if response_format == URL:
+        if not url:
+            raise HTTPException(status_code=500, detail="Generated image was not stored")
+        return Response(content=f"{url}\r\n", media_type="text/uri-list", headers=headers)
+
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n"
+        f"{json.dumps({**metadata, 'image_url': url})}\r\n"
+        f"--{boundary}\r\nContent-Type: {mime_type}\r\nContent-Length: {len(image_data)}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def parts():
+        # Yielded separately so the image is never concatenated into a second buffer
+        yield head
+        yield image_data
+        yield tail
+
+    headers["Content-Length"] = str(len(head) + len(image_data) + len(tail))
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
@@ -0,0 +1,149 @@
+import asyncio
+import io
+import os
+import time
+from PIL import Image, ImageOps, UnidentifiedImageError
+from utils.metrics import stage_seconds
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+
+DEFAULT_MODEL_IMAGE_MAX_EDGE = int(os.getenv("DEFAULT_MODEL_IMAGE_MAX_EDGE", "1536"))
+MODEL_IMAGE_QUALITY = int(os.getenv("MODEL_IMAGE_QUALITY", "85"))
+
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def parse_model_max_edges(value: str) -> dict:
+    """Parses "model=edge,model=edge" into {model: edge}."""
+    edges = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, edge = item.split("=", 1)
+            edges[model.strip()] = int(edge)
+    return edges
+
+
+# Long-edge cap per model; the model downsamples anything larger, so extra pixels only cost upload time
+MODEL_IMAGE_MAX_EDGE = parse_model_max_edges(
+    os.getenv("MODEL_IMAGE_MAX_EDGE", "gemini-2.5-flash-image=1536,gemini-2.5-flash=1024")
+)
+
+
+class PreprocessReport:
+    """Per-request totals for the images prepared for one model call."""
+
+    def __init__(self):
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.sent_bytes
+
+    def headers(self, model_seconds: float = None) -> dict:
+        timings = [f"preprocess;dur={self.seconds * 1000:.1f}"]
+        if model_seconds is not None:
+            timings.append(f"model;dur={model_seconds * 1000:.1f}")
+        return {
+            "Server-Timing": ", ".join(timings),
+            "X-Image-Bytes-Original": str(self.original_bytes),
+            "X-Image-Bytes-Sent": str(self.sent_bytes),
+        }
+
+
+class PreprocessStats:
+    """Process-wide totals across all requests."""
+
+    def __init__(self):
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+        self.failures = 0
+
+    def record(self, original_bytes: int, sent_bytes: int, seconds: float):
+        self.images += 1
+        self.original_bytes += original_bytes
+        self.sent_bytes += sent_bytes
+        self.seconds += seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "images": self.images,
+            "original_bytes": self.original_bytes,
+            "sent_bytes": self.sent_bytes,
+            "bytes_saved": self.original_bytes - self.sent_bytes,
+            "avg_preprocess_seconds": self.seconds / self.images if self.images else 0.0,
+            "failures": self.failures,
+        }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def max_edge_for(model: str) -> int:
+    return MODEL_IMAGE_MAX_EDGE.get(model, DEFAULT_MODEL_IMAGE_MAX_EDGE)
+
+
+def downscale_image(data: bytes, mime_type: str, max_edge: int, quality: int = MODEL_IMAGE_QUALITY):
+    """Applies EXIF orientation, caps the long edge and re-encodes (JPEG, or WebP when there is alpha).
+
+    Returns the original bytes untouched when they are already upright, small enough and
+    re-encoding would not make them smaller.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format
+        rotated = img.getexif().get(0x0112, 1) != 1
+        oriented = ImageOps.exif_transpose(img)
+        needs_resize = max(oriented.size) > max_edge
+        needs_decode = source_format not in PASSTHROUGH_FORMATS
+
+        if not (rotated or needs_resize or needs_decode) and len(data) < 256 * 1024:
+            return data, PASSTHROUGH_FORMATS[source_format]
+
+        if needs_resize:
+            oriented.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        has_alpha = "A" in oriented.getbands() or "transparency" in oriented.info
+        out = io.BytesIO()
+        if has_alpha:
+            oriented.convert("RGBA").save(out, format="WEBP", quality=quality)
+            out_mime_type = "image/webp"
+        else:
+            oriented.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+            out_mime_type = "image/jpeg"
+
+    encoded = out.getvalue()
+    if not (rotated or needs_resize or needs_decode) and len(encoded) >= len(data):
+        return data, PASSTHROUGH_FORMATS[source_format]
+    return encoded, out_mime_type
+
+
+async def prepare_for_model(data: bytes, mime_type: str, model: str, report: PreprocessReport = None):
+    """Downscales/re-encodes an image for `model` off the event loop; returns (bytes, mime_type).
+
+    Images Pillow cannot decode are passed through unchanged.
+    """
+    started_at = time.perf_counter()
+    try:
+        prepared, prepared_mime_type = await asyncio.to_thread(downscale_image, data, mime_type, max_edge_for(model))
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Image preprocessing skipped ({mime_type}): {e}")
+        preprocess_stats.failures += 1
+        prepared, prepared_mime_type = data, mime_type
+
+    elapsed = time.perf_counter() - started_at
+    stage_seconds.observe(elapsed, stage="preprocess")
+    preprocess_stats.record(len(data), len(prepared), elapsed)
+    if report is not None:
+        report.images += 1
+        report.original_bytes += len(data)
+        report.sent_bytes += len(prepared)
+        report.seconds += elapsed
+    return prepared, prepared_mime_type
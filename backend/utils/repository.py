@@ -0,0 +1,291 @@
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import httpx
+from utils.blob_store import BLOB_STORE_DIR
+from utils.clients import clients, require_env
+from utils.image_store import IMAGE_COLUMNS
+from utils.metrics import db_query_seconds
+from utils.pagination import decode_cursor
+
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DB_BACKEND = os.getenv("DB_BACKEND", "postgrest").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_KEEPALIVE_CONNECTIONS = int(os.getenv("DB_KEEPALIVE_CONNECTIONS", "10"))
+DB_KEEPALIVE_SECONDS = float(os.getenv("DB_KEEPALIVE_SECONDS", "60"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+DB_CONNECT_TIMEOUT_SECONDS = float(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "3"))
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", os.path.join(os.path.dirname(BLOB_STORE_DIR), "app.sqlite3"))
+
+# Columns per table; projections are checked against these so a typo fails loudly in every backend
+TABLE_COLUMNS = {
+    "room_designs": (
+        "id", "session_id", "created_at", "design_metadata", "description", "generated_image_data", *IMAGE_COLUMNS,
+    ),
+    "furnitures": (
+        "id", "session_id", "created_at", "description", "image_base64", *IMAGE_COLUMNS,
+    ),
+}
+JSON_COLUMNS = {"design_metadata"}
+
+
+def projection(table: str, columns) -> tuple:
+    columns = tuple(columns)
+    unknown = [column for column in columns if column not in TABLE_COLUMNS[table]]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(unknown)}")
+    return columns
+
+
+class PostgrestBackend:
+    """Talks to Supabase's PostgREST API over one pooled, keep-alive (HTTP/2 when available) async client."""
+
+    def __init__(self, url: str, key: str):
+        self.base_url = f"{url.rstrip('/')}/rest/v1"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"}
+        self._client = None
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=DB_POOL_SIZE,
+                    max_keepalive_connections=DB_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=DB_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(DB_TIMEOUT_SECONDS, connect=DB_CONNECT_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _filters(eq: dict) -> dict:
+        return {column: f"eq.{value}" for column, value in eq.items()}
+
+    async def warm(self):
+        await self.select("room_designs", ("id",), {}, limit=1)
+
+    async def _request(self, method: str, table: str, **kwargs):
+        response = await self.client().request(method, f"/{table}", **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else []
+
+    async def select(self, table: str, columns: tuple, eq: dict, limit: int = None):
+        params = {"select": ",".join(columns), **self._filters(eq)}
+        if limit is not None:
+            params["limit"] = str(limit)
+        return await self._request("GET", table, params=params)
+
+    async def select_in(self, table: str, columns: tuple, column: str, values: list):
+        quoted = ",".join(f'"{value}"' for value in values)
+        params = {"select": ",".join(columns), column: f"in.({quoted})"}
+        return await self._request("GET", table, params=params)
+
+    async def page(self, table: str, columns: tuple, eq: dict, limit: int, cursor: tuple = None, ascending: bool = False):
+        direction, op = ("asc", "gt") if ascending else ("desc", "lt")
+        params = {
+            "select": ",".join(columns),
+            **self._filters(eq),
+            "order": f"created_at.{direction},id.{direction}",
+            "limit": str(limit),
+        }
+        if cursor:
+            created_at, row_id = cursor
+            params["or"] = f'(created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}."{row_id}"))'
+        return await self._request("GET", table, params=params)
+
+    async def insert(self, table: str, rows: list, returning: tuple):
+        return await self._request(
+            "POST", table,
+            params={"select": ",".join(returning)},
+            headers={"Prefer": "return=representation"},
+            json=rows,
+        )
+
+    async def delete(self, table: str, eq: dict, returning: tuple):
+        return await self._request(
+            "DELETE", table,
+            params={"select": ",".join(returning), **self._filters(eq)},
+            headers={"Prefer": "return=representation"},
+        )
+
+
+class SqliteBackend:
+    """Local stand-in for PostgREST with the same tables, for benchmarks and offline development."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for table, columns in TABLE_COLUMNS.items():
+            definitions = ", ".join("id TEXT PRIMARY KEY" if column == "id" else column for column in columns)
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created ON {table}(created_at DESC, id DESC)")
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_session_created ON {table}(session_id, created_at DESC, id DESC)"
+            )
+
+    async def close(self):
+        pass
+
+    async def warm(self):
+        await self.select("room_designs", ("id",), {}, limit=1)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params).fetchall()]
+
+    async def _run(self, sql: str, params: tuple = ()) -> list:
+        rows = await asyncio.to_thread(self._query, sql, params)
+        for row in rows:
+            for column in JSON_COLUMNS & row.keys():
+                if row[column] is not None:
+                    row[column] = json.loads(row[column])
+        return rows
+
+    @staticmethod
+    def _where(eq: dict):
+        clauses = [f"{column} = ?" for column in eq]
+        return clauses, tuple(eq.values())
+
+    async def select(self, table: str, columns: tuple, eq: dict, limit: int = None):
+        clauses, params = self._where(eq)
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return await self._run(sql, params)
+
+    async def select_in(self, table: str, columns: tuple, column: str, values: list):
+        placeholders = ", ".join("?" for _ in values)
+        return await self._run(f"SELECT {', '.join(columns)} FROM {table} WHERE {column} IN ({placeholders})", tuple(values))
+
+    async def page(self, table: str, columns: tuple, eq: dict, limit: int, cursor: tuple = None, ascending: bool = False):
+        direction, op = ("ASC", ">") if ascending else ("DESC", "<")
+        clauses, params = self._where(eq)
+        if cursor:
+            clauses.append(f"(created_at {op} ? OR (created_at = ? AND id {op} ?))")
+            params += (cursor[0], cursor[0], cursor[1])
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY created_at {direction}, id {direction} LIMIT {int(limit)}"
+        return await self._run(sql, params)
+
+    async def insert(self, table: str, rows: list, returning: tuple):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        prepared = []
+        for offset, row in enumerate(rows):
+            # Distinct microseconds keep a bulk insert's keyset order stable
+            created_at = (now + datetime.timedelta(microseconds=offset)).isoformat()
+            prepared.append({"id": str(uuid.uuid4()), "created_at": created_at, **row})
+
+        def write():
+            with self._lock:
+                self._db.execute("BEGIN")
+                for row in prepared:
+                    values = {
+                        column: json.dumps(value) if column in JSON_COLUMNS and value is not None else value
+                        for column, value in row.items()
+                    }
+                    self._db.execute(
+                        f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+                        tuple(values.values()),
+                    )
+                self._db.execute("COMMIT")
+
+        await asyncio.to_thread(write)
+        return [{column: row.get(column) for column in returning} for row in prepared]
+
+    async def delete(self, table: str, eq: dict, returning: tuple):
+        clauses, params = self._where(eq)
+        where = " AND ".join(clauses)
+        rows = await self._run(f"SELECT {', '.join(returning)} FROM {table} WHERE {where}", params)
+        await asyncio.to_thread(self._query, f"DELETE FROM {table} WHERE {where}", params)
+        return rows
+
+
+class TableRepository:
+    """Async access to one table. Every read names its columns; nothing selects "*"."""
+
+    def __init__(self, table: str):
+        self.table = table
+
+    @property
+    def backend(self):
+        return clients.get("database")
+
+    async def _timed(self, call):
+        started_at = time.perf_counter()
+        try:
+            return await call
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started_at, table=self.table)
+
+    async def get(self, row_id: str, columns, **eq):
+        """Returns the row with this id (and matching `eq` filters), or None."""
+        rows = await self._timed(self.backend.select(self.table, projection(self.table, columns), {"id": row_id, **eq}, limit=1))
+        return rows[0] if rows else None
+
+    async def get_many(self, ids: list, columns) -> list:
+        if not ids:
+            return []
+        return await self._timed(self.backend.select_in(self.table, projection(self.table, columns), "id", ids))
+
+    async def page(self, columns, limit: int, cursor: str = None, **eq) -> list:
+        """Newest first on (created_at, id), resuming strictly after `cursor`.
+
+        Fetches one extra row so split_page can tell whether another page exists.
+        """
+        decoded = decode_cursor(cursor) if cursor else None
+        return await self._timed(
+            self.backend.page(self.table, projection(self.table, columns), eq, limit + 1, decoded)
+        )
+
+    async def page_after(self, columns, limit: int, after: tuple = None) -> list:
+        """Oldest first, strictly after the (created_at, id) pair `after`; used to pick up newly inserted rows."""
+        return await self._timed(
+            self.backend.page(self.table, projection(self.table, columns), {}, limit, after, ascending=True)
+        )
+
+    async def insert(self, rows, returning=("id",)) -> list:
+        """Inserts one row (dict) or many (list) in a single round trip; returns them in the order given."""
+        rows = rows if isinstance(rows, list) else [rows]
+        return await self._timed(self.backend.insert(self.table, rows, projection(self.table, returning)))
+
+    async def delete(self, row_id: str) -> bool:
+        deleted = await self._timed(self.backend.delete(self.table, {"id": row_id}, ("id",)))
+        return bool(deleted)
+
+
+def create_backend():
+    if DB_BACKEND == "sqlite":
+        return SqliteBackend(DB_SQLITE_PATH)
+    if DB_BACKEND != "postgrest":
+        raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND}")
+    return PostgrestBackend(require_env("SUPABASE_URL"), require_env("SUPABASE_SERVICE_ROLE_KEY"))
+
+
+clients.register("database", create_backend, warm=lambda backend: backend.warm(), close=lambda backend: backend.close())
+designs = TableRepository("room_designs")
+furnitures = TableRepository("furnitures")
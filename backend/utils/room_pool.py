@@ -0,0 +1,219 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import traceback
+from utils.image_store import store_image
+from utils.blob_store import blob_store, BlobNotFound, BLOB_STORE_DIR
+
+# Off by default: filling the pool spends ROOM_POOL_SIZE image generations per (room type, style) at startup
+ROOM_POOL_ENABLED = os.getenv("ROOM_POOL_ENABLED", "false").lower() == "true"
+ROOM_POOL_ROOM_TYPES = [t.strip() for t in os.getenv("ROOM_POOL_ROOM_TYPES", "empty").split(",") if t.strip()]
+ROOM_POOL_STYLES = [s.strip() for s in os.getenv("ROOM_POOL_STYLES", "neutral").split(",") if s.strip()]
+ROOM_POOL_SIZE = int(os.getenv("ROOM_POOL_SIZE", "3"))
+ROOM_POOL_MAX_USES = int(os.getenv("ROOM_POOL_MAX_USES", "50"))
+ROOM_POOL_REFILL_INTERVAL_SECONDS = float(os.getenv("ROOM_POOL_REFILL_INTERVAL_SECONDS", "300"))
+ROOM_POOL_SYNC_SECONDS = float(os.getenv("ROOM_POOL_SYNC_SECONDS", "30"))
+ROOM_POOL_DB_PATH = os.getenv("ROOM_POOL_DB_PATH", os.path.join(os.path.dirname(BLOB_STORE_DIR), "room_pool.sqlite3"))
+
+
+def pool_key(room_type: str, style: str) -> str:
+    return f"{room_type.strip().lower()}|{style.strip().lower()}"
+
+
+class RoomPool:
+    """Pre-generated empty rooms per (room type, style), served round-robin and retired after max_uses.
+
+    Rooms and their use counts live in SQLite so every worker process shares one pool.
+    `take` only counts uses in memory; `sync` adds them to the shared counts, retires rooms
+    past max_uses and reloads what other processes added or retired.
+    """
+
+    def __init__(self, db_path: str, room_types: list[str], styles: list[str], size: int, max_uses: int):
+        self.keys = {pool_key(t, s): (t, s) for t in room_types for s in styles}
+        self.size = size
+        self.max_uses = max_uses
+        self.hits = 0
+        self.misses = 0
+        self._entries = {key: [] for key in self.keys}
+        self._unsynced = {}
+        self._cursor = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._task = None
+        self._sync_task = None
+        self._wake = asyncio.Event()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pooled_rooms (
+                pool_key TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (pool_key, image_hash)
+            )
+        """)
+        self.sync()
+
+    def sync(self):
+        """Writes the uses counted since the last sync and reloads the shared pool. Blocking; run off the event loop."""
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, {}
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    for (key, image_hash), uses in unsynced.items():
+                        self._db.execute(
+                            "UPDATE pooled_rooms SET uses = uses + ? WHERE pool_key = ? AND image_hash = ?",
+                            (uses, key, image_hash),
+                        )
+                    self._db.execute("DELETE FROM pooled_rooms WHERE uses >= ?", (self.max_uses,))
+                    rows = self._db.execute("SELECT pool_key, image_hash, uses FROM pooled_rooms ORDER BY rowid").fetchall()
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+        except Exception:
+            # Keep the counts for the next attempt
+            with self._lock:
+                for entry, uses in unsynced.items():
+                    self._unsynced[entry] = self._unsynced.get(entry, 0) + uses
+            raise
+
+        entries = {key: [] for key in self.keys}
+        for row in rows:
+            if row["pool_key"] in entries:
+                entries[row["pool_key"]].append({"image_hash": row["image_hash"], "uses": row["uses"]})
+        with self._lock:
+            # Uses taken while the database was being read are not in its counts yet
+            for (key, image_hash), uses in self._unsynced.items():
+                for entry in entries.get(key, []):
+                    if entry["image_hash"] == image_hash:
+                        entry["uses"] += uses
+            for key in entries:
+                entries[key] = [e for e in entries[key] if e["uses"] < self.max_uses]
+            self._entries = entries
+
+    def is_pooled(self, room_type: str, style: str) -> bool:
+        return pool_key(room_type, style) in self.keys
+
+    async def take(self, room_type: str, style: str):
+        """Returns the next pooled room image bytes for this key, or None if the pool is empty."""
+        key = pool_key(room_type, style)
+        while True:
+            with self._lock:
+                entries = self._entries.get(key)
+                if not entries:
+                    break
+                index = self._cursor.get(key, 0) % len(entries)
+                entry = entries[index]
+                entry["uses"] += 1
+                self._unsynced[(key, entry["image_hash"])] = self._unsynced.get((key, entry["image_hash"]), 0) + 1
+                if entry["uses"] >= self.max_uses:
+                    entries.pop(index)
+                    self._wake.set()
+                else:
+                    self._cursor[key] = index + 1
+            try:
+                data = await asyncio.to_thread(blob_store.get, entry["image_hash"])
+            except BlobNotFound:
+                with self._lock:
+                    if entry in entries:
+                        entries.remove(entry)
+                    # Counted up to max_uses so the next sync retires it for every process
+                    self._unsynced[(key, entry["image_hash"])] = self.max_uses
+                continue
+            self.hits += 1
+            return data
+        self.misses += 1
+        self._wake.set()
+        return None
+
+    def add(self, room_type: str, style: str, data: bytes, mime_type: str):
+        key = pool_key(room_type, style)
+        if key not in self._entries:
+            return
+        columns = store_image(data, mime_type, derivatives=False)
+        with self._db_lock:
+            added = self._db.execute(
+                "INSERT OR IGNORE INTO pooled_rooms (pool_key, image_hash, uses) VALUES (?, ?, 0)",
+                (key, columns["image_hash"]),
+            ).rowcount
+        if added:
+            with self._lock:
+                self._entries[key].append({"image_hash": columns["image_hash"], "uses": 0})
+
+    def deficits(self):
+        return [self.keys[key] for key, entries in self._entries.items() if len(entries) < self.size]
+
+    async def refill(self, generate):
+        """Tops up every key below the target size, one generation at a time."""
+        # Reload first so rooms another process just generated are counted
+        await asyncio.to_thread(self.sync)
+        for room_type, style in self.deficits():
+            while len(self._entries[pool_key(room_type, style)]) < self.size:
+                try:
+                    generated = await generate(room_type, style)
+                except Exception as e:
+                    print(f"Room pool refill failed for {room_type}/{style}: {e}")
+                    traceback.print_exc()
+                    break
+                if not generated:
+                    break
+                await asyncio.to_thread(self.add, room_type, style, *generated)
+
+    async def _refill_forever(self, generate):
+        # Refill on a timer, or straight away when a room is retired or a request misses
+        while True:
+            self._wake.clear()
+            await self.refill(generate)
+            try:
+                await asyncio.wait_for(self._wake.wait(), ROOM_POOL_REFILL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sync_forever(self):
+        while True:
+            await asyncio.sleep(ROOM_POOL_SYNC_SECONDS)
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                print(f"Room pool sync failed: {e}")
+                traceback.print_exc()
+
+    def start(self, generate=None):
+        """Starts the periodic sync, and with `generate` the background refill."""
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_forever())
+        if generate is not None and self._task is None:
+            self._task = asyncio.create_task(self._refill_forever(generate))
+
+    async def stop(self):
+        for task in (self._task, self._sync_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._sync_task = None
+        try:
+            await asyncio.to_thread(self.sync)
+        except Exception as e:
+            print(f"Room pool sync failed: {e}")
+            traceback.print_exc()
+
+    def stats(self) -> dict:
+        return {
+            "sizes": {key: len(entries) for key, entries in self._entries.items()},
+            "target_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+room_pool = RoomPool(ROOM_POOL_DB_PATH, ROOM_POOL_ROOM_TYPES, ROOM_POOL_STYLES, ROOM_POOL_SIZE, ROOM_POOL_MAX_USES)
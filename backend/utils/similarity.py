@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import traceback
+import numpy as np
+from PIL import Image, ImageOps
+from utils import repository
+from utils.blob_store import blob_store, BlobNotFound
+from utils.metrics import stage_seconds
+
+SIMILARITY_REFRESH_SECONDS = float(os.getenv("SIMILARITY_REFRESH_SECONDS", "30"))
+SIMILARITY_DUPLICATE_DISTANCE = int(os.getenv("SIMILARITY_DUPLICATE_DISTANCE", "6"))
+# pHash only sees structure, so the same shape in another colour also needs a close colour embedding
+SIMILARITY_DUPLICATE_MIN_COSINE = float(os.getenv("SIMILARITY_DUPLICATE_MIN_COSINE", "0.9"))
+SIMILARITY_SYNC_BATCH = int(os.getenv("SIMILARITY_SYNC_BATCH", "200"))
+
+# Bump when the feature layout below changes so stored vectors are recomputed
+FEATURE_VERSION = 1
+
+HUE_BINS = 12
+SATURATION_BINS = 2
+VALUE_BINS = 3
+GREY_BINS = 4  # black, dark grey, light grey, white
+COLOR_DIM = HUE_BINS * SATURATION_BINS * VALUE_BINS + GREY_BINS
+TEXTURE_DIM = 9  # 8 gradient orientations + edge density
+EMBEDDING_DIM = COLOR_DIM + TEXTURE_DIM
+COLOR_WEIGHT = 0.85
+TEXTURE_WEIGHT = 0.15
+# Below this saturation a pixel's hue is noise, so it counts as grey
+MIN_CHROMA = 0.2
+
+FEATURE_EDGE = 64
+PHASH_EDGE = 32
+
+# colour words (English and Vietnamese) -> (hue in degrees or None for grey, value 0..1, saturation 0..1)
+COLOR_WORDS = {
+    "black": (None, 0.05, 0), "đen": (None, 0.05, 0),
+    "grey": (None, 0.5, 0), "gray": (None, 0.5, 0), "xám": (None, 0.5, 0), "ghi": (None, 0.5, 0),
+    "white": (None, 0.95, 0), "trắng": (None, 0.95, 0),
+    "red": (0, 0.7, 0.8), "đỏ": (0, 0.7, 0.8),
+    "orange": (30, 0.8, 0.8), "cam": (30, 0.8, 0.8),
+    "brown": (25, 0.4, 0.6), "nâu": (25, 0.4, 0.6), "walnut": (25, 0.35, 0.6),
+    "beige": (40, 0.85, 0.3), "be": (40, 0.85, 0.3), "cream": (45, 0.9, 0.25), "kem": (45, 0.9, 0.25),
+    "oak": (35, 0.7, 0.45), "sồi": (35, 0.7, 0.45),
+    "yellow": (55, 0.85, 0.8), "vàng": (55, 0.85, 0.8), "gold": (45, 0.75, 0.7),
+    "green": (120, 0.6, 0.6), "lá": (120, 0.6, 0.6), "olive": (75, 0.45, 0.6),
+    "teal": (180, 0.5, 0.7), "navy": (225, 0.3, 0.8),
+    "blue": (220, 0.65, 0.7), "dương": (220, 0.65, 0.7),
+    "purple": (280, 0.5, 0.6), "tím": (280, 0.5, 0.6),
+    "pink": (330, 0.85, 0.45), "hồng": (330, 0.85, 0.45),
+}
+
+_DCT = None
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """64-bit DCT hash of a PHASH_EDGE x PHASH_EDGE greyscale image."""
+    global _DCT
+    if _DCT is None:
+        _DCT = _dct_matrix(PHASH_EDGE)
+    low = (_DCT @ gray @ _DCT.T)[:8, :8].flatten()
+    # The DC term only tracks overall brightness
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _color_bin(hue: float, saturation: float, value: float) -> int:
+    if saturation < MIN_CHROMA:
+        return HUE_BINS * SATURATION_BINS * VALUE_BINS + min(int(value * GREY_BINS), GREY_BINS - 1)
+    h = min(int(hue * HUE_BINS), HUE_BINS - 1)
+    s = min(int((saturation - MIN_CHROMA) / (1 - MIN_CHROMA) * SATURATION_BINS), SATURATION_BINS - 1)
+    v = min(int(value * VALUE_BINS), VALUE_BINS - 1)
+    return (h * SATURATION_BINS + s) * VALUE_BINS + v
+
+
+def color_histogram(hsv: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    hue, saturation, value = hsv[..., 0] / 255.0, hsv[..., 1] / 255.0, hsv[..., 2] / 255.0
+    h = np.minimum((hue * HUE_BINS).astype(int), HUE_BINS - 1)
+    s = np.clip(((saturation - MIN_CHROMA) / (1 - MIN_CHROMA) * SATURATION_BINS).astype(int), 0, SATURATION_BINS - 1)
+    v = np.minimum((value * VALUE_BINS).astype(int), VALUE_BINS - 1)
+    grey = HUE_BINS * SATURATION_BINS * VALUE_BINS + np.minimum((value * GREY_BINS).astype(int), GREY_BINS - 1)
+    bins = np.where(saturation < MIN_CHROMA, grey, (h * SATURATION_BINS + s) * VALUE_BINS + v)
+    histogram = np.bincount(bins.ravel(), weights=weights.ravel(), minlength=COLOR_DIM)
+    return histogram / max(histogram.sum(), 1e-9)
+
+
+def texture_histogram(gray: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy) * weights
+    orientation = ((np.arctan2(gy, gx) % np.pi) / np.pi * 8).astype(int) % 8
+    histogram = np.bincount(orientation.ravel(), weights=magnitude.ravel(), minlength=8)
+    total = histogram.sum()
+    density = magnitude.sum() / max(weights.sum(), 1e-9)
+    return np.append(histogram / max(total, 1e-9), min(density * 4, 1.0))
+
+
+def _embed(color: np.ndarray, texture: np.ndarray) -> np.ndarray:
+    # Square roots turn histogram overlap (Hellinger) into plain cosine similarity
+    vector = np.concatenate([np.sqrt(color) * COLOR_WEIGHT, np.sqrt(texture) * TEXTURE_WEIGHT]).astype(np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-9)
+
+
+def image_phash(data: bytes) -> int:
+    """Perceptual hash of an encoded photo; re-encoding, resizing or a small crop changes only a few bits."""
+    with stage_seconds.time(stage="perceptual_hash"):
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("L", (PHASH_EDGE * 4, PHASH_EDGE * 4))
+            img = ImageOps.exif_transpose(img).convert("L")
+        gray = np.asarray(img.resize((PHASH_EDGE, PHASH_EDGE), Image.Resampling.LANCZOS), dtype=np.float64)
+        return perceptual_hash(gray)
+
+
+def compute_features(data: bytes):
+    """Returns (embedding float32[EMBEDDING_DIM], 64-bit perceptual hash) for an encoded image.
+
+    Transparent pixels are ignored, so cut-out furniture is described by the object only.
+    """
+    with stage_seconds.time(stage="furniture_features"):
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", (FEATURE_EDGE * 4, FEATURE_EDGE * 4))
+            img = ImageOps.exif_transpose(img).convert("RGBA")
+        small = img.resize((FEATURE_EDGE, FEATURE_EDGE), Image.Resampling.BILINEAR)
+        weights = np.asarray(small.getchannel("A"), dtype=np.float64) / 255.0
+        if weights.sum() < 1:
+            weights = np.ones_like(weights)
+        rgb = small.convert("RGB")
+        hsv = np.asarray(rgb.convert("HSV"), dtype=np.float64)
+        gray = np.asarray(rgb.convert("L"), dtype=np.float64) / 255.0
+
+        embedding = _embed(color_histogram(hsv, weights), texture_histogram(gray, weights))
+        # Flatten onto white so whatever colour transparent pixels carry does not change the hash
+        flat = Image.alpha_composite(Image.new("RGBA", img.size, "white"), img).convert("L")
+        phash_gray = np.asarray(flat.resize((PHASH_EDGE, PHASH_EDGE), Image.Resampling.LANCZOS), dtype=np.float64)
+        return embedding, perceptual_hash(phash_gray)
+
+
+def features_key(image_hash: str) -> str:
+    return hashlib.sha256(f"{image_hash}:features:{FEATURE_VERSION}".encode("utf-8")).hexdigest()
+
+
+def store_features(image_hash: str, embedding: np.ndarray, phash: int):
+    out = io.BytesIO()
+    np.savez(out, embedding=embedding, phash=np.array([phash], dtype=np.uint64))
+    blob_store.put(features_key(image_hash), out.getvalue(), "application/octet-stream")
+
+
+def load_features(image_hash: str):
+    """Stored (embedding, phash) for an image, or None if they were never computed.
+
+    Uploads store them up front; older rows are filled in by scripts/backfill_furniture_features.
+    """
+    try:
+        with np.load(io.BytesIO(blob_store.get(features_key(image_hash)))) as stored:
+            return stored["embedding"], int(stored["phash"][0])
+    except BlobNotFound:
+        return None
+
+
+def hamming_distances(hashes: np.ndarray, phash: int) -> np.ndarray:
+    diff = np.bitwise_xor(hashes, np.uint64(phash))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def text_query(text: str):
+    """Returns (embedding of the query's colour words or None, all query words).
+
+    There is no learned text-image model here, so text search scores colour words against
+    the colour histogram and matches every word against furniture names.
+    """
+    tokens = tokenize(text)
+    histogram = np.zeros(COLOR_DIM)
+    for token in tokens:
+        color = COLOR_WORDS.get(token)
+        if color is None:
+            continue
+        hue, value, saturation = color
+        if hue is None:
+            histogram[_color_bin(0, 0, value)] += 1
+            continue
+        # A colour word names a hue but barely pins down shade, so spread over neighbouring
+        # hues and every saturation/value bin, favouring the typical shade
+        target_value = min(int(value * VALUE_BINS), VALUE_BINS - 1)
+        for offset, hue_weight in ((-15, 0.25), (0, 1.0), (15, 0.25)):
+            for s in (0.3, 0.8):
+                for v in range(VALUE_BINS):
+                    weight = hue_weight * (1.0 if v == target_value else 0.4) * (1.0 if abs(s - saturation) < 0.3 else 0.5)
+                    histogram[_color_bin(((hue + offset) % 360) / 360, s, (v + 0.5) / VALUE_BINS)] += weight
+    if not histogram.any():
+        return None, tokens
+    vector = np.concatenate([np.sqrt(histogram / histogram.sum()), np.zeros(TEXTURE_DIM)]).astype(np.float32)
+    return vector / float(np.linalg.norm(vector)), tokens
+
+
+class SimilarityIndex:
+    """In-memory matrix of furniture embeddings and perceptual hashes for vectorized top-k search.
+
+    Rows are appended as they are uploaded and picked up from other workers by syncing only
+    rows newer than the last one seen; deleted rows are masked out and compacted later.
+    `start` builds the index and keeps it synced in a background task, off the request path.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._refresh_lock = None
+        self._positions = {}
+        self._rows = []
+        self._tokens = []
+        self._sessions = np.zeros(0, dtype=object)
+        self._embeddings = np.zeros((0, dim), dtype=np.float32)
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._task = None
+        self.ready = False
+        self.missing_features = 0
+
+    def _grow(self, needed: int):
+        capacity = max(16, len(self._embeddings))
+        while capacity < needed:
+            capacity *= 2
+        if capacity == len(self._embeddings):
+            return
+        embeddings = np.zeros((capacity, self.dim), dtype=np.float32)
+        hashes = np.zeros(capacity, dtype=np.uint64)
+        alive = np.zeros(capacity, dtype=bool)
+        sessions = np.empty(capacity, dtype=object)
+        embeddings[:self._size] = self._embeddings[:self._size]
+        hashes[:self._size] = self._hashes[:self._size]
+        alive[:self._size] = self._alive[:self._size]
+        sessions[:self._size] = self._sessions[:self._size]
+        self._embeddings, self._hashes, self._alive, self._sessions = embeddings, hashes, alive, sessions
+
+    def add(self, row: dict, embedding: np.ndarray, phash: int):
+        """`row` carries id, session_id, description, created_at and image_hash."""
+        with self._lock:
+            position = self._positions.get(row["id"])
+            if position is None:
+                self._grow(self._size + 1)
+                position = self._size
+                self._size += 1
+                self._rows.append(row)
+                self._tokens.append(None)
+                self._positions[row["id"]] = position
+            self._rows[position] = row
+            self._tokens[position] = set(tokenize(row.get("description")))
+            self._sessions[position] = row.get("session_id")
+            self._embeddings[position] = embedding
+            self._hashes[position] = phash
+            self._alive[position] = True
+
+    def remove(self, row_id: str):
+        with self._lock:
+            position = self._positions.pop(row_id, None)
+            if position is None:
+                return
+            self._alive[position] = False
+            if len(self._positions) < self._size // 2:
+                self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        self._rows = [self._rows[position] for position in keep]
+        self._tokens = [self._tokens[position] for position in keep]
+        self._sessions[:len(keep)] = self._sessions[keep]
+        self._embeddings[:len(keep)] = self._embeddings[keep]
+        self._hashes[:len(keep)] = self._hashes[keep]
+        self._alive[:len(keep)] = True
+        self._alive[len(keep):] = False
+        self._size = len(keep)
+        self._positions = {row["id"]: position for position, row in enumerate(self._rows)}
+
+    def embedding_of(self, row_id: str):
+        with self._lock:
+            position = self._positions.get(row_id)
+            return None if position is None else self._embeddings[position].copy()
+
+    def _mask(self, session_id: str = None, exclude: str = None) -> np.ndarray:
+        mask = self._alive[:self._size].copy()
+        if session_id is not None:
+            mask &= self._sessions[:self._size] == session_id
+        if exclude is not None and exclude in self._positions:
+            mask[self._positions[exclude]] = False
+        return mask
+
+    def _top(self, scores: np.ndarray, limit: int) -> list:
+        candidates = np.flatnonzero(np.isfinite(scores))
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        ordered = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [{**self._rows[position], "score": round(float(scores[position]), 4)} for position in ordered]
+
+    def nearest(self, query: np.ndarray, limit: int, session_id: str = None, exclude: str = None, words: list = ()) -> list:
+        """Cosine top-k against `query` (if given) plus a bonus for name words; both vectorized over the index."""
+        with self._lock:
+            if not self._size:
+                return []
+            scores = np.zeros(self._size, dtype=np.float32)
+            if query is not None:
+                scores += self._embeddings[:self._size] @ query
+            if words:
+                matched = np.array(
+                    [len(tokens.intersection(words)) / len(words) for tokens in self._tokens], dtype=np.float32
+                )
+                scores += matched
+            scores[~self._mask(session_id, exclude) | (scores <= 0)] = -np.inf
+            return self._top(scores, limit)
+
+    def near_duplicates(self, embedding: np.ndarray, phash: int, session_id: str = None) -> list:
+        with self._lock:
+            if not self._size:
+                return []
+            distances = hamming_distances(self._hashes[:self._size], phash)
+            similar = self._embeddings[:self._size] @ embedding >= SIMILARITY_DUPLICATE_MIN_COSINE
+            hits = np.flatnonzero((distances <= SIMILARITY_DUPLICATE_DISTANCE) & similar & self._mask(session_id))
+            hits = hits[np.argsort(distances[hits], kind="stable")]
+            return [{"id": self._rows[position]["id"], "distance": int(distances[position])} for position in hits]
+
+    def _get_refresh_lock(self) -> asyncio.Lock:
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        return self._refresh_lock
+
+    async def refresh(self, force: bool = False):
+        """Indexes rows inserted since the last sync (by any worker); cheap when nothing changed.
+
+        Unless forced, returns straight away while another refresh (e.g. the initial build) is running.
+        """
+        if not force and time.monotonic() - self._refreshed_at < SIMILARITY_REFRESH_SECONDS:
+            return
+        if not force and self._get_refresh_lock().locked():
+            return
+        async with self._get_refresh_lock():
+            if not force and time.monotonic() - self._refreshed_at < SIMILARITY_REFRESH_SECONDS:
+                return
+            while True:
+                rows = await repository.furnitures.page_after(
+                    ("id", "session_id", "created_at", "description", "image_hash"), SIMILARITY_SYNC_BATCH, self._watermark
+                )
+                if not rows:
+                    break
+                await asyncio.to_thread(self._index_rows, rows)
+                self._watermark = (rows[-1]["created_at"], rows[-1]["id"])
+                if len(rows) < SIMILARITY_SYNC_BATCH:
+                    break
+            self._refreshed_at = time.monotonic()
+
+    def _index_rows(self, rows: list):
+        for row in rows:
+            if not row.get("image_hash"):
+                continue  # Still on the legacy base64 column; see scripts/migrate_images_to_blobs
+            try:
+                features = load_features(row["image_hash"])
+            except Exception as e:
+                print(f"Could not index furniture {row['id']}: {e}")
+                traceback.print_exc()
+                continue
+            if features is None:
+                # Uploaded before features were stored; run scripts/backfill_furniture_features
+                self.missing_features += 1
+                continue
+            self.add(row, *features)
+
+    async def _sync_forever(self):
+        while True:
+            try:
+                await self.refresh(force=True)
+                if not self.ready:
+                    self.ready = True
+                    if self.missing_features:
+                        print(f"{self.missing_features} furniture rows have no stored features; "
+                              "run scripts/backfill_furniture_features and restart to index them")
+            except Exception as e:
+                print(f"Furniture index sync failed: {e}")
+                traceback.print_exc()
+            await asyncio.sleep(SIMILARITY_REFRESH_SECONDS)
+
+    def start(self):
+        """Builds the index in the background, then picks up other workers' rows every SIMILARITY_REFRESH_SECONDS."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "indexed": len(self._positions),
+            "capacity": len(self._embeddings),
+            "missing_features": self.missing_features,
+        }
+
+
+furniture_index = SimilarityIndex(EMBEDDING_DIM)
@@ -0,0 +1,32 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight coroutine.
+
+    The shared call runs as its own task, so a caller that is cancelled (e.g. the client
+    disconnected) does not cancel the work the other waiters depend on.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Returns (result, shared) where `shared` is True if another caller started the call."""
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), False
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def __len__(self):
+        return len(self._in_flight)
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import traceback
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# Proxies such as nginx buffer responses unless told not to, which would hold back every event
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def relay(events: asyncio.Queue, task: asyncio.Future):
+    """Yields what is put on `events` while `task` runs, then whatever is left once it finishes.
+
+    Lets a stream forward progress from work that runs as its own task, e.g. a shared
+    single-flight call. The caller reads the task's result (or error) afterwards.
+    """
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                break
+            yield getter.result()
+        while not events.empty():
+            yield events.get_nowait()
+    finally:
+        if getter is not None and not getter.done():
+            getter.cancel()
+
+
+async def _guarded(events, label: str):
+    try:
+        async for event in events:
+            yield event
+    except HTTPException as e:
+        yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        print(f"Error in {label} stream: {e}")
+        traceback.print_exc()
+        yield sse_event("error", {"status": 500, "detail": "Internal Server Error"})
+
+
+def sse_response(events, label: str) -> StreamingResponse:
+    """Streams an async iterator of `sse_event` strings; failures after the response started become an `error` event."""
+    return StreamingResponse(_guarded(events, label), media_type="text/event-stream", headers=SSE_HEADERS)
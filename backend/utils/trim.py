@@ -0,0 +1,147 @@
+import hashlib
+import io
+import os
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+from utils.blob_store import blob_store, BlobNotFound
+from utils.metrics import registry, Counter, stage_seconds
+
+TRIM_ENABLED = os.getenv("TRIM_ENABLED", "true").lower() == "true"
+TRIM_TOLERANCE = int(os.getenv("TRIM_TOLERANCE", "16"))
+TRIM_ALPHA_THRESHOLD = int(os.getenv("TRIM_ALPHA_THRESHOLD", "8"))
+TRIM_UNIFORM_BORDER = float(os.getenv("TRIM_UNIFORM_BORDER", "0.9"))
+TRIM_PADDING = float(os.getenv("TRIM_PADDING", "0.04"))
+TRIM_MIN_SAVING = float(os.getenv("TRIM_MIN_SAVING", "0.1"))
+
+# Bump when the trimming rules change so earlier trims are not reused
+TRIM_VERSION = 1
+
+ENCODE_FORMATS = {"JPEG": ("JPEG", "image/jpeg"), "WEBP": ("WEBP", "image/webp")}
+
+furniture_trims = registry.register(Counter(
+    "ati_furniture_trim_total", "Furniture images checked for trimming, by outcome (trimmed, kept).", ("outcome",)
+))
+
+
+def trimmed_key(image_hash: str) -> str:
+    return hashlib.sha256(f"{image_hash}:trimmed:{TRIM_VERSION}".encode("utf-8")).hexdigest()
+
+
+def background_mask(rgba: np.ndarray):
+    """True where a pixel is background: transparent, or close to a uniform border colour.
+
+    Returns None when the image has neither, e.g. a product shot in a furnished room.
+    """
+    alpha = rgba[..., 3]
+    border = np.concatenate([rgba[0], rgba[-1], rgba[1:-1, 0], rgba[1:-1, -1]])
+
+    if (border[:, 3] <= TRIM_ALPHA_THRESHOLD).mean() >= TRIM_UNIFORM_BORDER:
+        return alpha <= TRIM_ALPHA_THRESHOLD
+
+    background = np.median(border[:, :3], axis=0)
+    # Per-channel bounds keep the comparison in uint8 instead of widening the whole image
+    low = np.clip(background - TRIM_TOLERANCE, 0, 255).astype(np.uint8)
+    high = np.clip(background + TRIM_TOLERANCE, 0, 255).astype(np.uint8)
+    border_close = ((border[:, :3] >= low) & (border[:, :3] <= high)).all(axis=1)
+    if border_close.mean() < TRIM_UNIFORM_BORDER:
+        return None
+    # One 2-D plane at a time: several times faster than broadcasting over the (h, w, 3) view
+    close = alpha <= TRIM_ALPHA_THRESHOLD
+    matches = np.ones(alpha.shape, dtype=bool)
+    for channel in range(3):
+        plane = rgba[..., channel]
+        matches &= (plane >= low[channel]) & (plane <= high[channel])
+    return close | matches
+
+
+def object_box(rgba: np.ndarray):
+    """(left, top, right, bottom) of the object with TRIM_PADDING around it, or None to keep the image as is."""
+    mask = background_mask(rgba)
+    if mask is None:
+        return None
+    height, width = mask.shape
+    foreground = ~mask
+    # Ignore rows/columns with only a few stray pixels (JPEG ringing, dust on a white sweep)
+    rows = np.flatnonzero(foreground.sum(axis=1) > max(1, width // 500))
+    cols = np.flatnonzero(foreground.sum(axis=0) > max(1, height // 500))
+    if not len(rows) or not len(cols):
+        return None
+
+    pad = int(round(TRIM_PADDING * max(rows[-1] - rows[0], cols[-1] - cols[0])))
+    box = (
+        max(0, cols[0] - pad),
+        max(0, rows[0] - pad),
+        min(width, cols[-1] + 1 + pad),
+        min(height, rows[-1] + 1 + pad),
+    )
+    if (box[2] - box[0]) * (box[3] - box[1]) > (1 - TRIM_MIN_SAVING) * width * height:
+        return None
+    return box
+
+
+def trim_image(data: bytes):
+    """Crops a furniture photo to the object on its plain or transparent background.
+
+    Returns (bytes, mime_type) for the cropped image, or None when there is no uniform
+    background or trimming would save less than TRIM_MIN_SAVING of the area.
+    """
+    with stage_seconds.time(stage="furniture_trim"):
+        with Image.open(io.BytesIO(data)) as img:
+            source_format = img.format
+            img = ImageOps.exif_transpose(img)
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            rgba = img.convert("RGBA")
+
+        box = object_box(np.asarray(rgba))
+        if box is None:
+            furniture_trims.inc(outcome="kept")
+            return None
+
+        cropped = rgba.crop(box)
+        fmt, mime_type = ENCODE_FORMATS.get(source_format, ("PNG", "image/png"))
+        out = io.BytesIO()
+        if has_alpha and fmt != "WEBP":
+            cropped.save(out, format="PNG", optimize=True)
+            mime_type = "image/png"
+        elif fmt == "PNG":
+            cropped.convert("RGB").save(out, format="PNG", optimize=True)
+        else:
+            (cropped if has_alpha else cropped.convert("RGB")).save(out, format=fmt, quality=92)
+        furniture_trims.inc(outcome="trimmed")
+        return out.getvalue(), mime_type
+
+
+def store_trimmed(image_hash: str, data: bytes) -> bool:
+    """Trims an uploaded furniture image and stores the result next to the original; returns whether it did."""
+    if not TRIM_ENABLED:
+        return False
+    try:
+        trimmed = trim_image(data)
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Trimming skipped for {image_hash}: {e}")
+        return False
+    if trimmed is None:
+        return False
+    blob_store.put(trimmed_key(image_hash), *trimmed)
+    return True
+
+
+def trimmed_or_original(data: bytes) -> bytes:
+    """Trimmed bytes for an image that is not stored (e.g. uploaded with a placement request)."""
+    if not TRIM_ENABLED:
+        return data
+    try:
+        trimmed = trim_image(data)
+    except (UnidentifiedImageError, OSError):
+        return data
+    return trimmed[0] if trimmed else data
+
+
+def load_trimmed(image_hash: str):
+    """The stored trimmed copy of an image, or None if it was not worth trimming."""
+    if not TRIM_ENABLED or not image_hash:
+        return None
+    try:
+        return blob_store.get(trimmed_key(image_hash))
+    except BlobNotFound:
+        return None
@@ -0,0 +1,162 @@
+import os
+from fastapi import HTTPException, UploadFile
+from utils.metrics import stage_seconds
+
+MAX_IMAGE_SIZE_MB = float(os.getenv("MAX_IMAGE_SIZE_MB", "10"))
+MAX_REQUEST_UPLOAD_MB = float(os.getenv("MAX_REQUEST_UPLOAD_MB", "40"))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+MAX_IMAGE_BYTES = int(MAX_IMAGE_SIZE_MB * 1024 * 1024)
+MAX_REQUEST_UPLOAD_BYTES = int(MAX_REQUEST_UPLOAD_MB * 1024 * 1024)
+
+IMAGE_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+def sniff_image_type(head: bytes):
+    """Returns the MIME type implied by the file's magic bytes, or None if it is not a known image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+        if brand in HEIF_BRANDS:
+            return "image/heic" if brand.startswith(b"he") else "image/heif"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+class UploadBudget:
+    """Total bytes all files in one request may use together."""
+
+    def __init__(self, max_bytes: int = MAX_REQUEST_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def consume(self, size: int):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Uploads exceed the {self.max_bytes // (1024 * 1024)}MB per-request limit",
+            )
+
+
+async def read_image_upload(
+    upload: UploadFile,
+    allowed_mime_types: set = IMAGE_MIME_TYPES,
+    max_bytes: int = MAX_IMAGE_BYTES,
+    budget: UploadBudget = None,
+    field: str = "image",
+):
+    """Reads an uploaded image in chunks, stopping as soon as a size cap is crossed.
+
+    The type is taken from the file's magic bytes rather than the client's content_type.
+    Chunking only bounds how much is read; the accepted image is returned whole, in memory.
+    Returns (bytes, mime_type).
+    """
+    with stage_seconds.time(stage="upload_read"):
+        return await _read_image_upload(upload, allowed_mime_types, max_bytes, budget, field)
+
+
+async def _read_image_upload(upload: UploadFile, allowed_mime_types: set, max_bytes: int, budget: UploadBudget, field: str):
+    chunks = []
+    size = 0
+    mime_type = None
+
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        if mime_type is None:
+            mime_type = sniff_image_type(chunk[:32])
+            if mime_type not in allowed_mime_types:
+                raise HTTPException(status_code=400, detail=f"Unsupported file type for {field}: {mime_type or 'unrecognized image data'}")
+
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=400, detail=f"Image exceeds {max_bytes // (1024 * 1024)}MB size limit for {field}")
+        if budget is not None:
+            budget.consume(len(chunk))
+        chunks.append(chunk)
+
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail=f"Empty file for {field}")
+
+    return b"".join(chunks), mime_type
+
+
+class BodySizeLimitMiddleware:
+    """Rejects request bodies over `max_body_bytes` with 413.
+
+    A declared Content-Length over the limit is refused without reading the body. Chunked bodies
+    are counted as they arrive; once they cross the limit the middleware sends the 413 itself,
+    hands the app a disconnect so it stops reading, and drops whatever the app tries to send.
+    """
+
+    def __init__(self, app, max_body_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > self.max_body_bytes:
+                    return await self._reject(send)
+                break
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    rejected = True
+                    if not response_started:
+                        await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The app failing on the cut-off body is expected; the 413 is already sent
+            if not rejected:
+                raise
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -107,12 +107,22 @@ function FurniturePlacement({ isDarkMode }) {
     }
   };
 
-  const handleUserRoomSelect = (room) => {
+  const handleUserRoomSelect = async (room) => {
     setSelectedUserRoomId(room.id);
     setSelectedDesignId(null);
-    setSelectedRoomImage(room.image);
+    setSelectedRoomImage(null);
+
+    try {
+      const res = await axios.get(`http://127.0.0.1:8000/api/design/${room.id}/image`);
+      setSelectedRoomImage(res.data.image);
+    } catch {
+      toast.error("Failed to load room image");
+    }
   };
 
+  const thumbnailSrc = (item) =>
+    item.thumbnail_url ? `http://127.0.0.1:8000${item.thumbnail_url}` : undefined;
+
   const handleRoomUpload = async () => {
     if (!pendingRoomFile) return toast.error("Select a room image");
     const form = new FormData();
@@ -281,7 +291,7 @@ function FurniturePlacement({ isDarkMode }) {
                               border: selectedUserRoomId === room.id ? "2px solid blue" : "1px solid gray",
                             }}
                           >
-                            <img src={room.image} style={{ width: "100%", borderRadius: 8 }} />
+                            <img src={thumbnailSrc(room)} loading="lazy" style={{ width: "100%", borderRadius: 8 }} />
                           </Card>
                         </Col>
                       ))}
@@ -327,7 +337,7 @@ function FurniturePlacement({ isDarkMode }) {
                           onClick={() => setSelectedLibraryFurniture(f)}
                           style={{ border: selectedLibraryFurniture?.id === f.id ? "2px solid blue" : "1px solid gray" }}
                         >
-                          <img src={f.image} style={{ width: "100%", borderRadius: 8 }} />
+                          <img src={thumbnailSrc(f)} loading="lazy" style={{ width: "100%", borderRadius: 8 }} />
                         </Card>
                       </Col>
                     ))}
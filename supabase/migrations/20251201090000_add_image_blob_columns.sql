@@ -0,0 +1,37 @@
+/*
+  # Move image payloads out of text columns into the content-addressed blob store
+
+  1. Modified Tables
+    - `room_designs`
+      - `image_hash` (text) - SHA-256 hex digest of the image; key in the blob store
+      - `image_mime_type` (text) - MIME type sniffed from the image bytes
+      - `image_width` (integer) - Image width in pixels
+      - `image_height` (integer) - Image height in pixels
+      - `generated_image_data` is now nullable; rows written after this migration leave it empty
+    - `furnitures`
+      - Same four columns; `image_base64` is now nullable
+
+  2. Storage
+    - `images` bucket for the Supabase Storage blob backend (BLOB_STORE_BACKEND=supabase)
+
+  3. Notes
+    - Existing rows are moved over by `backend/scripts/migrate_images_to_blobs.py`
+*/
+
+ALTER TABLE room_designs ADD COLUMN IF NOT EXISTS image_hash text;
+ALTER TABLE room_designs ADD COLUMN IF NOT EXISTS image_mime_type text;
+ALTER TABLE room_designs ADD COLUMN IF NOT EXISTS image_width integer;
+ALTER TABLE room_designs ADD COLUMN IF NOT EXISTS image_height integer;
+ALTER TABLE room_designs ALTER COLUMN generated_image_data DROP NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_room_designs_image_hash ON room_designs(image_hash);
+
+ALTER TABLE IF EXISTS furnitures ADD COLUMN IF NOT EXISTS image_hash text;
+ALTER TABLE IF EXISTS furnitures ADD COLUMN IF NOT EXISTS image_mime_type text;
+ALTER TABLE IF EXISTS furnitures ADD COLUMN IF NOT EXISTS image_width integer;
+ALTER TABLE IF EXISTS furnitures ADD COLUMN IF NOT EXISTS image_height integer;
+ALTER TABLE IF EXISTS furnitures ALTER COLUMN image_base64 DROP NOT NULL;
+
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('images', 'images', false)
+ON CONFLICT (id) DO NOTHING;
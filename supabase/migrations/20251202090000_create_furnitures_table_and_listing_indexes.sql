@@ -0,0 +1,69 @@
+/*
+  # Create furnitures table and keyset-pagination indexes
+
+  1. New Tables
+    - `furnitures`
+      - `id` (uuid, primary key) - Unique identifier for each furniture item
+      - `session_id` (text) - Session identifier to group items by user
+      - `description` (text) - User-provided name/description
+      - `image_base64` (text) - Legacy base64 image data; empty for rows stored in the blob store
+      - `image_hash` (text) - SHA-256 hex digest of the image; key in the blob store
+      - `image_mime_type` (text) - MIME type sniffed from the image bytes
+      - `image_width` (integer) - Image width in pixels
+      - `image_height` (integer) - Image height in pixels
+      - `created_at` (timestamptz) - Timestamp of when the item was uploaded
+
+  2. Indexes
+    - Listing endpoints page on `(created_at, id)` newest first, optionally filtered by
+      `session_id`. The composite indexes below match that ordering so each page is a
+      bounded index range scan.
+
+  3. Security
+    - Enable RLS on `furnitures` table
+    - Allow anyone to insert, read and delete furniture (no auth required for testing)
+*/
+
+CREATE TABLE IF NOT EXISTS furnitures (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  session_id text NOT NULL,
+  description text,
+  image_base64 text,
+  image_hash text,
+  image_mime_type text,
+  image_width integer,
+  image_height integer,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE furnitures ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Anyone can insert furnitures" ON furnitures;
+CREATE POLICY "Anyone can insert furnitures"
+  ON furnitures
+  FOR INSERT
+  TO anon
+  WITH CHECK (true);
+
+DROP POLICY IF EXISTS "Anyone can read furnitures" ON furnitures;
+CREATE POLICY "Anyone can read furnitures"
+  ON furnitures
+  FOR SELECT
+  TO anon
+  USING (true);
+
+DROP POLICY IF EXISTS "Anyone can delete furnitures" ON furnitures;
+CREATE POLICY "Anyone can delete furnitures"
+  ON furnitures
+  FOR DELETE
+  TO anon
+  USING (true);
+
+CREATE INDEX IF NOT EXISTS idx_furnitures_session_created_id
+  ON furnitures(session_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_furnitures_created_id
+  ON furnitures(created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_room_designs_session_created_id
+  ON room_designs(session_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_room_designs_created_id
+  ON room_designs(created_at DESC, id DESC);